@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+#
+# Filename: bidir_matrix.py
+# Description: Build bidir region count matrices from queries
+# Authors: Lynn Sanford <lynn.sanford@colorado.edu>
+#
+
+# Commentary:
+#
+# This file contains code for assembling the counts over the
+# tfit or dREG master merge regions of one genome, for the
+# samples returned by a query, into one regions x samples count
+# matrix plus a colData table of the query fields. Every count
+# file is checked against the master merge region BED, so rows
+# are always in master merge order.
+#
+# Parameters:
+#
+# Genome build (hg38 or mm10), bidir caller (tfit or dreg), and
+# one or more YAML/JSON query spec files (see dbquery.py). For
+# each query, <outfile base>_<genome>_<caller>_counts.tsv.gz,
+# _coldata.tsv and the memory-mapped _counts.npy are written.
+#
+
+# Code:
+
+# Import
+import sys, os
+sys.path.append(os.path.join(os.path.dirname(__file__), '.', 'global_files'))
+import dbexport
+import dbmatrix
+import dbquery
+import dbsearch
+import dbutils
+
+if len(sys.argv) < 4:
+    sys.exit("Usage: bidir_matrix.py <genome> <tfit|dreg> "
+             "<query spec file> [...]")
+genome = sys.argv[1]
+caller = sys.argv[2]
+query_specs = []
+for spec_path in sys.argv[3:]:
+    query_specs.extend(dbquery.load_query_specs(spec_path))
+
+# Load config file and connect to db
+config = dbutils.load_config(
+    "/home/lsanford/DBNascent-build/config/config_query.txt")
+files = config["file_locations"]
+dbconnect = dbutils.dbnascentConnection(files["database"], files["credentials"])
+
+regions_path = files[genome + "_" + caller + "_master_regions"]
+pattern = files.get("bidir_counts", dbmatrix.DEFAULT_BIDIR_COUNTS)
+workers = int(os.environ.get("SLURM_CPUS_ON_NODE", 4))
+use_wide = dbquery.sample_wide_current(dbconnect)
+resolver = dbsearch.SearchResolver.from_db(dbconnect)
+
+### Build a matrix for each query
+for spec in query_specs:
+    summary = dbmatrix.build_bidir_matrix(
+        dbconnect,
+        spec,
+        dbexport.output_base(spec["outfile"]) + "_" + genome + "_" + caller,
+        files["db_data"],
+        genome,
+        caller,
+        regions_path,
+        pattern,
+        workers,
+        use_wide,
+        resolver,
+    )
+    print(spec["outfile"] + ": " + str(summary["features"]) + " regions x "
+          + str(summary["samples"]) + " samples")
+    if summary["missing"]:
+        print("No count file for: " + ", ".join(summary["missing"]))
+
+# bidir_matrix.py ends here
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+#
+# Filename: count_matrix.py
+# Description: Build gene count matrices for DESeq2 from queries
+# Authors: Lynn Sanford <lynn.sanford@colorado.edu>
+#
+
+# Commentary:
+#
+# This file contains code for assembling the featureCounts gene
+# counts of the samples returned by a query into one count
+# matrix, plus a colData table of the query fields, ready for
+# DESeq2. Only samples with gene counts available are used.
+#
+# Parameters:
+#
+# One or more YAML/JSON query spec files (see dbquery.py). For
+# each query, <outfile base>_counts.tsv.gz, <outfile base>_coldata.tsv
+# and the memory-mapped <outfile base>_counts.npy are written.
+#
+
+# Code:
+
+# Import
+import sys, os
+sys.path.append(os.path.join(os.path.dirname(__file__), '.', 'global_files'))
+import dbexport
+import dbmatrix
+import dbquery
+import dbsearch
+import dbutils
+
+if len(sys.argv) < 2:
+    sys.exit("Usage: count_matrix.py <query spec file> [...]")
+query_specs = []
+for spec_path in sys.argv[1:]:
+    query_specs.extend(dbquery.load_query_specs(spec_path))
+
+# Load config file and connect to db
+config = dbutils.load_config(
+    "/home/lsanford/DBNascent-build/config/config_query.txt")
+files = config["file_locations"]
+dbconnect = dbutils.dbnascentConnection(files["database"], files["credentials"])
+
+pattern = files.get("gene_counts", dbmatrix.DEFAULT_GENE_COUNTS)
+workers = int(os.environ.get("SLURM_CPUS_ON_NODE", 4))
+use_wide = dbquery.sample_wide_current(dbconnect)
+resolver = dbsearch.SearchResolver.from_db(dbconnect)
+
+### Build a matrix for each query
+for spec in query_specs:
+    summary = dbmatrix.build_gene_matrix(
+        dbconnect,
+        spec,
+        dbexport.output_base(spec["outfile"]),
+        files["db_data"],
+        pattern,
+        workers,
+        use_wide,
+        resolver,
+    )
+    print(spec["outfile"] + ": " + str(summary["features"]) + " genes x "
+          + str(summary["samples"]) + " samples")
+    if summary["missing"]:
+        print("No count file for: " + ", ".join(summary["missing"]))
+
+# count_matrix.py ends here
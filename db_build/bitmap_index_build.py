@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+#
+# Filename: bitmap_index_build.py
+# Description: Build the sample flag/score bitmap index
+# Authors: Lynn Sanford <lynn.sanford@colorado.edu>
+#
+
+# Commentary:
+#
+# This file contains code for rebuilding the bitmap index of
+# sample flags and scores used for fast cohort selection (see
+# dbbitmap.py). It should be run at the end of every build;
+# paper ingests patch the index for their own samples.
+#
+
+# Code:
+
+# Import
+import sys, os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'global_files'))
+import dbbitmap
+import dbutils
+
+# Load config file
+config = dbutils.load_config(
+    "/home/lsanford/DBNascent-build/config/config_build.txt"
+)
+
+# Create database connection object
+db_url = config["file_locations"]["database"]
+creds = config["file_locations"]["credentials"]
+dbconnect = dbutils.dbnascentConnection(db_url, creds)
+
+# Build bitmaps of all samples and replace the saved index
+index = dbbitmap.BitmapIndex.build(dbconnect)
+index.save(config["file_locations"]["bitmap_index"])
+print("Bitmap index samples: " + str(len(index.sample_ids)))
+
+# bitmap_index_build.py ends here
@@ -32,16 +32,23 @@ creds = config["file_locations"]["credentials"]
 
 dbconnect = dbutils.dbnascentConnection(db_url, creds)
 
-# Back up entire database
+# Back up entire database from one consistent snapshot,
+# dumping tables in parallel over one connection per core
+# Incremental backups only store table blocks that changed since
+# earlier backups (prune old ones with db_backup_prune.py)
 backupdir = config["file_locations"]["backup_dir"]
+workers = int(os.environ.get("SLURM_CPUS_ON_NODE", 1))
 dbconnect.backup(
     backupdir, tables = [
         "organisms", "searchEquiv", "tissues", "archive",
         "papers", "samples", "sampleEquiv", "genetics",
         "bidirs", "conditions", "conditionLink",
         "bidirflowRuns", "nascentflowRuns",
-        "bidirflowLink", "nascentflowLink", "linkIDs"
-    ]
+        "bidirflowLink", "nascentflowLink", "linkIDs",
+        "dbVersion"
+    ],
+    workers = workers,
+    incremental = True,
 )
 
 # Delete tables
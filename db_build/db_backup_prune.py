@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+#
+# Filename: db_backup_prune.py
+# Description: Apply backup retention and compact the block store
+# Authors: Lynn Sanford <lynn.sanford@colorado.edu>
+#
+
+# Commentary:
+#
+# This file contains code for deleting old DBNascent backups
+# and removing blocks from the incremental backup block store
+# that are no longer referenced by any remaining backup
+#
+
+# Code:
+
+# Import
+import sys, os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'global_files'))
+import dbbackup
+import dbutils
+
+# User input
+keep_backups = 10
+
+# Load config file
+config = dbutils.load_config(
+    "/home/lsanford/DBNascent-build/config/config_build.txt"
+)
+
+# Delete old backups and unreferenced blocks
+backupdir = config["file_locations"]["backup_dir"]
+pruned = dbbackup.prune_backups(backupdir, keep_backups)
+
+print("Deleted backups: " + ", ".join(pruned["backups"]))
+print("Deleted unfinished backups: " + ", ".join(pruned["stale"]))
+print("Deleted blocks: " + str(pruned["blocks"]))
+
+# db_backup_prune.py ends here
@@ -30,6 +30,9 @@ files = config["file_locations"]
 dbconnect = dbutils.dbnascentConnection(files["database"], files["credentials"])
 dbconnect.add_tables()
 
+# Add ORM indexes that existing tables do not have yet
+dbconnect.add_indexes()
+
 # Back up entire database
 #backupdir = config["file_locations"]["backup_dir"]
 #dbconnect.backup(backupdir, False)
@@ -106,4 +109,23 @@ if len(archive_to_add) > 0:
         archive_to_add
     )
 
+# Parse master merge lists once into the mergeMembership table,
+# so each paper ingest only looks up its own paper
+merge_files = {}
+for genome in ["hg38", "mm10"]:
+    for caller in ["tfit", "dreg"]:
+        merge_files[(genome, caller)] = (
+            files[genome + "_" + caller + "_master_merge"]
+        )
+merge_rows = dbutils.merge_membership_rows(merge_files)
+dbutils.sync_rows(
+    dbconnect,
+    "mergeMembership",
+    ["paper_name", "genome", "caller"],
+    merge_rows,
+)
+
+# Bump database version so cached query results are refreshed
+dbconnect.bump_version("global tables")
+
 # db_global_add_update.py ends here
@@ -28,6 +28,8 @@
 # Step 8: Add condition info to database
 # Step 9: Add nascentflow/bidirflow version data
 # Step 10: Make match tables
+# Step 11: Recount facet values for this paper
+# Step 12: Patch bitmap index for this paper's samples
 
 # Code:
 
@@ -37,6 +39,8 @@ import re
 import sys, os
 #sys.path.append(os.path.join(os.getcwd(), '..', 'global_files'))
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'global_files'))
+import dbbitmap
+import dbfacets
 import dborm
 import dbutils
 
@@ -115,7 +119,7 @@ sampmeta.key_replace(genetics_keys["in"], genetics_keys["match"])
 
 # Parse organisms from db tables and add ids
 # Replace the 'organism' field with the correct database organism_id
-org_dump = dbconnect.reflect_table("organisms")
+org_dump = dbconnect.reflect_table("organisms", columns=["id", "organism"])
 org_dump = dbutils.format_for_db_add(dbconnect,org_dump)
 sampmeta.data = dbutils.format_for_db_add(dbconnect,sampmeta.data)
 sampmeta = dbutils.bulk_key_store_compare(
@@ -137,7 +141,10 @@ tissuetype_path = files["tissue_table"]
 # These keys are a little different than the others in that the "db" keys
 # are actually the keys from the external tissue table and the "match" keys
 # are the keys that are stored in the database
-tissues_dump = dbconnect.reflect_table("tissues")
+tissues_dump = dbconnect.reflect_table(
+    "tissues",
+    columns=tissues_keys["match"] + ["id"],
+)
 tissues_dump = dbutils.format_for_db_add(dbconnect,tissues_dump)
 tissues = dbutils.Metatable(tissuetype_path)
 tissues.key_replace(tissues_keys["in"], tissues_keys["match"])
@@ -164,37 +171,14 @@ sampmeta = dbutils.bulk_key_store_compare(
 
 ### Step 4: Add bidir summary data, if present ###
 
-tfit_path = data_path + str(paper_id) + "/bidir_summary/tfit_stats.txt"
-dreg_path = data_path + str(paper_id) + "/bidir_summary/dreg_stats.txt"
-
-# Read in master merge list files and make paper_id lists
-# for tfit and dreg separately
-dreg_merge_files = [
-    files["hg38_tfit_master_merge"],
-    files["mm10_tfit_master_merge"],
-]
-tfit_merge_files = [
-    files["hg38_dreg_master_merge"],
-    files["mm10_dreg_master_merge"],
-]
-dreg_merge_ids = dbutils.merge_list_accum(dreg_merge_files)
-tfit_merge_ids = dbutils.merge_list_accum(tfit_merge_files)
-
-# Add bidir data, if available, otherwise add nulls
-sampmeta = dbutils.add_bidir_info(
-    sampmeta,
-    tfit_path,
-    "tfit",
-    tfit_merge_ids,
-    bidirs_keys["db"],
-)
-sampmeta = dbutils.add_bidir_info(
-    sampmeta,
-    dreg_path,
-    "dreg",
-    dreg_merge_ids,
-    bidirs_keys["db"],
-)
+# Look up master merge inclusion for tfit and dreg separately
+# (parsed from the merge lists by db_global_add_update.py)
+merge_ids = dbutils.merge_membership(dbconnect, paper_id)
+
+# Add tfit and dreg summary data in one pass over the samples,
+# if available, otherwise add nulls
+bidir_summary = dbutils.BidirSummary.load(data_path, paper_id)
+sampmeta = bidir_summary.attach(sampmeta, merge_ids, bidirs_keys["db"])
 
 bidirs_unique = sampmeta.unique(bidirs_keys["db"])
 
@@ -299,25 +283,25 @@ dbconnect = dbutils.dbnascentConnection(
 equiv_keys = ["sample_id", "srr"]
 link_keys = ["sample_id", "paper_id", "genetic_id", "bidir_id"]
 
-# Scrape tables
+# Scrape id and comparison columns from tables
 samples_dump = dbutils.format_for_db_add(
     dbconnect,
-    dbconnect.reflect_table("samples"),
+    dbconnect.reflect_table("samples", columns=samples_keys["db"] + ["id"]),
 )
 
 papers_dump = dbutils.format_for_db_add(
     dbconnect,
-    dbconnect.reflect_table("papers"),
+    dbconnect.reflect_table("papers", columns=papers_keys["match"] + ["id"]),
 )
 
 genetics_dump = dbutils.format_for_db_add(
     dbconnect,
-    dbconnect.reflect_table("genetics"),
+    dbconnect.reflect_table("genetics", columns=genetics_keys["db"] + ["id"]),
 )
 
 bidirs_dump = dbutils.format_for_db_add(
     dbconnect,
-    dbconnect.reflect_table("bidirs"),
+    dbconnect.reflect_table("bidirs", columns=bidirs_keys["db"] + ["id"]),
 )
 
 # Link ids
@@ -396,15 +380,11 @@ if len(link_to_add) > 0:
 # Extract condition data
 sampmeta.key_replace(conditions_keys["in"], conditions_keys["match"])
 
-# Parse metadata strings and store values with db keys
-cond_table = dbutils.condition_processing(sampmeta.data)
-for cond in cond_table:
-    for key in cond.keys():
-        cond[key] = str(cond[key])
-
-# Extract unique conditions and store integer blanks correctly
-conds = dbutils.Metatable(cond_table)
-conds_unique = conds.unique(conditions_keys["db"])
+# Parse metadata strings into (sample_id, condition) pairs;
+# identical conditions are the same object, so dedupe directly
+sample_conds = dbutils.parse_conditions(sampmeta.data)
+conditions = list(dict.fromkeys(cond for sample_id, cond in sample_conds))
+conds_unique = [cond._asdict() for cond in conditions]
 
 # If not present, add condition metadata to database
 cond_to_add = dbutils.entry_update(
@@ -462,21 +442,54 @@ bflink_keys = dbutils.load_keys(config,"bidirflow")
 bflink_keys["db"] = ["sample_id","bidirflow_id"]
 
 # Grab condition and version id info from database
-cond_dump = dbconnect.reflect_table("conditions")
+cond_dump = dbconnect.reflect_table(
+    "conditions", columns=condlink_keys["match"] + ["id"]
+)
 cond_dump = dbutils.format_for_db_add(dbconnect,cond_dump)
-nf_dump = dbconnect.reflect_table("nascentflowRuns")
+cond_ids = dbutils.key_id_map(cond_dump, condlink_keys["match"])
+nf_dump = dbconnect.reflect_table(
+    "nascentflowRuns", columns=nflink_keys["match"] + ["id"]
+)
 nf_dump = dbutils.format_for_db_add(dbconnect,nf_dump)
-bf_dump = dbconnect.reflect_table("bidirflowRuns")
+bf_dump = dbconnect.reflect_table(
+    "bidirflowRuns", columns=bflink_keys["match"] + ["id"]
+)
 bf_dump = dbutils.format_for_db_add(dbconnect,bf_dump)
 
-conds.data = dbutils.format_for_db_add(dbconnect,conds.data)
-conds = dbutils.bulk_key_store_compare(
-    conds,
-    cond_dump,
-    condlink_keys["match"],
-    ["id"],
-    ["condition_id"],
+# Look up each distinct condition's id once, formatted as in the dump
+cond_rows = dbutils.format_for_db_add(
+    dbconnect, [cond._asdict() for cond in conditions]
 )
+cond_id = {}
+for cond, cond_row in zip(conditions, cond_rows):
+    cond_key = tuple(
+        "" if cond_row[key] is None else str(cond_row[key])
+        for key in condlink_keys["match"]
+    )
+    if cond_key in cond_ids:
+        cond_id[cond] = cond_ids[cond_key]
+
+# Every condition was added in step 8, so a miss is a bug
+sample_rows = {
+    sample["sample_id"]: (row, sample)
+    for row, sample in enumerate(sampmeta.data, start=1)
+}
+missing = []
+for sample_id, cond in sample_conds:
+    if cond not in cond_id:
+        row, sample = sample_rows[sample_id]
+        missing.append(
+            "row " + str(row) + " (" + str(sample.get("sample_name"))
+            + ", " + str(sample.get("paper_name")) + "): " + str(cond)
+        )
+if missing:
+    raise KeyError(
+        "Conditions not found in database:\n" + "\n".join(missing)
+    )
+conds = dbutils.Metatable([
+    {"sample_id": sample_id, "condition_id": cond_id[cond]}
+    for sample_id, cond in sample_conds
+])
 nf_vers.data = dbutils.format_for_db_add(dbconnect,nf_vers.data)
 nf_vers = dbutils.bulk_key_store_compare(
     nf_vers,
@@ -518,4 +531,30 @@ sampbf_to_add = dbutils.entry_update(
 if len(sampbf_to_add) > 0:
     dbconnect.engine.execute(dborm.bidirflowLink.__table__.insert(), sampbf_to_add)
 
+
+### Step 11: Recount facet values for this paper ###
+
+dbfacets.refresh_facets(
+    dbconnect, dbfacets.paper_ids(dbconnect, [paper_id])
+)
+
+# Bump database version so cached query results are refreshed
+dbconnect.bump_version("paper " + paper_id)
+
+
+### Step 12: Patch bitmap index for this paper's samples ###
+
+bitmap_path = files.get("bitmap_index")
+if bitmap_path and exists(bitmap_path):
+    paper_samples = dbconnect.reflect_table(
+        "linkIDs",
+        filter_crit={"paper_id": dbfacets.paper_ids(dbconnect, [paper_id])},
+        columns=["sample_id"],
+    )
+    bitmap_index = dbbitmap.BitmapIndex.load(bitmap_path)
+    bitmap_index.patch(
+        dbconnect, [sample["sample_id"] for sample in paper_samples]
+    )
+    bitmap_index.save(bitmap_path)
+
 # db_paper_add_update.py ends here
@@ -20,8 +20,11 @@ import dborm
 import dbutils
 
 # User input
+# If paper_name is given, only that paper's rows are restored
 restore_timestamp = "20220310_134246"
 tables = []
+paper_name = ""
+workers = 4
 
 # Load config file
 config = dbutils.load_config(
@@ -38,7 +41,10 @@ dbconnect = dbutils.dbnascentConnection(db_url, creds)
 backupdir = config["file_locations"]["backup_dir"]
 restoredir = backupdir + "/" + restore_timestamp
 
-# Restore tables
-dbconnect.restore(restoredir, tables)
+# Restore tables (or a single paper)
+if paper_name:
+    dbconnect.restore_paper(restoredir, paper_name)
+else:
+    dbconnect.restore(restoredir, tables, workers)
 
 # db_restore.py ends here
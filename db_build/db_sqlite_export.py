@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+#
+# Filename: db_sqlite_export.py
+# Description: Export DBNascent to a read-only SQLite file
+# Authors: Lynn Sanford <lynn.sanford@colorado.edu>
+#
+
+# Commentary:
+#
+# This file contains code for exporting the whole database,
+# schema and indexes included, into one SQLite file per release.
+# Cluster jobs can copy the file to node-local storage and query
+# it by setting database in config_query.txt to the file path,
+# instead of querying the MySQL server. It should be run at the
+# end of every build, after sampleWide is refreshed.
+#
+
+# Code:
+
+# Import
+import sys, os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'global_files'))
+import dbutils
+
+# Load config file
+config = dbutils.load_config(
+    "/home/lsanford/DBNascent-build/config/config_build.txt"
+)
+
+# Create database connection object
+db_url = config["file_locations"]["database"]
+creds = config["file_locations"]["credentials"]
+dbconnect = dbutils.dbnascentConnection(db_url, creds)
+
+# Copy all tables from one consistent snapshot into
+# <sqlite_export_dir>/dbnascent_v<version>.sqlite
+export_dir = config["file_locations"]["sqlite_export_dir"]
+out_file = dbconnect.export_sqlite(export_dir)
+print("SQLite export: " + out_file)
+
+# db_sqlite_export.py ends here
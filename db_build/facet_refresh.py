@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+#
+# Filename: facet_refresh.py
+# Description: Recount facet values in the facetCounts table
+# Authors: Lynn Sanford <lynn.sanford@colorado.edu>
+#
+
+# Commentary:
+#
+# This file contains code for recounting samples and papers per
+# value of the browsing facet fields. Paper ingests recount their
+# own paper, so this only needs to be run after restores or
+# other changes made outside db_paper_add_update.py
+#
+# Parameters:
+#
+# Optionally takes paper identifiers to recount; with no
+# arguments, all papers are recounted
+#
+
+# Code:
+
+# Import
+import sys, os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'global_files'))
+import dbfacets
+import dbutils
+
+# Load config file
+config = dbutils.load_config(
+    "/home/lsanford/DBNascent-build/config/config_build.txt"
+)
+
+# Create database connection object
+db_url = config["file_locations"]["database"]
+creds = config["file_locations"]["credentials"]
+dbconnect = dbutils.dbnascentConnection(db_url, creds)
+
+# Replace counts of the given papers (or all) in one transaction
+if len(sys.argv) > 1:
+    nrows = dbfacets.refresh_facets(
+        dbconnect, dbfacets.paper_ids(dbconnect, sys.argv[1:])
+    )
+else:
+    nrows = dbfacets.refresh_facets(dbconnect)
+print("facetCounts rows: " + str(nrows))
+dbconnect.bump_version("facetCounts")
+
+# facet_refresh.py ends here
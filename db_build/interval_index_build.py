@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+#
+# Filename: interval_index_build.py
+# Description: Build the interval indexes of bidir calls
+# Authors: Lynn Sanford <lynn.sanford@colorado.edu>
+#
+
+# Commentary:
+#
+# This file contains code for rebuilding the interval indexes of
+# per-sample tfit and dREG calls used to find samples with calls
+# overlapping a region (see dbintervals.py). One index is saved
+# per genome and caller. It should be run at the end of every
+# build.
+#
+
+# Code:
+
+# Import
+import sys, os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'global_files'))
+import dbintervals
+import dbutils
+
+# Load config file
+config = dbutils.load_config(
+    "/home/lsanford/DBNascent-build/config/config_build.txt"
+)
+files = config["file_locations"]
+
+# Create database connection object
+dbconnect = dbutils.dbnascentConnection(files["database"], files["credentials"])
+
+pattern = files.get("bidir_calls", dbintervals.DEFAULT_CALLS)
+workers = int(os.environ.get("SLURM_CPUS_ON_NODE", 4))
+
+# Build an index for each genome and caller and replace the saved one
+for genome in ["hg38", "mm10"]:
+    for caller in ["tfit", "dreg"]:
+        index = dbintervals.IntervalIndex.build(
+            dbconnect, genome, caller, files["db_data"], pattern, workers
+        )
+        index.save(files["interval_index"].format(
+            genome=genome, caller=caller
+        ))
+        print(genome + " " + caller + " interval index samples: "
+              + str(len(index.sample_names)))
+
+# interval_index_build.py ends here
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+#
+# Filename: sample_wide_refresh.py
+# Description: Rebuild the denormalized sampleWide table
+# Authors: Lynn Sanford <lynn.sanford@colorado.edu>
+#
+
+# Commentary:
+#
+# This file contains code for rebuilding the sampleWide table,
+# which holds one row per sample with all one-to-one fields
+# and aggregated condition and run fields. It should be run
+# at the end of every build, after all papers are added.
+#
+
+# Code:
+
+# Import
+import sys, os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'global_files'))
+import dbquery
+import dbutils
+
+# Load config file
+config = dbutils.load_config(
+    "/home/lsanford/DBNascent-build/config/config_build.txt"
+)
+
+# Create database connection object
+db_url = config["file_locations"]["database"]
+creds = config["file_locations"]["credentials"]
+dbconnect = dbutils.dbnascentConnection(db_url, creds)
+
+# Replace sampleWide contents in one transaction
+# This also bumps the database version, marking sampleWide as
+# current so queries can be routed to it
+nrows = dbquery.refresh_sample_wide(dbconnect)
+print("sampleWide rows: " + str(nrows))
+
+# sample_wide_refresh.py ends here
@@ -11,15 +11,17 @@
 # values in searchable fields and formatting it for
 # inputting into database as searchEquiv table
 #
+# Distinct values are selected on the database server, and
+# only search terms that were added or removed since the last
+# run are changed, in one transaction, so the table is never
+# empty while it is being updated
+#
 
 # Code:
 
 # Import
-import csv
-import sqlalchemy as sql
 import sys, os
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'global_files'))
-import dborm
 import dbutils
 
 # Load config file
@@ -31,11 +33,10 @@ files = config["file_locations"]
 # Create database connection object
 dbconnect = dbutils.dbnascentConnection(files["database"], files["credentials"])
 
-# Delete current searcheq table
-dbconnect.delete_tables([dborm.searchEquiv.__table__,])
+# Create searcheq table if it does not exist yet
 dbconnect.add_tables()
 
-# Reflect database tables and define searchable fields
+# Define searchable tables and fields
 dbtables = [
     "organisms",
     "tissues",
@@ -77,23 +78,20 @@ fields = [
     "sample_data_score",
 ]
 
-full_dbdump = []
-for table in dbtables:
-    dbdump = dbconnect.reflect_table(table)
-    for entry in dbdump:
-        full_dbdump.append(entry)
-
+# Each value of a searchable field is a search term for itself
 search_table = []
-for dbentry in full_dbdump:
+for table in dbtables:
+    table_fields = dbconnect.get_table(table).columns.keys()
     for field in fields:
-        if field in dbentry.keys():
-            if dbentry[field]:
-                dictentry = {
-                    "search_term": dbentry[field],
-                    "db_term": dbentry[field],
+        if field not in table_fields:
+            continue
+        for value in dbconnect.distinct_values(table, field):
+            if value:
+                search_table.append({
+                    "search_term": str(value),
+                    "db_term": str(value),
                     "search_field": field,
-                }
-                search_table.append(dictentry)
+                })
 
 # Read in additional manually curated search terms
 search_keys = dbutils.load_keys(config,"searchequiv")
@@ -102,10 +100,11 @@ searcheqs = dbutils.Metatable(search_manual_path)
 searcheqs.key_replace(search_keys["in"], search_keys["match"])
 
 # Append manual to automatically generated and ensure unique
-for entry in searcheqs.data:
-    search_table.append(entry)
-search_table_full = dbutils.Metatable(search_table)
-searcheqs_unique = search_table_full.unique(search_keys["db"])
+search_terms = set()
+for entry in search_table + searcheqs.data:
+    search_terms.add(tuple(str(entry[key]) for key in search_keys["db"]))
+searcheqs_unique = [dict(zip(search_keys["db"], term))
+                    for term in sorted(search_terms)]
 
 searcheq_full_path = files["searcheq_table"]
 with open(searcheq_full_path, 'w') as outfile:
@@ -113,16 +112,13 @@ with open(searcheq_full_path, 'w') as outfile:
     for entry in searcheqs_unique:
         outfile.write('\t'.join(entry.values()) + '\n')
 
-# If not already present, add data to database
-searcheqs_to_add = dbutils.entry_update(
-                       dbconnect,
-                       "searchEquiv",
-                       search_keys["db"],
-                       searcheqs_unique
-                   )
-if len(searcheqs_to_add) > 0:
-    searcheqs_to_add = dbutils.format_for_db_add(dbconnect,searcheqs_to_add)
-    dbconnect.engine.execute(
-        dborm.searchEquiv.__table__.insert(),
-        searcheqs_to_add
-    )
+# Insert new and delete removed search terms in one transaction
+changes = dbutils.sync_rows(
+    dbconnect, "searchEquiv", search_keys["db"], searcheqs_unique
+)
+print("searchEquiv terms added: " + str(changes["added"])
+      + ", deleted: " + str(changes["deleted"]))
+
+# Bump database version so cached query results are refreshed
+if changes["added"] or changes["deleted"]:
+    dbconnect.bump_version("searchEquiv")
@@ -0,0 +1,339 @@
+"""Check DBNascent query plans and suggest indexes.
+
+Filename: dbadvisor.py
+Authors: Lynn Sanford <lynn.sanford@colorado.edu>
+
+Commentary:
+    This module runs a set of queries (by default the common
+    queries from query_printout.py and manual_query_printout.py)
+    under EXPLAIN and reports tables read by full scans and
+    queries needing temporary tables or filesorts. For each
+    scanned table it suggests a composite index: equality filter
+    columns first, then the join column, then one range filter
+    column, skipping indexes the table already has.
+
+    MySQL EXPLAIN and SQLite EXPLAIN QUERY PLAN output are
+    supported.
+
+Functions:
+    explain_query(object, object) -> dict
+    index_candidates(list, dict, bool) -> dict
+    suggest_index(dict, list) -> list
+    advise(object, list, bool) -> list
+    format_report(list, object) -> str
+"""
+
+import re
+
+import dborm
+import dbquery
+import dbutils
+import sqlalchemy as sql
+
+# Common queries from query_printout.py and manual_query_printout.py
+CANONICAL_QUERIES = [
+    {
+        "fields": ["paper_name", "sample_name", "cell_type"],
+        "filters": {"cell_type": [
+            'IN ("HEK293","HEK293T","HEK293 Flp-In","HEK293T Flp-In")'
+        ]},
+    },
+    {
+        "fields": ["paper_name"],
+        "filters": {"organism": ['= "D. melanogaster"']},
+    },
+    {
+        "fields": ["sample_name", "paper_name"],
+        "filters": {"control_experimental": ['= "control"']},
+    },
+    {
+        "fields": ["sample_name", "paper_name"],
+        "filters": {"tfit_date": ["IS NOT NULL"]},
+    },
+    {
+        "fields": ["sample_name", "sample_qc_score"],
+        "filters": {"sample_qc_score": ["< 4"]},
+    },
+    {
+        "fields": ["sample_name", "paper_name"],
+        "filters": {"treatment": ['= "DRB"']},
+    },
+    {
+        "fields": ["paper_name", "sample_name", "cell_type",
+                   "sample_qc_score", "condition_type", "trim_read_depth"],
+        "filters": {
+            "organism": ['= "H. sapiens"'],
+            "control_experimental": ['= "control"'],
+            "sample_qc_score": ["< 3"],
+            "cell_type": ['IN ("MCF7","lymphoblast","HeLa","K562",'
+                          '"HEK293T Flp-In","HEK293","HEK293T")'],
+            "condition_type": ['= "no treatment"'],
+        },
+    },
+    {
+        "fields": ["sample_name", "srr"],
+        "filters": {"srr": ['IN ("SRR0000001","SRR0000002")']},
+    },
+]
+
+SQLITE_TABLE_RE = re.compile(r"^(SCAN|SEARCH)(?: TABLE)? (\w+)")
+
+
+def explain_query(dbconn, query) -> dict:
+    """Run a query under EXPLAIN.
+
+    Parameters:
+        dbconn (dbnascentConnection object) :
+            current db connection
+
+        query (sqlalchemy Select) :
+            query to explain
+
+    Returns:
+        explain (dict) :
+            "scans": tables read by full scans
+            "temporary": whether a temporary table is used
+            "filesort": whether rows are sorted without an index
+            "plan": raw EXPLAIN rows as dicts
+    """
+    query_sql = dbquery.query_text(query, dbconn.engine.dialect)
+    dialect = dbconn.engine.dialect.name
+    if dialect == "sqlite":
+        prefix = "EXPLAIN QUERY PLAN "
+    else:
+        prefix = "EXPLAIN "
+    with dbconn.engine.connect() as conn:
+        plan = [dict(row._mapping)
+                for row in conn.exec_driver_sql(prefix + query_sql)]
+
+    scans = []
+    temporary = False
+    filesort = False
+    for row in plan:
+        if dialect == "sqlite":
+            detail = row["detail"]
+            match = SQLITE_TABLE_RE.match(detail)
+            if match and match.group(1) == "SCAN" and "INDEX" not in detail:
+                scans.append(match.group(2))
+            if "TEMP B-TREE" in detail:
+                if "ORDER BY" in detail:
+                    filesort = True
+                else:
+                    temporary = True
+        else:
+            row = {key.lower(): value for key, value in row.items()}
+            extra = row.get("extra") or ""
+            if row.get("type") == "ALL" and row.get("table"):
+                scans.append(row["table"])
+            temporary = temporary or "Using temporary" in extra
+            filesort = filesort or "Using filesort" in extra
+
+    return {
+        "scans": scans,
+        "temporary": temporary,
+        "filesort": filesort,
+        "plan": plan,
+    }
+
+
+def index_candidates(fields, filters=None, use_wide=False) -> dict:
+    """Find the columns each table is looked up by in a query.
+
+    Parameters:
+        fields (list) :
+            query fields
+
+        filters (dict) :
+            filter specification for each field
+
+        use_wide (boolean) :
+            whether the query may be routed to sampleWide
+
+    Returns:
+        candidates (dict) :
+            table -> {"join": join columns, "eq": equality
+            filter columns, "range": range filter columns}
+    """
+    filters = filters or {}
+    candidates = {}
+
+    def table_entry(table):
+        return candidates.setdefault(
+            table, {"join": [], "eq": [], "range": []}
+        )
+
+    def add_filter(table, field, spec):
+        for crit in dbutils.normalize_filter(spec):
+            if isinstance(crit, dict):
+                ops = [op.strip().lower() for op in crit]
+                if any(op in ("<", "<=", ">", ">=") for op in ops):
+                    kind = "range"
+                elif all(op in ("=", "==", "is", "in") for op in ops):
+                    kind = "eq"
+                else:
+                    # != and NOT IN cannot use an index lookup
+                    continue
+            else:
+                kind = "eq"
+            if field not in table_entry(table)[kind]:
+                table_entry(table)[kind].append(field)
+
+    all_fields = list(fields) + list(filters)
+    aggregated = any(
+        field in dborm.sample_wide_aggregates for field in all_fields
+    )
+    if dbquery.wide_fields(all_fields) and (use_wide or aggregated):
+        for field, spec in filters.items():
+            add_filter("sampleWide", field, spec)
+        return candidates
+
+    def add_join(table, col):
+        # Primary key lookups are already indexed
+        if col not in db_tables[table].primary_key.columns.keys():
+            table_entry(table)["join"].append(col)
+
+    db_tables = dborm.Base.metadata.tables
+    plan = dbquery.plan_query(fields, filters)
+    for table, parent, parent_col, col in plan["joins"]:
+        add_join(table, col)
+    for table, field, spec in plan["filters"]:
+        add_filter(table, field, spec)
+    for semi in plan["exists"]:
+        for table, parent, parent_col, col in semi["joins"]:
+            add_join(table, col)
+        for table, field, spec in semi["filters"]:
+            add_filter(table, field, spec)
+
+    return candidates
+
+
+def suggest_index(candidate, existing) -> list:
+    """Choose columns for a composite index on one table.
+
+    Parameters:
+        candidate (dict) :
+            lookup columns of the table (see index_candidates)
+
+        existing (list of lists) :
+            columns of the table's current indexes
+
+    Returns:
+        columns (list) :
+            suggested index columns, or an empty list if an
+            existing index already leads with them
+    """
+    columns = []
+    for col in candidate["eq"] + candidate["join"] + candidate["range"][0:1]:
+        if col not in columns:
+            columns.append(col)
+    if not columns:
+        return []
+    if any(cols[0:len(columns)] == columns for cols in existing):
+        return []
+    return columns
+
+
+def advise(dbconn, specs=None, use_wide=False) -> list:
+    """Explain queries and suggest indexes for scanned tables.
+
+    Parameters:
+        dbconn (dbnascentConnection object) :
+            current db connection
+
+        specs (list of dicts) :
+            query specs with "fields" and "filters"
+            (default CANONICAL_QUERIES)
+
+        use_wide (boolean) :
+            route queries to sampleWide where possible,
+            as query_printout.py does when it is current
+
+    Returns:
+        reports (list of dicts) :
+            for each query, "spec", "sql", the explain_query
+            results and "suggestions" (table -> index columns)
+    """
+    specs = specs or CANONICAL_QUERIES
+    inspector = sql.inspect(dbconn.engine)
+    reports = []
+    for spec in specs:
+        filters = spec.get("filters") or {}
+        query = dbquery.build_query(
+            spec["fields"], filters, spec.get("distinct", True), use_wide
+        )
+        explain = explain_query(dbconn, query)
+        candidates = index_candidates(spec["fields"], filters, use_wide)
+
+        suggestions = {}
+        for table in explain["scans"]:
+            if table not in candidates:
+                continue
+            existing = [index["column_names"]
+                        for index in inspector.get_indexes(table)]
+            existing.append(
+                inspector.get_pk_constraint(table)["constrained_columns"]
+            )
+            columns = suggest_index(candidates[table], existing)
+            if columns:
+                suggestions[table] = columns
+
+        report = {
+            "spec": spec,
+            "sql": dbquery.query_text(query, dbconn.engine.dialect),
+            "suggestions": suggestions,
+        }
+        report.update(explain)
+        reports.append(report)
+
+    return reports
+
+
+def format_report(reports, dialect) -> str:
+    """Format advisor results as text with CREATE INDEX statements.
+
+    Parameters:
+        reports (list of dicts) :
+            results of advise()
+
+        dialect (sqlalchemy Dialect) :
+            dialect to write CREATE INDEX statements for
+
+    Returns:
+        text (str) :
+            report text
+    """
+    lines = []
+    statements = {}
+    for i, report in enumerate(reports):
+        lines.append("Query " + str(i + 1) + ": "
+                     + " ".join(report["sql"].split()))
+        if report["scans"]:
+            lines.append("  Full scans: " + ", ".join(report["scans"]))
+        if report["temporary"]:
+            lines.append("  Uses temporary table")
+        if report["filesort"]:
+            lines.append("  Uses filesort")
+        if not (report["scans"] or report["temporary"]
+                or report["filesort"]):
+            lines.append("  OK")
+        for table, columns in report["suggestions"].items():
+            name = "ix_" + table + "_" + "_".join(columns)
+            lines.append("  Suggested index: " + name)
+            metadata = sql.MetaData()
+            table_obj = sql.Table(
+                table, metadata,
+                *[sql.Column(col, sql.Integer) for col in columns]
+            )
+            statements[name] = str(sql.schema.CreateIndex(
+                sql.Index(name, *[table_obj.c[col] for col in columns])
+            ).compile(dialect=dialect))
+        lines.append("")
+
+    if statements:
+        lines.append("Suggested indexes:")
+        for statement in statements.values():
+            lines.append(statement + ";")
+
+    return "\n".join(lines) + "\n"
+
+# dbadvisor.py ends here
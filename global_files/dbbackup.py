@@ -0,0 +1,1361 @@
+"""Functions for backing up and restoring DBNascent.
+
+Filename: dbbackup.py
+Authors: Lynn Sanford <lynn.sanford@colorado.edu>
+
+Commentary:
+    This module contains the on-disk backup format used by
+    dbnascentConnection.backup and dbnascentConnection.restore.
+
+    Each table is written to its own gzipped file. The first line
+    is a JSON schema header (table name and column names/types);
+    every following line is one JSON chunk holding up to chunk_size
+    rows stored column by column. Rows are streamed from the
+    database in primary key order, so memory use depends on the
+    chunk size rather than the table size.
+
+    All tables in a backup are read from one consistent snapshot,
+    optionally over several connections in parallel, and a
+    manifest.json records row counts, checksums and the snapshot
+    point.
+
+    Incremental backups store each table as content-addressed blocks
+    (gzipped JSON named by the sha256 of their contents) in a block
+    store shared by all backups, blocks/ under the backup directory.
+    Each timestamped backup is then only a manifest listing the
+    blocks of each table, so unchanged tables cost no extra space.
+    prune_backups removes old backups and unreferenced blocks.
+
+    export_sqlite writes the whole ORM schema, with its indexes, and
+    the contents of one snapshot into a single SQLite file. Release
+    files are opened read-only and immutable (see sqlite_url), so
+    any number of cluster jobs can query a node-local copy without
+    touching the MySQL server.
+
+Functions:
+    column_schema(object) -> list
+    encode_chunk(list, list) -> dict
+    decode_chunk(dict, list) -> list
+    write_table_backup(object, str, str, int) -> int
+    file_checksum(str) -> str
+    open_snapshot_connections(object, list, int) -> tuple
+    snapshot_backup(object, str, list, int, int, str) -> dict
+    block_path(str, str) -> str
+    iter_row_blocks(iterable, str, int) -> generator
+    write_block(str, dict) -> str
+    read_block(str, str) -> dict
+    write_table_blocks(object, str, str, int) -> dict
+    prune_backups(str, int, int) -> dict
+    iter_table_chunks(str, str, dict) -> generator
+    read_manifest(str) -> dict
+    verify_backup(str, list) -> list
+    read_backup_header(str) -> dict
+    iter_backup_chunks(str) -> generator
+    backup_tables(str) -> list
+    dependency_levels(list) -> list
+    fk_checks_off(object) -> contextmanager
+    load_table_backup(object, object, str) -> int
+    restore_tables(object, str, list, int) -> dict
+    backup_rows(str, str, str, set, dict) -> list
+    restore_paper(object, str, str) -> dict
+    sqlite_url(str, bool) -> str
+    export_sqlite(object, str, list, int) -> dict
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import queue
+import shutil
+import socket
+import stat
+import time
+
+import dborm
+import sqlalchemy as sql
+from sqlalchemy.ext.serializer import loads
+
+BACKUP_EXT = ".dbcol.gz"
+LEGACY_EXT = ".dbdump"
+MANIFEST_FILE = "manifest.json"
+# Marker present while a backup is being written
+RUNNING_FILE = "running.json"
+BLOCK_DIR = "blocks"
+# Age after which an unfinished backup is taken to have been killed;
+# well above the backup job time limit
+STALE_BACKUP_AGE = 24 * 3600
+FORMAT_NAME = "dbnascent-columnar"
+FORMAT_VERSION = 1
+SQLITE_EXT = ".sqlite"
+
+DATE_FMT = "%Y-%m-%d"
+DATETIME_FMT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+def column_schema(table_obj) -> list:
+    """Describe the columns of a table for the backup header.
+
+    Parameters:
+        table_obj (sqlalchemy Table) :
+            table to describe
+
+    Returns:
+        schema (list of dicts) :
+            name and storage type of each column, in table order
+            types are "int", "float", "bool", "str", "date" or
+            "datetime"
+    """
+    schema = []
+    for col in table_obj.columns:
+        try:
+            pytype = col.type.python_type
+        except NotImplementedError:
+            pytype = str
+        if pytype is bool:
+            coltype = "bool"
+        elif pytype is int:
+            coltype = "int"
+        elif pytype is float:
+            coltype = "float"
+        elif pytype is datetime.datetime:
+            coltype = "datetime"
+        elif pytype is datetime.date:
+            coltype = "date"
+        else:
+            coltype = "str"
+        schema.append({"name": col.name, "type": coltype})
+
+    return schema
+
+
+def encode_chunk(rows, schema) -> dict:
+    """Convert a chunk of rows into columnar, JSON-safe form.
+
+    Parameters:
+        rows (list of dicts) :
+            rows as returned by dbnascentConnection.reflect_chunks
+
+        schema (list of dicts) :
+            column schema from column_schema
+
+    Returns:
+        chunk (dict) :
+            row count and one list of values per column
+    """
+    columns = []
+    for col in schema:
+        name = col["name"]
+        values = [row[name] for row in rows]
+        if col["type"] == "date":
+            values = [None if v is None else v.strftime(DATE_FMT)
+                      for v in values]
+        elif col["type"] == "datetime":
+            values = [None if v is None else v.strftime(DATETIME_FMT)
+                      for v in values]
+        elif col["type"] == "str":
+            values = [None if v is None else str(v) for v in values]
+        columns.append(values)
+
+    return {"rows": len(rows), "columns": columns}
+
+
+def decode_chunk(chunk, schema) -> list:
+    """Convert a columnar chunk back into a list of row dicts.
+
+    Parameters:
+        chunk (dict) :
+            chunk as produced by encode_chunk
+
+        schema (list of dicts) :
+            column schema from the backup header
+
+    Returns:
+        rows (list of dicts) :
+            one dict per row, keyed by column name
+    """
+    columns = []
+    for col, values in zip(schema, chunk["columns"]):
+        if col["type"] == "date":
+            values = [
+                None if v is None
+                else datetime.datetime.strptime(v, DATE_FMT).date()
+                for v in values
+            ]
+        elif col["type"] == "datetime":
+            values = [
+                None if v is None
+                else datetime.datetime.strptime(v, DATETIME_FMT)
+                for v in values
+            ]
+        elif col["type"] == "bool":
+            values = [None if v is None else bool(v) for v in values]
+        columns.append(values)
+
+    names = [col["name"] for col in schema]
+    return [dict(zip(names, row)) for row in zip(*columns)]
+
+
+def write_table_backup(
+    dbconn,
+    table,
+    outfile,
+    chunk_size=10000,
+    conn=None,
+) -> int:
+    """Stream one table into a compressed columnar backup file.
+
+    Parameters:
+        dbconn (dbnascentConnection object) :
+            current db connection
+
+        table (str) :
+            table name
+
+        outfile (str) :
+            path to backup file
+
+        chunk_size (int) :
+            number of rows per chunk
+
+        conn (sqlalchemy Connection) :
+            connection to read from (default a new connection)
+
+    Returns:
+        nrows (int) :
+            number of rows written
+    """
+    table_obj = dbconn.get_table(table)
+    schema = column_schema(table_obj)
+    pkeys = [col.name for col in table_obj.primary_key.columns]
+    header = {
+        "format": FORMAT_NAME,
+        "version": FORMAT_VERSION,
+        "table": table,
+        "columns": schema,
+        "chunk_size": chunk_size,
+    }
+
+    nrows = 0
+    with gzip.open(outfile, "wt", compresslevel=6) as out:
+        out.write(json.dumps(header) + "\n")
+        for rows in dbconn.reflect_chunks(
+            table,
+            order_by=pkeys,
+            stream=True,
+            chunk_size=chunk_size,
+            conn=conn,
+        ):
+            out.write(json.dumps(encode_chunk(rows, schema)) + "\n")
+            nrows = nrows + len(rows)
+
+    return nrows
+
+
+def file_checksum(path) -> str:
+    """Calculate the sha256 checksum of a file.
+
+    Parameters:
+        path (str) :
+            path to file
+
+    Returns:
+        checksum (str) :
+            hex digest of file contents
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def open_snapshot_connections(engine, tables, nconn) -> tuple:
+    """Open connections that all read the same database state.
+
+    On MySQL, the tables are briefly locked for reading while each
+    connection starts a transaction WITH CONSISTENT SNAPSHOT, so
+    every connection sees the same committed data. If the lock
+    cannot be taken (missing LOCK TABLES privilege), snapshots are
+    still started but may differ by concurrent commits.
+
+    Parameters:
+        engine (sqlalchemy Engine) :
+            engine to open connections from
+
+        tables (list) :
+            tables that will be read
+
+        nconn (int) :
+            number of connections to open
+
+    Returns:
+        conns (list of sqlalchemy Connections) :
+            connections holding open snapshot transactions
+
+        snapshot (dict) :
+            description of the snapshot point
+    """
+    snapshot = {
+        "time": datetime.datetime.now().strftime(DATETIME_FMT),
+        "dialect": engine.dialect.name,
+        "locked": False,
+    }
+    if engine.dialect.name != "mysql":
+        conns = [engine.connect()]
+        conns[0].begin()
+        return conns, snapshot
+
+    coordinator = engine.connect()
+    conns = []
+    try:
+        try:
+            coordinator.exec_driver_sql(
+                "LOCK TABLES "
+                + ", ".join("`" + table + "` READ" for table in tables)
+            )
+            snapshot["locked"] = True
+        except sql.exc.DBAPIError:
+            pass
+
+        # Binary log position identifies the snapshot for replication
+        # or point-in-time recovery (needs REPLICATION CLIENT)
+        try:
+            status = coordinator.exec_driver_sql(
+                "SHOW MASTER STATUS"
+            ).fetchone()
+            if status is not None:
+                snapshot["binlog_file"] = status[0]
+                snapshot["binlog_position"] = status[1]
+        except sql.exc.DBAPIError:
+            pass
+
+        for i in range(nconn):
+            conn = engine.connect()
+            conn.exec_driver_sql(
+                "SET SESSION TRANSACTION ISOLATION LEVEL REPEATABLE READ"
+            )
+            conn.exec_driver_sql(
+                "START TRANSACTION WITH CONSISTENT SNAPSHOT"
+            )
+            conns.append(conn)
+    except Exception:
+        for conn in conns:
+            conn.close()
+        raise
+    finally:
+        if snapshot["locked"]:
+            coordinator.exec_driver_sql("UNLOCK TABLES")
+        coordinator.close()
+
+    return conns, snapshot
+
+
+def snapshot_backup(
+    dbconn,
+    backup_dir,
+    tables,
+    workers=1,
+    chunk_size=10000,
+    block_dir=None,
+) -> dict:
+    """Back up tables in parallel from one consistent snapshot.
+
+    Opens one snapshot connection per worker (see
+    open_snapshot_connections); each worker takes tables from a
+    shared queue until all are written. A manifest recording the
+    snapshot point, row counts and file checksums is written last.
+    A running.json marker is kept in the backup directory until the
+    backup finishes or fails (see prune_backups).
+
+    If a block store is given, the backup is incremental: tables are
+    split into content-addressed blocks (see write_table_blocks) and
+    the manifest lists the blocks of each table instead of files.
+
+    Parameters:
+        dbconn (dbnascentConnection object) :
+            current db connection
+
+        backup_dir (str) :
+            existing directory to write backup files into
+
+        tables (list) :
+            tables to back up
+
+        workers (int) :
+            number of connections reading at the same time
+
+        chunk_size (int) :
+            number of rows per chunk (and per block)
+
+        block_dir (str) :
+            path to shared block store for incremental backups
+
+    Returns:
+        manifest (dict) :
+            contents of the manifest file
+    """
+    running_path = backup_dir + "/" + RUNNING_FILE
+    with open(running_path, "w") as out:
+        json.dump({"host": socket.gethostname(), "pid": os.getpid()}, out)
+    try:
+        return _snapshot_backup(
+            dbconn, backup_dir, tables, workers, chunk_size, block_dir
+        )
+    finally:
+        os.remove(running_path)
+
+
+def _snapshot_backup(
+    dbconn, backup_dir, tables, workers, chunk_size, block_dir
+) -> dict:
+    """Write the backup files and manifest (see snapshot_backup)."""
+    conns, snapshot = open_snapshot_connections(
+        dbconn.engine, tables, max(1, min(workers, len(tables)))
+    )
+    todo = queue.Queue()
+    for table in tables:
+        todo.put(table)
+
+    def dump_tables(conn) -> dict:
+        written = {}
+        while True:
+            try:
+                table = todo.get_nowait()
+            except queue.Empty:
+                return written
+            if block_dir:
+                written[table] = write_table_blocks(
+                    dbconn, table, block_dir, chunk_size, conn
+                )
+                continue
+            filename = table + BACKUP_EXT
+            outfile = backup_dir + "/" + filename
+            nrows = write_table_backup(
+                dbconn, table, outfile, chunk_size, conn
+            )
+            written[table] = {
+                "file": filename,
+                "rows": nrows,
+                "sha256": file_checksum(outfile),
+            }
+
+    table_info = {}
+    try:
+        if len(conns) == 1:
+            table_info.update(dump_tables(conns[0]))
+        else:
+            with ThreadPoolExecutor(max_workers=len(conns)) as pool:
+                for written in pool.map(dump_tables, conns):
+                    table_info.update(written)
+    finally:
+        for conn in conns:
+            conn.close()
+
+    manifest = {
+        "format": FORMAT_NAME,
+        "version": FORMAT_VERSION,
+        "type": "incremental" if block_dir else "full",
+        "snapshot": snapshot,
+        "tables": {table: table_info[table] for table in tables},
+    }
+    if block_dir:
+        manifest["block_store"] = os.path.relpath(block_dir, backup_dir)
+    with open(backup_dir + "/" + MANIFEST_FILE, "w") as out:
+        json.dump(manifest, out, indent=2)
+
+    return manifest
+
+
+def block_path(block_dir, digest) -> str:
+    """Locate a block in the block store.
+
+    Parameters:
+        block_dir (str) :
+            path to block store
+
+        digest (str) :
+            sha256 of block contents
+
+    Returns:
+        path (str) :
+            path to block file
+    """
+    return block_dir + "/" + digest[:2] + "/" + digest + ".json.gz"
+
+
+def iter_row_blocks(chunks, key, block_rows):
+    """Regroup streamed rows into blocks with stable boundaries.
+
+    Rows are assigned to blocks by primary key range, so inserting
+    or changing rows only changes the blocks covering those rows.
+
+    Parameters:
+        chunks (iterable of lists of dicts) :
+            rows in primary key order
+
+        key (str) :
+            integer primary key column, or None to cut blocks
+            every block_rows rows
+
+        block_rows (int) :
+            primary key range (or row count) covered by a block
+
+    Yields:
+        block (list of dicts) :
+            rows of one block
+    """
+    block = []
+    bucket = None
+    count = 0
+    for rows in chunks:
+        for row in rows:
+            if key:
+                row_bucket = row[key] // block_rows
+            else:
+                row_bucket = count // block_rows
+            count = count + 1
+            if block and row_bucket != bucket:
+                yield block
+                block = []
+            bucket = row_bucket
+            block.append(row)
+    if block:
+        yield block
+
+
+def write_block(block_dir, block) -> str:
+    """Store one encoded block if it is not already in the store.
+
+    Parameters:
+        block_dir (str) :
+            path to block store
+
+        block (dict) :
+            encoded block (column names plus encode_chunk output)
+
+    Returns:
+        digest (str) :
+            sha256 of block contents
+    """
+    content = json.dumps(
+        block, sort_keys=True, separators=(",", ":")
+    ).encode("utf-8")
+    digest = hashlib.sha256(content).hexdigest()
+    path = block_path(block_dir, digest)
+    if os.path.exists(path):
+        # Mark the block as in use, so a concurrent prune keeps it
+        os.utime(path)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + "." + str(os.getpid()) + ".tmp"
+        with gzip.open(tmp_path, "wb", compresslevel=6) as out:
+            out.write(content)
+        os.replace(tmp_path, path)
+
+    return digest
+
+
+def read_block(block_dir, digest) -> dict:
+    """Read one encoded block from the block store.
+
+    Parameters:
+        block_dir (str) :
+            path to block store
+
+        digest (str) :
+            sha256 of block contents
+
+    Returns:
+        block (dict) :
+            encoded block
+    """
+    with gzip.open(block_path(block_dir, digest), "rb") as f:
+        return json.loads(f.read().decode("utf-8"))
+
+
+def write_table_blocks(
+    dbconn,
+    table,
+    block_dir,
+    block_rows=10000,
+    conn=None,
+) -> dict:
+    """Stream one table into content-addressed blocks.
+
+    Blocks already present in the store (e.g. from unchanged tables
+    in an earlier backup) are referenced rather than written again.
+
+    Parameters:
+        dbconn (dbnascentConnection object) :
+            current db connection
+
+        table (str) :
+            table name
+
+        block_dir (str) :
+            path to block store
+
+        block_rows (int) :
+            primary key range covered by one block
+
+        conn (sqlalchemy Connection) :
+            connection to read from (default a new connection)
+
+    Returns:
+        table_info (dict) :
+            column schema, row count and block digests for the
+            manifest
+    """
+    table_obj = dbconn.get_table(table)
+    schema = column_schema(table_obj)
+    names = [col["name"] for col in schema]
+    pkeys = [col.name for col in table_obj.primary_key.columns]
+    key = None
+    if len(pkeys) == 1 and table_obj.c[pkeys[0]].type.python_type is int:
+        key = pkeys[0]
+
+    chunks = dbconn.reflect_chunks(
+        table,
+        order_by=pkeys,
+        stream=True,
+        chunk_size=block_rows,
+        conn=conn,
+    )
+    nrows = 0
+    digests = []
+    for rows in iter_row_blocks(chunks, key, block_rows):
+        block = encode_chunk(rows, schema)
+        block["names"] = names
+        digests.append(write_block(block_dir, block))
+        nrows = nrows + len(rows)
+
+    return {"columns": schema, "rows": nrows, "blocks": digests}
+
+
+def prune_backups(out_path, keep, stale_after=STALE_BACKUP_AGE) -> dict:
+    """Apply backup retention and compact the block store.
+
+    Keeps the newest timestamped backups that have a manifest,
+    deletes older ones, then deletes blocks that no remaining
+    incremental backup references.
+
+    A backup without a manifest is still running if it has a
+    running.json marker and started less than stale_after seconds
+    ago; blocks written or reused (see write_block) since the oldest
+    running backup started are kept even if unreferenced. Other
+    backups without a manifest failed or were killed. They do not
+    hold back compaction, and are deleted once older than
+    stale_after.
+
+    Parameters:
+        out_path (str) :
+            path to backup directory (containing blocks/)
+
+        keep (int) :
+            number of newest backups to keep
+
+        stale_after (int) :
+            seconds after which an unfinished backup is deleted
+
+    Returns:
+        pruned (dict) :
+            lists of deleted backups and unfinished backups, and
+            number of deleted blocks
+    """
+    backups = sorted(
+        entry for entry in os.listdir(out_path)
+        if os.path.exists(out_path + "/" + entry + "/" + MANIFEST_FILE)
+    )
+    to_delete = backups[:max(0, len(backups) - keep)]
+    for entry in to_delete:
+        shutil.rmtree(out_path + "/" + entry)
+
+    # Start time of the oldest backup still running
+    running_since = None
+    stale = []
+    now = time.time()
+    for entry in sorted(os.listdir(out_path)):
+        entry_path = out_path + "/" + entry
+        if (entry == BLOCK_DIR or not os.path.isdir(entry_path)
+                or os.path.exists(entry_path + "/" + MANIFEST_FILE)):
+            continue
+        try:
+            started = datetime.datetime.strptime(
+                entry, "%Y%m%d_%H%M%S"
+            ).timestamp()
+        except ValueError:
+            started = os.path.getmtime(entry_path)
+        if now - started >= stale_after:
+            shutil.rmtree(entry_path)
+            stale.append(entry)
+        elif os.path.exists(entry_path + "/" + RUNNING_FILE):
+            if running_since is None or started < running_since:
+                running_since = started
+
+    block_dir = out_path + "/" + BLOCK_DIR
+    referenced = set()
+    for entry in backups[len(to_delete):]:
+        manifest = read_manifest(out_path + "/" + entry)
+        if manifest.get("type") == "incremental":
+            for info in manifest["tables"].values():
+                referenced.update(info["blocks"])
+
+    nblocks = 0
+    if os.path.isdir(block_dir):
+        for subdir in os.listdir(block_dir):
+            for file in os.listdir(block_dir + "/" + subdir):
+                file_path = block_dir + "/" + subdir + "/" + file
+                if file.split(".")[0] in referenced:
+                    continue
+                if (running_since is not None
+                        and os.path.getmtime(file_path) >= running_since):
+                    continue
+                os.remove(file_path)
+                nblocks = nblocks + 1
+            if not os.listdir(block_dir + "/" + subdir):
+                os.rmdir(block_dir + "/" + subdir)
+
+    return {"backups": to_delete, "stale": stale, "blocks": nblocks}
+
+
+def iter_table_chunks(in_path, table, manifest=None):
+    """Read one table of a full or incremental backup in chunks.
+
+    Parameters:
+        in_path (str) :
+            path to backup file directory
+
+        table (str) :
+            table name
+
+        manifest (dict) :
+            manifest of the backup, if already loaded
+
+    Yields:
+        rows (list of dicts) :
+            one chunk (or block) of rows, keyed by column name
+    """
+    if manifest is None:
+        manifest = read_manifest(in_path)
+    if manifest is not None and manifest.get("type") == "incremental":
+        block_dir = os.path.join(in_path, manifest["block_store"])
+        info = manifest["tables"][table]
+        for digest in info["blocks"]:
+            yield decode_chunk(read_block(block_dir, digest), info["columns"])
+    else:
+        yield from iter_backup_chunks(in_path + "/" + table + BACKUP_EXT)
+
+
+def read_manifest(in_path) -> dict:
+    """Read the manifest of a backup directory, if there is one.
+
+    Parameters:
+        in_path (str) :
+            path to backup file directory
+
+    Returns:
+        manifest (dict) :
+            manifest contents, or None for backups without one
+    """
+    manifest_path = in_path + "/" + MANIFEST_FILE
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def verify_backup(in_path, tables=None) -> list:
+    """Check backup files against the checksums in the manifest.
+
+    For incremental backups, every referenced block must exist and
+    hash to its name.
+
+    Parameters:
+        in_path (str) :
+            path to backup file directory
+
+        tables (list) :
+            tables to check (default all tables in manifest)
+
+    Returns:
+        bad_tables (list) :
+            tables whose file is missing or does not match
+    """
+    manifest = read_manifest(in_path)
+    if manifest is None:
+        return []
+
+    bad_tables = []
+    for table, info in manifest["tables"].items():
+        if tables and table not in tables:
+            continue
+        if manifest.get("type") == "incremental":
+            block_dir = os.path.join(in_path, manifest["block_store"])
+            for digest in info["blocks"]:
+                path = block_path(block_dir, digest)
+                if not os.path.exists(path):
+                    bad_tables.append(table)
+                    break
+                with gzip.open(path, "rb") as f:
+                    if hashlib.sha256(f.read()).hexdigest() != digest:
+                        bad_tables.append(table)
+                        break
+            continue
+        path = in_path + "/" + info["file"]
+        if not os.path.exists(path) or file_checksum(path) != info["sha256"]:
+            bad_tables.append(table)
+
+    return bad_tables
+
+
+def read_backup_header(infile) -> dict:
+    """Read the schema header of a backup file.
+
+    Parameters:
+        infile (str) :
+            path to backup file
+
+    Returns:
+        header (dict) :
+            table name, column schema and format information
+    """
+    with gzip.open(infile, "rt") as f:
+        header = json.loads(next(f))
+    if header.get("format") != FORMAT_NAME:
+        raise ValueError(
+            "Not a DBNascent columnar backup: " + infile
+        )
+    return header
+
+
+def iter_backup_chunks(infile):
+    """Read a backup file one chunk at a time.
+
+    Parameters:
+        infile (str) :
+            path to backup file
+
+    Yields:
+        rows (list of dicts) :
+            one chunk of rows, keyed by column name
+    """
+    with gzip.open(infile, "rt") as f:
+        header = json.loads(next(f))
+        if header.get("format") != FORMAT_NAME:
+            raise ValueError(
+                "Not a DBNascent columnar backup: " + infile
+            )
+        for line in f:
+            yield decode_chunk(json.loads(line), header["columns"])
+
+
+def backup_tables(in_path) -> list:
+    """List the tables that have backup files in a directory.
+
+    Parameters:
+        in_path (str) :
+            path to backup file directory
+
+    Returns:
+        tables (list) :
+            table names with a columnar or legacy backup file,
+            or listed in an incremental backup manifest
+    """
+    manifest = read_manifest(in_path)
+    if manifest is not None and manifest.get("type") == "incremental":
+        return list(manifest["tables"].keys())
+
+    tables = []
+    for file in sorted(os.listdir(in_path)):
+        for ext in (BACKUP_EXT, LEGACY_EXT):
+            if file.endswith(ext):
+                tables.append(file[:-len(ext)])
+
+    return tables
+
+
+def dependency_levels(tables) -> list:
+    """Group tables by foreign key depth within the ORM.
+
+    Tables in the same level do not reference each other and can be
+    loaded at the same time; every table only references tables in
+    earlier levels.
+
+    Parameters:
+        tables (list) :
+            table names
+
+    Returns:
+        levels (list of lists) :
+            table names grouped by load order
+    """
+    deps = {}
+    for table in tables:
+        deps[table] = set()
+        if table in dborm.Base.metadata.tables:
+            for fkey in dborm.Base.metadata.tables[table].foreign_keys:
+                parent = fkey.column.table.name
+                if parent in tables and parent != table:
+                    deps[table].add(parent)
+
+    levels = []
+    placed = set()
+    while len(placed) < len(tables):
+        level = [table for table in tables
+                 if table not in placed and deps[table] <= placed]
+        if not level:
+            raise ValueError(
+                "Circular foreign key dependency between tables"
+            )
+        levels.append(level)
+        placed.update(level)
+
+    return levels
+
+
+@contextmanager
+def fk_checks_off(conn):
+    """Disable foreign key and unique checks on a MySQL connection.
+
+    Checks are switched back on before the connection is returned
+    to the pool. Other database backends are left unchanged.
+
+    Parameters:
+        conn (sqlalchemy Connection) :
+            connection used for the load
+    """
+    mysql = conn.dialect.name == "mysql"
+    if mysql:
+        conn.execute(sql.text("SET FOREIGN_KEY_CHECKS = 0"))
+        conn.execute(sql.text("SET UNIQUE_CHECKS = 0"))
+    try:
+        yield conn
+    finally:
+        if mysql:
+            conn.execute(sql.text("SET UNIQUE_CHECKS = 1"))
+            conn.execute(sql.text("SET FOREIGN_KEY_CHECKS = 1"))
+
+
+def load_table_backup(engine, table_obj, chunks) -> int:
+    """Bulk insert the rows of one backed up table on its own connection.
+
+    Each chunk is sent as a single executemany insert and the whole
+    table is loaded in one transaction.
+
+    Parameters:
+        engine (sqlalchemy Engine) :
+            engine to open the connection from
+
+        table_obj (sqlalchemy Table) :
+            table to load into
+
+        chunks (iterable of lists of dicts) :
+            rows to insert, e.g. from iter_table_chunks
+
+    Returns:
+        nrows (int) :
+            number of rows inserted
+    """
+    nrows = 0
+    with engine.connect() as conn:
+        with fk_checks_off(conn):
+            with conn.begin():
+                for rows in chunks:
+                    conn.execute(table_obj.insert(), rows)
+                    nrows = nrows + len(rows)
+
+    return nrows
+
+
+def restore_tables(dbconn, in_path, tables, workers=4) -> dict:
+    """Replace table contents with the contents of a backup.
+
+    Backup files are checked against the manifest before anything
+    is deleted. Existing rows are deleted child tables first, then
+    tables are bulk loaded level by level (see dependency_levels).
+    Tables within a level are loaded concurrently on separate
+    connections. Legacy .dbdump backups are replayed through the
+    ORM session.
+
+    Parameters:
+        dbconn (dbnascentConnection object) :
+            current db connection
+
+        in_path (str) :
+            path to backup file directory
+
+        tables (list) :
+            tables to restore
+
+        workers (int) :
+            maximum number of tables loaded at the same time
+
+    Returns:
+        row_counts (dict) :
+            number of rows restored per columnar or incremental table
+    """
+    engine = dbconn.engine
+    dbtables = [table for table in dborm.Base.metadata.tables
+                if table in tables]
+    bad_tables = verify_backup(in_path, dbtables)
+    if bad_tables:
+        raise ValueError(
+            "Backup files do not match manifest: " + ", ".join(bad_tables)
+        )
+    levels = dependency_levels(dbtables)
+    if engine.dialect.name == "sqlite":
+        workers = 1
+
+    # Delete current data, child tables first
+    with engine.connect() as conn:
+        with fk_checks_off(conn):
+            with conn.begin():
+                for level in reversed(levels):
+                    for table in level:
+                        conn.execute(
+                            dborm.Base.metadata.tables[table].delete()
+                        )
+
+    manifest = read_manifest(in_path)
+    incremental = (manifest is not None
+                   and manifest.get("type") == "incremental")
+    row_counts = {}
+    for level in levels:
+        jobs = []
+        for table in level:
+            infile = in_path + "/" + table + BACKUP_EXT
+            if incremental or os.path.exists(infile):
+                jobs.append((
+                    table,
+                    dborm.Base.metadata.tables[table],
+                    iter_table_chunks(in_path, table, manifest),
+                ))
+            else:
+                infile = in_path + "/" + table + LEGACY_EXT
+                with open(infile, 'rb') as table_backup:
+                    for dbentry in loads(table_backup.read()):
+                        dbconn.session.merge(dbentry)
+                dbconn.session.commit()
+
+        if workers > 1 and len(jobs) > 1:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = {
+                    table: pool.submit(load_table_backup, engine, obj, chunks)
+                    for table, obj, chunks in jobs
+                }
+                for table in futures:
+                    row_counts[table] = futures[table].result()
+        else:
+            for table, obj, chunks in jobs:
+                row_counts[table] = load_table_backup(engine, obj, chunks)
+
+    return row_counts
+
+
+def backup_rows(in_path, table, column, values, manifest=None) -> list:
+    """Read the rows of a backed up table matching a set of values.
+
+    Parameters:
+        in_path (str) :
+            path to backup file directory
+
+        table (str) :
+            table name
+
+        column (str) :
+            column to match on
+
+        values (set) :
+            values to keep
+
+        manifest (dict) :
+            manifest of the backup, if already loaded
+
+    Returns:
+        rows (list of dicts) :
+            matching rows
+    """
+    matched = []
+    if not values:
+        return matched
+    for rows in iter_table_chunks(in_path, table, manifest):
+        for row in rows:
+            if row[column] in values:
+                matched.append(row)
+
+    return matched
+
+
+def restore_paper(dbconn, in_path, paper_name) -> dict:
+    """Restore the rows belonging to one paper from a backup.
+
+    Starting from papers.paper_name, follows linkIDs to the paper's
+    samples, sampleEquiv, genetics and bidirs, and the condition,
+    nascentflow and bidirflow links to their conditions and runs.
+    Rows owned by the paper (papers, samples, sampleEquiv and all
+    link tables) are deleted from the database with set-based
+    deletes, for both the backed up and the current version of the
+    paper, then bulk inserted from the backup. Only the paper's own
+    linkIDs rows are deleted; a sample that another paper still
+    links to keeps its current samples, sampleEquiv and link rows
+    and is not reinserted. Shared rows (genetics, bidirs,
+    conditions, runs) are only inserted if their id is missing,
+    since other papers may reference them. Everything runs in one
+    transaction.
+
+    Parameters:
+        dbconn (dbnascentConnection object) :
+            current db connection
+
+        in_path (str) :
+            path to backup file directory
+
+        paper_name (str) :
+            paper identifier (papers.paper_name)
+
+    Returns:
+        row_counts (dict) :
+            number of rows inserted per table
+    """
+    manifest = read_manifest(in_path)
+    tables = dborm.Base.metadata.tables
+    bad_tables = verify_backup(in_path)
+    if bad_tables:
+        raise ValueError(
+            "Backup files do not match manifest: " + ", ".join(bad_tables)
+        )
+
+    # Walk the foreign key graph through the backup
+    closure = {}
+    closure["papers"] = backup_rows(
+        in_path, "papers", "paper_name", {paper_name}, manifest
+    )
+    if not closure["papers"]:
+        raise KeyError(
+            "Paper not present in backup: " + paper_name
+        )
+    paper_ids = {row["id"] for row in closure["papers"]}
+    closure["linkIDs"] = backup_rows(
+        in_path, "linkIDs", "paper_id", paper_ids, manifest
+    )
+    sample_ids = {row["sample_id"] for row in closure["linkIDs"]}
+    closure["samples"] = backup_rows(
+        in_path, "samples", "id", sample_ids, manifest
+    )
+    closure["sampleEquiv"] = backup_rows(
+        in_path, "sampleEquiv", "sample_id", sample_ids, manifest
+    )
+    closure["genetics"] = backup_rows(
+        in_path, "genetics", "id",
+        {row["genetic_id"] for row in closure["linkIDs"]}, manifest
+    )
+    closure["bidirs"] = backup_rows(
+        in_path, "bidirs", "id",
+        {row["bidir_id"] for row in closure["linkIDs"]}, manifest
+    )
+    link_tables = [
+        ("conditionLink", "condition_id", "conditions"),
+        ("nascentflowLink", "nascentflow_id", "nascentflowRuns"),
+        ("bidirflowLink", "bidirflow_id", "bidirflowRuns"),
+    ]
+    for link_table, link_col, run_table in link_tables:
+        closure[link_table] = backup_rows(
+            in_path, link_table, "sample_id", sample_ids, manifest
+        )
+        closure[run_table] = backup_rows(
+            in_path, run_table, "id",
+            {row[link_col] for row in closure[link_table]}, manifest
+        )
+
+    owned = ["papers", "samples", "sampleEquiv", "linkIDs",
+             "conditionLink", "nascentflowLink", "bidirflowLink"]
+    sample_tables = ["sampleEquiv", "conditionLink",
+                     "nascentflowLink", "bidirflowLink"]
+    shared = ["genetics", "bidirs", "conditions",
+              "nascentflowRuns", "bidirflowRuns"]
+
+    row_counts = {}
+    with dbconn.engine.connect() as conn:
+        with fk_checks_off(conn):
+            with conn.begin():
+                # Include the paper's current rows, which may differ
+                live_papers = tables["papers"]
+                live_links = tables["linkIDs"]
+                paper_ids.update(conn.execute(
+                    sql.select(live_papers.c.id)
+                    .where(live_papers.c.paper_name == paper_name)
+                ).scalars().all())
+                sample_ids.update(conn.execute(
+                    sql.select(live_links.c.sample_id)
+                    .where(live_links.c.paper_id.in_(paper_ids))
+                ).scalars().all())
+
+                # Set-based deletes of rows owned by the paper
+                conn.execute(live_links.delete().where(
+                    live_links.c.paper_id.in_(paper_ids)
+                ))
+                # Samples other papers still link to are left alone
+                sample_ids.difference_update(conn.execute(
+                    sql.select(live_links.c.sample_id)
+                    .where(live_links.c.sample_id.in_(sample_ids))
+                ).scalars().all())
+                for table in sample_tables:
+                    conn.execute(tables[table].delete().where(
+                        tables[table].c.sample_id.in_(sample_ids)
+                    ))
+                conn.execute(tables["samples"].delete().where(
+                    tables["samples"].c.id.in_(sample_ids)
+                ))
+                conn.execute(live_papers.delete().where(
+                    live_papers.c.id.in_(paper_ids)
+                ))
+
+                # Samples still in the database keep their current rows
+                backup_ids = [row["id"] for row in closure["samples"]]
+                if backup_ids:
+                    present = set(conn.execute(
+                        sql.select(tables["samples"].c.id)
+                        .where(tables["samples"].c.id.in_(backup_ids))
+                    ).scalars().all())
+                    closure["samples"] = [row for row in closure["samples"]
+                                          if row["id"] not in present]
+                    for table in sample_tables:
+                        closure[table] = [
+                            row for row in closure[table]
+                            if row["sample_id"] not in present
+                        ]
+
+                # Shared rows are only added if missing
+                for table in shared:
+                    ids = [row["id"] for row in closure[table]]
+                    if not ids:
+                        continue
+                    present = set(conn.execute(
+                        sql.select(tables[table].c.id)
+                        .where(tables[table].c.id.in_(ids))
+                    ).scalars().all())
+                    closure[table] = [row for row in closure[table]
+                                      if row["id"] not in present]
+
+                # Bulk insert in foreign key order
+                for level in dependency_levels(owned + shared):
+                    for table in level:
+                        if closure[table]:
+                            conn.execute(tables[table].insert(),
+                                         closure[table])
+                        row_counts[table] = len(closure[table])
+
+    return row_counts
+
+
+def sqlite_url(path, read_only=True) -> str:
+    """Build a database url for a SQLite export file.
+
+    Parameters:
+        path (str) :
+            path to SQLite file
+
+        read_only (boolean) :
+            open the file read-only and immutable, which skips
+            file locking (needed on network filesystems) and
+            lets any number of processes read it at once
+
+    Returns:
+        url (str) :
+            sqlalchemy database url
+    """
+    path = os.path.abspath(path)
+    if not read_only:
+        return "sqlite:///" + path
+    return "sqlite:///file:" + path + "?mode=ro&immutable=1&uri=true"
+
+
+def export_sqlite(dbconn, out_file, tables=None, chunk_size=10000) -> dict:
+    """Export the database to a single read-only SQLite file.
+
+    Every ORM table is created in the export, and the tables that
+    exist in the source database are copied from one consistent
+    snapshot (see open_snapshot_connections). Rows are bulk inserted
+    in chunks with journaling off, indexes are built after loading,
+    and ANALYZE is run so the SQLite planner has table statistics.
+    The file is written under a temporary name, then renamed and
+    made read-only.
+
+    Parameters:
+        dbconn (dbnascentConnection object) :
+            current db connection
+
+        out_file (str) :
+            path to SQLite file to write (replaced if it exists)
+
+        tables (list) :
+            tables to copy (default all ORM tables in the database)
+
+        chunk_size (int) :
+            number of rows read and inserted at a time
+
+    Returns:
+        row_counts (dict) :
+            number of rows exported per table
+    """
+    db_tables = dborm.Base.metadata.tables
+    present = sql.inspect(dbconn.engine).get_table_names()
+    if not tables:
+        tables = [table for table in db_tables if table in present]
+
+    tmp_file = out_file + "." + str(os.getpid()) + ".tmp"
+    if os.path.exists(tmp_file):
+        os.remove(tmp_file)
+    out_engine = sql.create_engine(sqlite_url(tmp_file, read_only=False))
+
+    row_counts = {}
+    conns, snapshot = open_snapshot_connections(dbconn.engine, tables, 1)
+    try:
+        with out_engine.connect() as out_conn:
+            out_conn.exec_driver_sql("PRAGMA journal_mode = OFF")
+            out_conn.exec_driver_sql("PRAGMA synchronous = OFF")
+            with out_conn.begin():
+                for table_obj in dborm.Base.metadata.sorted_tables:
+                    out_conn.execute(sql.schema.CreateTable(table_obj))
+
+                for table in tables:
+                    table_obj = db_tables[table]
+                    pkeys = [col.name for col in table_obj.primary_key.columns]
+                    nrows = 0
+                    for rows in dbconn.reflect_chunks(
+                        table,
+                        order_by=pkeys,
+                        stream=True,
+                        chunk_size=chunk_size,
+                        conn=conns[0],
+                    ):
+                        out_conn.execute(table_obj.insert(), rows)
+                        nrows = nrows + len(rows)
+                    row_counts[table] = nrows
+
+                # Indexes are cheaper to build once the rows are in
+                for table_obj in dborm.Base.metadata.sorted_tables:
+                    for index in table_obj.indexes:
+                        index.create(out_conn)
+            out_conn.exec_driver_sql("ANALYZE")
+    except Exception:
+        out_engine.dispose()
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+    finally:
+        for conn in conns:
+            conn.close()
+
+    out_engine.dispose()
+    os.chmod(tmp_file, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+    os.replace(tmp_file, out_file)
+
+    return row_counts
+
+# dbbackup.py ends here
@@ -0,0 +1,499 @@
+"""Bitmap index over sample flags and scores for cohort selection.
+
+Filename: dbbitmap.py
+Authors: Lynn Sanford <lynn.sanford@colorado.edu>
+
+Commentary:
+    Each sample gets a dense ordinal (its position in sample_ids),
+    and each boolean flag in BITMAP_FLAGS and each value of the
+    small-integer scores in BITMAP_SCORES gets a bitmap with one bit
+    per sample, stored as a NumPy packed bit array (np.packbits).
+    Cohorts are selected with predicates such as
+
+        fcgene_avail AND NOT outlier AND sample_qc_score <= 3
+
+    which are evaluated as bitwise operations on the packed arrays,
+    without touching the database. The resulting sample ids can
+    then be used to fetch fields with a normal query, through the
+    sample_ids argument of dbquery.build_query.
+
+    A flag bit is set only where the flag is true, so NOT flag
+    includes samples where the flag is null. The index is saved
+    as an .npz file, rebuilt at the end of each build and patched
+    after each paper ingest.
+
+Classes:
+    BitmapIndex
+
+Functions:
+    fetch_columns(object, list) -> tuple
+"""
+
+import json
+import os
+import re
+
+import numpy as np
+
+import dborm
+import dbquery
+import dbutils
+import sqlalchemy as sql
+
+BITMAP_FLAGS = [
+    "fcgene_avail", "fcbidir_avail", "tfit_avail", "dreg_avail",
+    "tdf_avail", "unusable", "outlier", "wildtype_untreated",
+    "timecourse", "tfit_master_merge_incl", "dreg_master_merge_incl",
+]
+BITMAP_SCORES = ["sample_qc_score", "sample_nro_score"]
+
+TOKEN_RE = re.compile(
+    r"\s*(\(|\)|,|<=|>=|!=|==|=|<|>|-?\d+|[A-Za-z_][A-Za-z0-9_]*)"
+)
+NUMBER_RE = re.compile(r"-?\d+")
+FIELD_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+KEYWORDS = ("AND", "OR", "NOT", "IN")
+COMPARE_OPS = {
+    "=": np.equal,
+    "==": np.equal,
+    "!=": np.not_equal,
+    "<": np.less,
+    "<=": np.less_equal,
+    ">": np.greater,
+    ">=": np.greater_equal,
+}
+
+
+def fetch_columns(dbconn, sample_ids=None) -> tuple:
+    """Read the indexed fields of samples from the database.
+
+    Parameters:
+        dbconn (dbnascentConnection object) :
+            current db connection
+
+        sample_ids (list) :
+            samples to read (default all samples in linkIDs)
+
+    Returns:
+        ids (numpy array) :
+            sample ids
+
+        columns (dict) :
+            field -> list of values aligned with ids
+    """
+    db_tables = dborm.Base.metadata.tables
+    link = db_tables["linkIDs"]
+    fields = BITMAP_FLAGS + BITMAP_SCORES
+    field_tables = {field: dbutils.resolve_field(field) for field in fields}
+    joins = dbquery.plan_joins(list(set(field_tables.values())))
+    query = sql.select(
+        link.c.sample_id,
+        *[db_tables[field_tables[field]].c[field] for field in fields]
+    ).select_from(
+        dbquery._join_from(link, joins, outer=True)
+    ).order_by(link.c.sample_id)
+    if sample_ids is not None:
+        query = query.where(link.c.sample_id.in_(list(sample_ids)))
+
+    # One row per sample, even if it is linked more than once
+    rows = {}
+    with dbconn.engine.connect() as conn:
+        for row in conn.execute(query):
+            rows[row[0]] = row[1:]
+    ids = np.array(sorted(rows), dtype=np.int64)
+    columns = {
+        field: [rows[sample_id][i] for sample_id in ids.tolist()]
+        for i, field in enumerate(fields)
+    }
+    return ids, columns
+
+
+class _PredicateParser:
+    """Recursive-descent parser for one BitmapIndex.evaluate call."""
+
+    def __init__(self, index, tokens):
+        self.index = index
+        self.tokens = tokens
+        self.pos = 0
+
+    def parse(self):
+        bits = self.parse_or()
+        if self.peek() is not None:
+            raise ValueError("Unexpected token in predicate: " + self.peek())
+        return bits
+
+    def peek(self):
+        return self.tokens[self.pos]
+
+    def next(self):
+        token = self.tokens[self.pos]
+        if token is None:
+            raise ValueError("Predicate ends early")
+        self.pos = self.pos + 1
+        return token
+
+    def number(self):
+        token = self.next()
+        if not NUMBER_RE.fullmatch(token):
+            raise ValueError("Expected a number in predicate: " + token)
+        return int(token)
+
+    def keyword(self, word):
+        token = self.peek()
+        if token is not None and token.upper() == word:
+            self.pos = self.pos + 1
+            return True
+        return False
+
+    def parse_or(self):
+        bits = self.parse_and()
+        while self.keyword("OR"):
+            bits = bits | self.parse_and()
+        return bits
+
+    def parse_and(self):
+        bits = self.parse_not()
+        while self.keyword("AND"):
+            bits = bits & self.parse_not()
+        return bits
+
+    def parse_not(self):
+        if self.keyword("NOT"):
+            return ~self.parse_not() & self.index.present
+        if self.peek() == "(":
+            self.next()
+            bits = self.parse_or()
+            if self.next() != ")":
+                raise ValueError("Missing ) in predicate")
+            return bits
+        field = self.next()
+        if not FIELD_RE.fullmatch(field) or field.upper() in KEYWORDS:
+            raise ValueError("Expected a field in predicate: " + field)
+        if self.keyword("IN"):
+            if self.next() != "(":
+                raise ValueError("IN values must be in parentheses")
+            values = [self.number()]
+            while self.peek() == ",":
+                self.next()
+                values.append(self.number())
+            if self.next() != ")":
+                raise ValueError("Missing ) in predicate")
+            return self.index.bits(field, "in", values)
+        if self.peek() in COMPARE_OPS:
+            op = self.next()
+            return self.index.bits(field, op, self.number())
+        return self.index.bits(field)
+
+
+class BitmapIndex:
+    """Packed bitmaps of sample flags and score values.
+
+    Attributes:
+        sample_ids (numpy array) :
+            sample id of each ordinal
+
+        present (numpy array) :
+            packed bitmap of samples currently in the database
+
+        bitmaps (dict) :
+            "<flag>" or "<score>=<value>" -> packed bitmap
+
+        version (str) :
+            database version stamp the index was built from
+
+    Methods:
+        build(dbconn) -> BitmapIndex :
+            Builds the index from the database
+
+        load(path) -> BitmapIndex :
+            Loads a saved index
+
+        save(path) :
+            Writes the index to an .npz file
+
+        patch(dbconn, sample_ids) :
+            Re-reads the given samples after an ingest
+
+        bits(field, op=None, value=None) -> numpy array :
+            Packed bitmap of one flag or score comparison
+
+        evaluate(expr) -> numpy array :
+            Packed bitmap of a predicate expression
+
+        select(expr) -> numpy array :
+            Sample ids matching a predicate expression
+
+        count(expr) -> int :
+            Number of samples matching a predicate expression
+    """
+
+    def __init__(self, sample_ids, columns, version=None):
+        """Build bitmaps from sample values.
+
+        Parameters:
+            sample_ids (numpy array) :
+                sample id of each ordinal
+
+            columns (dict) :
+                field -> values aligned with sample_ids
+
+            version (str) :
+                database version stamp
+        """
+        self.sample_ids = np.asarray(sample_ids, dtype=np.int64)
+        self.version = version
+        self.present = np.packbits(np.ones(len(self.sample_ids), bool))
+        self.bitmaps = {}
+        self._ordinals = None
+        self._set_columns(np.arange(len(self.sample_ids)), columns)
+
+    def _set_columns(self, ordinals, columns):
+        """Set the bits of some ordinals from their field values."""
+        nbits = len(self.sample_ids)
+        for field in BITMAP_FLAGS:
+            values = np.array([bool(value) for value in columns[field]])
+            self._set_bits(field, ordinals, values, nbits)
+        for field in BITMAP_SCORES:
+            values = columns[field]
+            keys = {field + "=" + str(value)
+                    for value in values if value is not None}
+            keys.update(key for key in self.bitmaps
+                        if key.startswith(field + "="))
+            for key in keys:
+                score = int(key.split("=")[1])
+                matches = np.array([value == score for value in values])
+                self._set_bits(key, ordinals, matches, nbits)
+
+    def _set_bits(self, key, ordinals, values, nbits):
+        # Bitmaps are zero-padded to new ordinals
+        if key in self.bitmaps:
+            bits = np.unpackbits(self.bitmaps[key], count=nbits)
+        else:
+            bits = np.zeros(nbits, dtype=np.uint8)
+        bits[ordinals] = values
+        self.bitmaps[key] = np.packbits(bits)
+
+    @classmethod
+    def build(cls, dbconn):
+        """Build the index from the database.
+
+        Parameters:
+            dbconn (dbnascentConnection object) :
+                current db connection
+
+        Returns:
+            index (BitmapIndex object) :
+                index of all samples
+        """
+        ids, columns = fetch_columns(dbconn)
+        return cls(ids, columns, dbconn.db_version())
+
+    @classmethod
+    def load(cls, path):
+        """Load a saved index.
+
+        Parameters:
+            path (str) :
+                path to .npz file written by save
+
+        Returns:
+            index (BitmapIndex object) :
+                loaded index
+        """
+        index = cls.__new__(cls)
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            index.sample_ids = data["sample_ids"]
+            index.present = data["present"]
+            index.bitmaps = {key: data["bits_" + str(i)]
+                             for i, key in enumerate(meta["keys"])}
+        index.version = meta["version"]
+        index._ordinals = None
+        return index
+
+    def save(self, path) -> None:
+        """Write the index to an .npz file.
+
+        Parameters:
+            path (str) :
+                output path
+
+        Returns:
+            none
+        """
+        keys = sorted(self.bitmaps)
+        meta = {"version": self.version, "keys": keys}
+        arrays = {"bits_" + str(i): self.bitmaps[key]
+                  for i, key in enumerate(keys)}
+        tmp_path = path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            meta=np.array(json.dumps(meta)),
+            sample_ids=self.sample_ids,
+            present=self.present,
+            **arrays
+        )
+        os.replace(tmp_path, path)
+
+    def patch(self, dbconn, sample_ids) -> None:
+        """Re-read some samples from the database.
+
+        New samples get the next ordinals; samples no longer in
+        the database are cleared from every bitmap, and samples
+        found again (e.g. after dbbackup.restore_paper) are marked
+        present.
+
+        Parameters:
+            dbconn (dbnascentConnection object) :
+                current db connection
+
+            sample_ids (list) :
+                samples added, changed or deleted
+
+        Returns:
+            none
+        """
+        ids, columns = fetch_columns(dbconn, sample_ids)
+        ordinals = self.ordinals()
+        new_ids = [sample_id for sample_id in ids.tolist()
+                   if sample_id not in ordinals]
+        if new_ids:
+            self.sample_ids = np.concatenate(
+                [self.sample_ids, np.array(new_ids, dtype=np.int64)]
+            )
+            self._ordinals = None
+            ordinals = self.ordinals()
+        nbits = len(self.sample_ids)
+
+        found = set(ids.tolist())
+        gone = [ordinals[sample_id] for sample_id in sample_ids
+                if sample_id in ordinals and sample_id not in found]
+        present = np.unpackbits(self.present, count=nbits)
+        present[[ordinals[sample_id] for sample_id in ids.tolist()]] = 1
+        present[gone] = 0
+        self.present = np.packbits(present)
+        for key in self.bitmaps:
+            self._set_bits(key, gone, False, nbits)
+
+        self._set_columns(
+            np.array([ordinals[sample_id] for sample_id in ids.tolist()],
+                     dtype=np.int64),
+            columns,
+        )
+        self.version = dbconn.db_version()
+
+    def ordinals(self) -> dict:
+        """Map sample ids to ordinals.
+
+        Returns:
+            ordinals (dict) :
+                sample id -> bit position
+        """
+        if self._ordinals is None:
+            self._ordinals = {
+                sample_id: i for i, sample_id
+                in enumerate(self.sample_ids.tolist())
+            }
+        return self._ordinals
+
+    def bits(self, field, op=None, value=None):
+        """Get the packed bitmap of one flag or score comparison.
+
+        Parameters:
+            field (str) :
+                flag or score field
+
+            op (str) :
+                comparison operator for scores ("=", "!=", "<",
+                "<=", ">", ">=" or "in")
+
+            value (int or list) :
+                score value (list of values for "in")
+
+        Returns:
+            bits (numpy array) :
+                packed bitmap
+        """
+        if field in BITMAP_FLAGS:
+            if op is not None:
+                raise ValueError("Flags take no comparison: " + field)
+            return self.bitmaps[field] & self.present
+        if field not in BITMAP_SCORES:
+            raise KeyError("Field not in bitmap index: " + field)
+        if op is None:
+            raise ValueError("Scores need a comparison: " + field)
+
+        bits = np.zeros_like(self.present)
+        for key, key_bits in self.bitmaps.items():
+            if not key.startswith(field + "="):
+                continue
+            score = int(key.split("=")[1])
+            if op == "in":
+                match = score in value
+            else:
+                match = COMPARE_OPS[op](score, value)
+            if match:
+                bits = bits | key_bits
+        return bits & self.present
+
+    def evaluate(self, expr):
+        """Evaluate a predicate expression.
+
+        Expressions combine flags and score comparisons with AND,
+        OR, NOT and parentheses, e.g.
+        "tfit_avail AND (sample_qc_score IN (1, 2) OR NOT outlier)".
+
+        Parameters:
+            expr (str) :
+                predicate expression
+
+        Returns:
+            bits (numpy array) :
+                packed bitmap of matching samples
+        """
+        tokens = []
+        pos = 0
+        expr = expr.rstrip()
+        while pos < len(expr):
+            match = TOKEN_RE.match(expr, pos)
+            if not match:
+                raise ValueError(
+                    "Cannot parse predicate at: " + expr[pos:]
+                )
+            tokens.append(match.group(1))
+            pos = match.end()
+        tokens.append(None)
+        # Parser state is per call, so a shared index stays re-entrant
+        return _PredicateParser(self, tokens).parse()
+
+    def select(self, expr) -> np.ndarray:
+        """Get the ids of samples matching a predicate expression.
+
+        Parameters:
+            expr (str) :
+                predicate expression (see evaluate)
+
+        Returns:
+            sample_ids (numpy array) :
+                matching sample ids, which can be passed to
+                dbquery.build_query(..., sample_ids=...) to fetch
+                fields
+        """
+        bits = np.unpackbits(self.evaluate(expr), count=len(self.sample_ids))
+        return self.sample_ids[np.flatnonzero(bits)]
+
+    def count(self, expr) -> int:
+        """Count samples matching a predicate expression.
+
+        Parameters:
+            expr (str) :
+                predicate expression (see evaluate)
+
+        Returns:
+            count (int) :
+                number of matching samples
+        """
+        bits = np.unpackbits(self.evaluate(expr), count=len(self.sample_ids))
+        return int(np.count_nonzero(bits))
+
+# dbbitmap.py ends here
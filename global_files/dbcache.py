@@ -0,0 +1,248 @@
+"""Local on-disk cache of DBNascent query results.
+
+Filename: dbcache.py
+Authors: Lynn Sanford <lynn.sanford@colorado.edu>
+
+Commentary:
+    Query results are stored as gzipped pickles named by a hash of
+    the normalized SQL, its bound parameters and the database
+    version stamp (see dbnascentConnection.db_version). Every
+    build/ingest run bumps the stamp, so cached results are reused
+    until the database changes and never afterwards. A cache hit
+    does not query the database at all, apart from reading the
+    stamp once per connection.
+
+    The cache is bounded in size: when it grows past its limit,
+    the least recently used results (by file modification time,
+    which is updated on every hit) are deleted.
+
+Classes:
+    QueryCache
+
+Functions:
+    query_key(object, object, str) -> str
+    cache_lookup(object, object, object) -> tuple
+    cached_execute(object, object, object) -> list
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import pickle
+
+import sqlalchemy as sql
+
+CACHE_EXT = ".pkl.gz"
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+
+class QueryCache:
+    """A size-bounded LRU cache of query results on disk.
+
+    Attributes:
+        cache_dir (str) :
+            directory holding cached results
+
+        max_bytes (int) :
+            size limit of the cache directory
+
+    Methods:
+        get(key) -> list :
+            cached rows, or None on a miss
+
+        put(key, rows) :
+            stores rows and evicts old results if over the limit
+
+        evict() -> int :
+            deletes least recently used results until under the limit
+    """
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        """Initialize query cache object.
+
+        Parameters:
+            cache_dir (str) :
+                directory holding cached results (created if needed)
+
+            max_bytes (int) :
+                size limit of the cache directory
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key) -> str:
+        return self.cache_dir + "/" + key + CACHE_EXT
+
+    def get(self, key) -> list:
+        """Look up cached rows.
+
+        Parameters:
+            key (str) :
+                cache key (see query_key)
+
+        Returns:
+            rows (list of tuples) :
+                cached rows, or None if not cached
+        """
+        path = self._path(key)
+        try:
+            with gzip.open(path, "rb") as f:
+                rows = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        # Mark as recently used
+        os.utime(path)
+        return rows
+
+    def put(self, key, rows) -> None:
+        """Store rows in the cache.
+
+        Parameters:
+            key (str) :
+                cache key (see query_key)
+
+            rows (list of tuples) :
+                query results
+
+        Returns:
+            none
+        """
+        path = self._path(key)
+        tmp_path = path + "." + str(os.getpid()) + ".tmp"
+        with gzip.open(tmp_path, "wb") as f:
+            pickle.dump([tuple(row) for row in rows], f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self) -> int:
+        """Delete least recently used results until under the size limit.
+
+        Parameters:
+            none
+
+        Returns:
+            removed (int) :
+                number of cached results deleted
+        """
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(CACHE_EXT):
+                continue
+            path = self.cache_dir + "/" + name
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total = total + stat.st_size
+
+        removed = 0
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total = total - size
+            removed = removed + 1
+
+        return removed
+
+
+def query_key(query, dialect, stamp) -> str:
+    """Hash a query and database version into a cache key.
+
+    Parameters:
+        query (sqlalchemy Select or str) :
+            query, or raw SQL string
+
+        dialect (sqlalchemy Dialect) :
+            dialect the query is compiled for
+
+        stamp (str) :
+            database version stamp
+
+    Returns:
+        key (str) :
+            sha256 hex digest
+    """
+    if isinstance(query, str):
+        query_sql = query
+        params = {}
+    else:
+        compiled = query.compile(dialect=dialect)
+        query_sql = str(compiled)
+        params = compiled.params
+    query_sql = " ".join(query_sql.split()).rstrip(";")
+    payload = json.dumps(
+        [query_sql, params, stamp], sort_keys=True, default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def cache_lookup(dbconn, query, cache) -> tuple:
+    """Find the cache key of a query and any cached rows.
+
+    Parameters:
+        dbconn (dbnascentConnection object) :
+            current db connection
+
+        query (sqlalchemy Select or str) :
+            query, or raw SQL string
+
+        cache (QueryCache object) :
+            result cache, or None
+
+    Returns:
+        key (str) :
+            cache key, or None if results cannot be cached
+            (no cache, or no database version stamp)
+
+        rows (list of tuples) :
+            cached rows, or None on a miss
+    """
+    if cache is None:
+        return None, None
+    stamp = dbconn.db_version()
+    if stamp is None:
+        return None, None
+    key = query_key(query, dbconn.engine.dialect, stamp)
+    return key, cache.get(key)
+
+
+def cached_execute(dbconn, query, cache=None) -> list:
+    """Run a query, using cached results when available.
+
+    Parameters:
+        dbconn (dbnascentConnection object) :
+            current db connection
+
+        query (sqlalchemy Select or str) :
+            query, or raw SQL string
+
+        cache (QueryCache object) :
+            result cache; None to always query the database
+
+    Returns:
+        rows (list of tuples) :
+            query results
+    """
+    key, rows = cache_lookup(dbconn, query, cache)
+    if rows is not None:
+        return rows
+
+    if isinstance(query, str):
+        query = sql.text(query)
+    rows = [tuple(row) for row in dbconn.session.execute(query).fetchall()]
+
+    if key is not None:
+        cache.put(key, rows)
+
+    return rows
+
+# dbcache.py ends here
@@ -0,0 +1,369 @@
+"""Stream DBNascent query results to output files.
+
+Filename: dbexport.py
+Authors: Lynn Sanford <lynn.sanford@colorado.edu>
+
+Commentary:
+    Query results are read from a server-side cursor in chunks and
+    written out chunk by chunk, so memory use does not grow with the
+    size of the result. The output format follows the file extension:
+
+        .tsv            tab-delimited text with a header line
+        .tsv.gz         gzipped tab-delimited text
+        .parquet        Parquet
+        .arrow/.feather Arrow IPC file
+
+    Columnar outputs take their column types from the ORM and need
+    the pyarrow package, which is only imported when used. Each
+    output gets a <base>_query.txt file recording the SQL that made it.
+
+    export_lookup writes the results of a bulk SRR or sample name
+    lookup (see dbquery.lookup_samples) in the same formats.
+
+Functions:
+    output_format(str) -> str
+    output_base(str) -> str
+    column_types(object, list) -> list
+    arrow_schema(list, list) -> object
+    export_query(object, object, str, list, object, int) -> int
+    export_lookup(object, list, str, list, str, int) -> int
+"""
+
+import csv
+import gzip
+
+import dbcache
+import dborm
+import dbquery
+import dbutils
+import sqlalchemy as sql
+
+OUTPUT_FORMATS = {
+    ".tsv.gz": "tsv.gz",
+    ".tsv": "tsv",
+    ".parquet": "parquet",
+    ".arrow": "arrow",
+    ".feather": "arrow",
+}
+# Streamed results larger than this are not stored in the query cache
+CACHE_MAX_ROWS = 100000
+
+
+def output_format(outfile) -> str:
+    """Find the output format of a file from its extension.
+
+    Parameters:
+        outfile (str) :
+            path to output file
+
+    Returns:
+        format (str) :
+            "tsv", "tsv.gz", "parquet" or "arrow"
+    """
+    for ext, fmt in OUTPUT_FORMATS.items():
+        if outfile.endswith(ext):
+            return fmt
+    raise ValueError(
+        "Output file must end in one of "
+        + ", ".join(OUTPUT_FORMATS.keys()) + ": " + outfile
+    )
+
+
+def output_base(outfile) -> str:
+    """Strip the format extension from an output file path.
+
+    Parameters:
+        outfile (str) :
+            path to output file
+
+    Returns:
+        base (str) :
+            path without extension, for naming the _query.txt file
+    """
+    for ext in OUTPUT_FORMATS:
+        if outfile.endswith(ext):
+            return outfile[0:-len(ext)]
+    return outfile
+
+
+def column_types(query, columns) -> list:
+    """Find the ORM types of query result columns.
+
+    Parameters:
+        query (sqlalchemy Select or str) :
+            query, or raw SQL string
+
+        columns (list) :
+            result column names
+
+    Returns:
+        types (list of sqlalchemy types) :
+            type of each column; columns of raw SQL queries are
+            matched to ORM fields by name, and unknown ones are
+            treated as strings
+    """
+    if not isinstance(query, str):
+        return [col.type for col in query.selected_columns]
+
+    types = []
+    for name in columns:
+        try:
+            table = dbutils.resolve_field(name)
+            types.append(dborm.Base.metadata.tables[table].c[name].type)
+        except KeyError:
+            types.append(sql.String())
+    return types
+
+
+def arrow_schema(columns, types):
+    """Build a pyarrow schema from ORM column types.
+
+    Parameters:
+        columns (list) :
+            column names
+
+        types (list of sqlalchemy types) :
+            type of each column
+
+    Returns:
+        schema (pyarrow Schema) :
+            schema for columnar output
+    """
+    import pyarrow as pa
+
+    arrow_types = []
+    for col_type in types:
+        if isinstance(col_type, sql.Boolean):
+            arrow_types.append(pa.bool_())
+        elif isinstance(col_type, sql.Integer):
+            arrow_types.append(pa.int64())
+        elif isinstance(col_type, (sql.Float, sql.Numeric)):
+            arrow_types.append(pa.float64())
+        elif isinstance(col_type, sql.DateTime):
+            arrow_types.append(pa.timestamp("us"))
+        elif isinstance(col_type, sql.Date):
+            arrow_types.append(pa.date32())
+        else:
+            arrow_types.append(pa.string())
+
+    return pa.schema(list(zip(columns, arrow_types)))
+
+
+class _TsvWriter:
+    """Write row chunks as tab-delimited text, optionally gzipped."""
+
+    def __init__(self, outfile, columns, compress):
+        if compress:
+            self.f = gzip.open(outfile, "wt", newline="")
+        else:
+            self.f = open(outfile, "w", newline="")
+        self.w = csv.writer(self.f, delimiter="\t")
+        self.w.writerow(columns)
+
+    def write(self, rows):
+        self.w.writerows(rows)
+
+    def close(self):
+        self.f.close()
+
+
+class _ArrowWriter:
+    """Write row chunks as Parquet row groups or Arrow record batches."""
+
+    def __init__(self, outfile, columns, types, fmt):
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ImportError(
+                "pyarrow is required for " + fmt + " output"
+            )
+        self.pa = pa
+        self.schema = arrow_schema(columns, types)
+        # Raw SQL results come back as the driver returns them (MySQL
+        # TINYINT booleans as ints, aggregates as Decimal), so values
+        # are converted to each field's type before building arrays
+        self.converters = []
+        for field in self.schema:
+            if pa.types.is_boolean(field.type):
+                self.converters.append(bool)
+            elif pa.types.is_integer(field.type):
+                self.converters.append(int)
+            elif pa.types.is_floating(field.type):
+                self.converters.append(float)
+            elif pa.types.is_string(field.type):
+                self.converters.append(str)
+            else:
+                self.converters.append(None)
+        if fmt == "parquet":
+            import pyarrow.parquet as pq
+            self.writer = pq.ParquetWriter(outfile, self.schema)
+            self.sink = None
+        else:
+            import pyarrow.ipc
+            self.sink = pa.OSFile(outfile, "wb")
+            self.writer = pyarrow.ipc.new_file(self.sink, self.schema)
+
+    def write(self, rows):
+        arrays = []
+        for i, field in enumerate(self.schema):
+            values = [row[i] for row in rows]
+            convert = self.converters[i]
+            if convert is not None:
+                values = [None if value is None else convert(value)
+                          for value in values]
+            arrays.append(self.pa.array(values, type=field.type))
+        batch = self.pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+        self.writer.write_table(self.pa.Table.from_batches([batch]))
+
+    def close(self):
+        self.writer.close()
+        if self.sink is not None:
+            self.sink.close()
+
+
+def _open_writer(outfile, columns, types):
+    """Open the writer for the format of an output file."""
+    fmt = output_format(outfile)
+    if fmt in ("tsv", "tsv.gz"):
+        return _TsvWriter(outfile, columns, fmt == "tsv.gz")
+    return _ArrowWriter(outfile, columns, types(), fmt)
+
+
+def _stream_rows(dbconn, query, chunk_size):
+    """Yield result rows as tuples from a server-side cursor."""
+    if isinstance(query, str):
+        query = sql.text(query)
+    with dbconn.engine.connect() as conn:
+        yield from dbutils.fetch_chunks(
+            conn, query, stream=True, chunk_size=chunk_size, as_tuples=True
+        )
+
+
+def export_query(
+    dbconn, query, outfile, columns=None, cache=None, chunk_size=10000
+) -> int:
+    """Run a query and stream its results to a file.
+
+    Parameters:
+        dbconn (dbnascentConnection object) :
+            current db connection
+
+        query (sqlalchemy Select or str) :
+            query, or raw SQL string
+
+        outfile (str) :
+            output path; the extension sets the format
+
+        columns (list) :
+            header names (default query field names;
+            required for raw SQL)
+
+        cache (QueryCache object) :
+            result cache, used for results up to CACHE_MAX_ROWS
+
+        chunk_size (int) :
+            number of rows fetched and written at a time
+
+    Returns:
+        nrows (int) :
+            number of rows written
+    """
+    # Check the extension before running the query
+    output_format(outfile)
+    key, cached_rows = dbcache.cache_lookup(dbconn, query, cache)
+
+    if columns is None:
+        if isinstance(query, str):
+            raise ValueError(
+                "Column names must be given for raw SQL queries"
+            )
+        columns = [col.name for col in query.selected_columns]
+
+    if cached_rows is not None:
+        chunks = [cached_rows[i:i + chunk_size]
+                  for i in range(0, len(cached_rows), chunk_size)]
+    else:
+        chunks = _stream_rows(dbconn, query, chunk_size)
+
+    writer = _open_writer(
+        outfile, columns, lambda: column_types(query, columns)
+    )
+
+    nrows = 0
+    to_cache = [] if key is not None and cached_rows is None else None
+    try:
+        for rows in chunks:
+            writer.write(rows)
+            nrows = nrows + len(rows)
+            if to_cache is not None:
+                if nrows > CACHE_MAX_ROWS:
+                    to_cache = None
+                else:
+                    to_cache.extend(rows)
+    finally:
+        writer.close()
+
+    if to_cache is not None:
+        cache.put(key, to_cache)
+
+    with open(output_base(outfile) + "_query.txt", "w") as f:
+        if isinstance(query, str):
+            f.write(query)
+        else:
+            f.write(dbquery.query_text(query, dbconn.engine.dialect))
+
+    return nrows
+
+
+def export_lookup(
+    dbconn, identifiers, outfile, fields=None, key="srr", chunk_size=10000
+) -> int:
+    """Look up samples for a list of identifiers and stream them to a file.
+
+    Parameters:
+        dbconn (dbnascentConnection object) :
+            current db connection
+
+        identifiers (list) :
+            SRRs or sample names to look up
+
+        outfile (str) :
+            output path; the extension sets the format
+
+        fields (list) :
+            fields to return for each sample
+            (default dbquery.LOOKUP_FIELDS)
+
+        key (str) :
+            identifier type, "srr" or "sample_name"
+
+        chunk_size (int) :
+            number of rows inserted and written at a time
+
+    Returns:
+        nrows (int) :
+            number of rows written
+    """
+    fields = fields or dbquery.LOOKUP_FIELDS
+    columns = [key, "found"] + list(fields)
+
+    def types():
+        query = dbquery.lookup_query(dbquery.lookup_table(), fields, key)
+        return [sql.String(), sql.Boolean()] + [
+            col.type for col in query.selected_columns
+        ][2:]
+
+    writer = _open_writer(outfile, columns, types)
+    nrows = 0
+    try:
+        for rows in dbquery.lookup_samples(
+            dbconn, identifiers, fields, key, chunk_size
+        ):
+            writer.write(rows)
+            nrows = nrows + len(rows)
+    finally:
+        writer.close()
+
+    return nrows
+
+# dbexport.py ends here
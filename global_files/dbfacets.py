@@ -0,0 +1,274 @@
+"""Precomputed facet counts for browsing DBNascent.
+
+Filename: dbfacets.py
+Authors: Lynn Sanford <lynn.sanford@colorado.edu>
+
+Commentary:
+    The facetCounts table holds the number of samples in each paper
+    for every value of the fields in dborm.facet_fields, split by
+    organism. Sample and paper counts per value, for all organisms
+    or only some, are sums over this small table instead of
+    GROUP BY scans of the main tables.
+
+    Rows are computed on the database server (INSERT ... SELECT)
+    and replaced one paper at a time, so a paper ingest only
+    recounts that paper. A full refresh recounts every paper.
+
+    Counts filtered by other fields than organism cannot come from
+    facetCounts; facets() computes those from a grouped query
+    (against sampleWide when it covers the fields and is current).
+
+Functions:
+    facet_select(str, list) -> sqlalchemy Select
+    refresh_facets(object, list) -> int
+    paper_ids(object, list) -> list
+    facet_counts(object, str, list) -> list
+    selection_counts(object, str, dict, bool, object) -> list
+    facets(object, dict, list, bool, object) -> dict
+"""
+
+import dborm
+import dbquery
+import dbutils
+import sqlalchemy as sql
+
+
+def facet_select(field, paper_ids=None) -> sql.sql.Select:
+    """Count samples per paper, value and organism for one facet field.
+
+    Parameters:
+        field (str) :
+            facet field
+
+        paper_ids (list) :
+            papers to count (default all)
+
+    Returns:
+        query (sqlalchemy Select) :
+            query returning facetCounts columns (paper_id,
+            field, value, organism, num_samples)
+    """
+    db_tables = dborm.Base.metadata.tables
+    table = dbutils.resolve_field(field)
+    link = db_tables["linkIDs"]
+    joins = dbquery.plan_joins([table, "organisms"])
+    query = sql.select(
+        link.c.paper_id,
+        sql.literal(field, sql.String(length=50)),
+        sql.cast(db_tables[table].c[field], sql.String(length=250)),
+        db_tables["organisms"].c.organism,
+        sql.func.count(sql.distinct(link.c.sample_id)),
+    ).select_from(
+        dbquery._join_from(link, joins)
+    ).group_by(
+        link.c.paper_id,
+        db_tables[table].c[field],
+        db_tables["organisms"].c.organism,
+    )
+    if paper_ids is not None:
+        query = query.where(link.c.paper_id.in_(list(paper_ids)))
+    return query
+
+
+def refresh_facets(dbconn, paper_ids=None) -> int:
+    """Recount facet values for some or all papers.
+
+    The rows of the papers are deleted and recounted in one
+    transaction, so readers never see partial counts.
+
+    Parameters:
+        dbconn (dbnascentConnection object) :
+            current db connection
+
+        paper_ids (list) :
+            database ids of papers to recount (default all)
+
+    Returns:
+        nrows (int) :
+            number of facetCounts rows written
+    """
+    facet_table = dborm.facetCounts.__table__
+    facet_table.create(dbconn.engine, checkfirst=True)
+    columns = ["paper_id", "field", "value", "organism", "num_samples"]
+
+    with dbconn.engine.begin() as conn:
+        delete = facet_table.delete()
+        if paper_ids is not None:
+            delete = delete.where(
+                facet_table.c.paper_id.in_(list(paper_ids))
+            )
+        conn.execute(delete)
+        for field in dborm.facet_fields:
+            conn.execute(facet_table.insert().from_select(
+                columns, facet_select(field, paper_ids)
+            ))
+        count = sql.select(sql.func.count()).select_from(facet_table)
+        if paper_ids is not None:
+            count = count.where(
+                facet_table.c.paper_id.in_(list(paper_ids))
+            )
+        nrows = conn.execute(count).scalar()
+
+    return nrows
+
+
+def paper_ids(dbconn, paper_names) -> list:
+    """Look up the database ids of papers.
+
+    Parameters:
+        dbconn (dbnascentConnection object) :
+            current db connection
+
+        paper_names (list) :
+            paper identifiers
+
+    Returns:
+        ids (list) :
+            database ids of the papers that exist
+    """
+    papers = dbconn.reflect_table(
+        "papers", filter_crit={"paper_name": list(paper_names)},
+        columns=["id"],
+    )
+    return [paper["id"] for paper in papers]
+
+
+def facet_counts(dbconn, field, organisms=None) -> list:
+    """Get sample and paper counts per value from facetCounts.
+
+    Parameters:
+        dbconn (dbnascentConnection object) :
+            current db connection
+
+        field (str) :
+            facet field (one of dborm.facet_fields)
+
+        organisms (list) :
+            only count samples from these organisms
+            (default all organisms)
+
+    Returns:
+        counts (list of tuples) :
+            (value, number of samples, number of papers),
+            most samples first; values are strings
+    """
+    if field not in dborm.facet_fields:
+        raise ValueError("Not a facet field: " + field)
+    facet_table = dborm.facetCounts.__table__
+    num_samples = sql.func.sum(facet_table.c.num_samples)
+    query = sql.select(
+        facet_table.c.value,
+        num_samples,
+        sql.func.count(sql.distinct(facet_table.c.paper_id)),
+    ).where(facet_table.c.field == field).group_by(
+        facet_table.c.value
+    ).order_by(num_samples.desc(), facet_table.c.value)
+    if organisms is not None:
+        query = query.where(facet_table.c.organism.in_(list(organisms)))
+
+    with dbconn.engine.connect() as conn:
+        return [(row[0], int(row[1]), row[2]) for row in conn.execute(query)]
+
+
+def selection_counts(
+    dbconn, field, selection, use_wide=False, resolver=None
+) -> list:
+    """Count samples and papers per value among selected samples.
+
+    Parameters:
+        dbconn (dbnascentConnection object) :
+            current db connection
+
+        field (str) :
+            field to count values of
+
+        selection (dict) :
+            filter specification for each field, as in
+            query_printout.py
+
+        use_wide (boolean) :
+            read sampleWide when it covers the query
+
+        resolver (SearchResolver object) :
+            translates filter values (see dbsearch.py)
+
+    Returns:
+        counts (list of tuples) :
+            (value, number of samples, number of papers),
+            most samples first; values are strings
+    """
+    query_fields = [field] + [name for name in ("sample_name", "paper_name")
+                              if name != field]
+    rows = dbquery.build_query(
+        query_fields, selection, True, use_wide, resolver
+    ).subquery()
+    num_samples = sql.func.count(sql.distinct(rows.c.sample_name))
+    query = sql.select(
+        rows.c[field],
+        num_samples,
+        sql.func.count(sql.distinct(rows.c.paper_name)),
+    ).group_by(rows.c[field]).order_by(num_samples.desc(), rows.c[field])
+
+    with dbconn.engine.connect() as conn:
+        return [(None if row[0] is None else str(row[0]), row[1], row[2])
+                for row in conn.execute(query)]
+
+
+def facets(
+    dbconn, selection=None, fields=None, use_wide=False, resolver=None
+) -> dict:
+    """Get facet counts for the current selection.
+
+    A selection on organism alone (or none) is served from
+    facetCounts; any other selection is counted with a grouped
+    query (see selection_counts).
+
+    Parameters:
+        dbconn (dbnascentConnection object) :
+            current db connection
+
+        selection (dict) :
+            filter specification for each field
+
+        fields (list) :
+            facet fields to count (default dborm.facet_fields)
+
+        use_wide (boolean) :
+            read sampleWide for grouped queries when it covers them
+
+        resolver (SearchResolver object) :
+            translates filter values (see dbsearch.py)
+
+    Returns:
+        counts (dict) :
+            field -> list of (value, number of samples,
+            number of papers)
+    """
+    selection = selection or {}
+    fields = fields or dborm.facet_fields
+
+    # An organism equality or IN filter can be read from facetCounts
+    organisms = None
+    precomputed = set(selection) <= {"organism"}
+    if "organism" in selection:
+        crits = dbutils.normalize_filter(selection["organism"])
+        if resolver is not None:
+            crits = [resolver.translate("organism", crit) for crit in crits]
+        if len(crits) == 1 and isinstance(crits[0], str):
+            organisms = [crits[0]]
+        elif len(crits) == 1 and isinstance(crits[0], list):
+            organisms = crits[0]
+        else:
+            precomputed = False
+
+    counts = {}
+    for field in fields:
+        if precomputed and field in dborm.facet_fields:
+            counts[field] = facet_counts(dbconn, field, organisms)
+        else:
+            counts[field] = selection_counts(
+                dbconn, field, selection, use_wide, resolver
+            )
+    return counts
+
+# dbfacets.py ends here
@@ -0,0 +1,428 @@
+"""Interval index over per-sample bidirectional calls.
+
+Filename: dbintervals.py
+Authors: Lynn Sanford <lynn.sanford@colorado.edu>
+
+Commentary:
+    This module answers which samples have a tfit or dREG call
+    overlapping a region, without scanning every sample's call
+    file. An IntervalIndex holds the calls of all samples of one
+    genome and caller. For each chromosome it keeps NumPy arrays
+    of call starts, ends and sample ordinals (positions in
+    sample_names), sorted by start, plus the longest call length.
+
+    A call [s, e) overlaps a region [start, end) when s < end and
+    e > start. As e <= s + max_len, only calls with
+    start - max_len < s < end can overlap, and both bounds are
+    found by binary search (np.searchsorted) on the starts; only
+    the calls in between are checked. Regions are looked up in
+    batches, one searchsorted call per chromosome.
+
+    The index is built from the call BED files of samples with
+    tfit_avail/dreg_avail, found from a path pattern (see
+    dbmatrix.count_file_path), and saved as an .npz file.
+    region_samples joins the overlapping samples to their
+    metadata with dbquery.lookup_samples.
+
+Classes:
+    IntervalIndex
+
+Functions:
+    read_calls(str) -> tuple
+    group_calls(object, object, object) -> dict
+    read_region_file(str) -> list
+    region_samples(object, object, list, list) -> generator
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+import json
+import os
+import warnings
+
+import numpy as np
+
+import dbmatrix
+import dbquery
+
+CALL_FLAGS = {"tfit": "tfit_avail", "dreg": "dreg_avail"}
+DEFAULT_CALLS = (
+    "{db_data}{paper_name}/{caller}/{sample_name}_{genome}_{caller}.bed"
+)
+REGION_FIELDS = ["sample_name", "paper_name", "cell_type"]
+# Coordinates fit in int32 for every supported genome
+CALL_DTYPE = [("chrom", "U64"), ("start", np.int32), ("end", np.int32)]
+SKIP_PREFIXES = ("#", "track", "browser")
+
+
+def read_calls(path) -> tuple:
+    """Read the calls of one sample from a BED file.
+
+    Parameters:
+        path (str) :
+            BED file (optionally gzipped); track, browser and
+            comment lines are skipped
+
+    Returns:
+        chroms (numpy array) :
+            chromosome of each call
+
+        starts (numpy array) :
+            call starts (int32)
+
+        ends (numpy array) :
+            call ends (int32)
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt") as f, warnings.catch_warnings():
+        # An empty call file is not an error
+        warnings.simplefilter("ignore", UserWarning)
+        calls = np.loadtxt(
+            (line for line in f
+             if line.strip() and not line.startswith(SKIP_PREFIXES)),
+            dtype=CALL_DTYPE, delimiter="\t", usecols=(0, 1, 2), ndmin=1,
+        )
+    return calls["chrom"], calls["start"], calls["end"]
+
+
+def group_calls(chroms, starts, ends) -> dict:
+    """Split the calls of one sample by chromosome.
+
+    Parameters:
+        chroms (numpy array) :
+            chromosome of each call
+
+        starts (numpy array) :
+            call starts
+
+        ends (numpy array) :
+            call ends
+
+    Returns:
+        groups (dict) :
+            chromosome -> (starts, ends), each sorted by start
+    """
+    names, inverse = np.unique(chroms, return_inverse=True)
+    # One sort by (chromosome, start) instead of a scan per chromosome
+    order = np.lexsort((starts, inverse))
+    bounds = np.searchsorted(inverse[order], np.arange(len(names) + 1))
+    starts = starts[order]
+    ends = ends[order]
+    groups = {}
+    for i, chrom in enumerate(names.tolist()):
+        rows = slice(bounds[i], bounds[i + 1])
+        groups[chrom] = (starts[rows], ends[rows])
+    return groups
+
+
+def read_region_file(path) -> list:
+    """Read query regions from a BED file.
+
+    Parameters:
+        path (str) :
+            BED file of regions
+
+    Returns:
+        regions (list of tuples) :
+            (chromosome, start, end) of each region, in file order
+    """
+    chroms, starts, ends = read_calls(path)
+    return list(zip(chroms, starts.tolist(), ends.tolist()))
+
+
+class IntervalIndex:
+    """Sorted-array interval index of bidir calls for one genome/caller.
+
+    Attributes:
+        genome (str) :
+            genome build of the calls
+
+        caller (str) :
+            bidir caller ("tfit" or "dreg")
+
+        sample_names (numpy array) :
+            sample name of each ordinal
+
+        chroms (dict) :
+            chromosome -> {"starts", "ends", "samples"} arrays
+            sorted by start, and "max_len", the longest call
+
+    Methods:
+        build(dbconn, genome, caller, data_path, pattern, workers)
+            -> IntervalIndex :
+            Reads the call files of all samples with calls
+
+        load(path) -> IntervalIndex :
+            Loads an index written by save
+
+        save(path) :
+            Writes the index to an .npz file
+
+        overlaps(regions) -> list :
+            Sample ordinals with calls overlapping each region
+
+        samples(regions) -> list :
+            Sample names with calls overlapping each region
+    """
+
+    def __init__(self, genome, caller, sample_names, calls):
+        """Sort calls into per-chromosome arrays.
+
+        Parameters:
+            genome (str) :
+                genome build of the calls
+
+            caller (str) :
+                bidir caller
+
+            sample_names (list) :
+                sample name of each ordinal
+
+            calls (iterable of dicts) :
+                calls of each sample grouped by chromosome, in
+                ordinal order (see group_calls)
+        """
+        self.genome = genome
+        self.caller = caller
+        self.sample_names = np.array(sample_names, dtype=str)
+
+        by_chrom = {}
+        for ordinal, groups in enumerate(calls):
+            for chrom, (starts, ends) in groups.items():
+                by_chrom.setdefault(chrom, []).append(
+                    (starts, ends, ordinal)
+                )
+
+        # Merge one chromosome at a time, freeing its parts as it
+        # goes, so peak memory stays near the size of the calls
+        self.chroms = {}
+        for chrom in sorted(by_chrom):
+            parts = by_chrom.pop(chrom)
+            starts = np.concatenate([part[0] for part in parts])
+            ends = np.concatenate([part[1] for part in parts])
+            samples = np.repeat(
+                np.array([part[2] for part in parts], dtype=np.int32),
+                [len(part[0]) for part in parts],
+            )
+            del parts
+            order = np.argsort(starts, kind="stable")
+            starts = starts[order]
+            ends = ends[order]
+            samples = samples[order]
+            del order
+            self.chroms[chrom] = {
+                "starts": starts,
+                "ends": ends,
+                "samples": samples,
+                "max_len": int((ends - starts).max()) if len(starts) else 0,
+            }
+
+    @classmethod
+    def build(
+        cls, dbconn, genome, caller, data_path, pattern=DEFAULT_CALLS,
+        workers=4,
+    ):
+        """Build the index from the call files of a genome and caller.
+
+        Samples whose call file is missing are left out.
+
+        Parameters:
+            dbconn (dbnascentConnection object) :
+                current db connection
+
+            genome (str) :
+                genome build (e.g. "hg38" or "mm10")
+
+            caller (str) :
+                bidir caller ("tfit" or "dreg")
+
+            data_path (str) :
+                data directory, filled in for {db_data}
+
+            pattern (str) :
+                call file path pattern (see dbmatrix.count_file_path);
+                {genome} and {caller} are filled in as well
+
+            workers (int) :
+                number of files read at the same time
+
+        Returns:
+            index (IntervalIndex object) :
+                index of all samples with calls
+        """
+        if caller not in CALL_FLAGS:
+            raise ValueError("Bidir caller must be tfit or dreg: " + caller)
+        columns, samples = dbmatrix.sample_table(
+            dbconn, ["sample_name", "paper_name"],
+            {CALL_FLAGS[caller]: True, "genome_build": genome},
+        )
+        extra = {"genome": genome, "caller": caller}
+        names = []
+        paths = []
+        for sample in samples:
+            path = dbmatrix.count_file_path(pattern, sample, data_path, extra)
+            if os.path.isfile(path):
+                names.append(sample["sample_name"])
+                paths.append(path)
+
+        def read_grouped(path):
+            return group_calls(*read_calls(path))
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            return cls(genome, caller, names, pool.map(read_grouped, paths))
+
+    @classmethod
+    def load(cls, path):
+        """Load a saved index.
+
+        Parameters:
+            path (str) :
+                path to .npz file written by save
+
+        Returns:
+            index (IntervalIndex object) :
+                loaded index
+        """
+        index = cls.__new__(cls)
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            index.sample_names = data["sample_names"]
+            index.chroms = {}
+            for i, chrom in enumerate(meta["chroms"]):
+                index.chroms[chrom] = {
+                    "starts": data["starts_" + str(i)],
+                    "ends": data["ends_" + str(i)],
+                    "samples": data["samples_" + str(i)],
+                    "max_len": meta["max_len"][i],
+                }
+        index.genome = meta["genome"]
+        index.caller = meta["caller"]
+        return index
+
+    def save(self, path) -> None:
+        """Write the index to an .npz file.
+
+        Parameters:
+            path (str) :
+                output path
+
+        Returns:
+            none
+        """
+        chroms = sorted(self.chroms)
+        meta = {
+            "genome": self.genome,
+            "caller": self.caller,
+            "chroms": chroms,
+            "max_len": [self.chroms[chrom]["max_len"] for chrom in chroms],
+        }
+        arrays = {}
+        for i, chrom in enumerate(chroms):
+            for key in ("starts", "ends", "samples"):
+                arrays[key + "_" + str(i)] = self.chroms[chrom][key]
+        tmp_path = path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            meta=np.array(json.dumps(meta)),
+            sample_names=self.sample_names,
+            **arrays
+        )
+        os.replace(tmp_path, path)
+
+    def overlaps(self, regions) -> list:
+        """Find the samples with calls overlapping each region.
+
+        Parameters:
+            regions (list of tuples) :
+                (chromosome, start, end) of each region, half-open
+                as in BED
+
+        Returns:
+            ordinals (list of numpy arrays) :
+                sorted unique sample ordinals for each region,
+                in region order
+        """
+        result = [np.zeros(0, dtype=np.int32)] * len(regions)
+        by_chrom = {}
+        for i, (chrom, start, end) in enumerate(regions):
+            by_chrom.setdefault(chrom, []).append(i)
+
+        for chrom, positions in by_chrom.items():
+            calls = self.chroms.get(chrom)
+            if calls is None:
+                continue
+            region_starts = np.array(
+                [regions[i][1] for i in positions], dtype=np.int64
+            )
+            region_ends = np.array(
+                [regions[i][2] for i in positions], dtype=np.int64
+            )
+            # Calls starting in (start - max_len, end) may overlap
+            lows = np.searchsorted(
+                calls["starts"], region_starts - calls["max_len"],
+                side="right",
+            )
+            highs = np.searchsorted(calls["starts"], region_ends, side="left")
+            for i, low, high, start in zip(
+                positions, lows.tolist(), highs.tolist(),
+                region_starts.tolist(),
+            ):
+                if high <= low:
+                    continue
+                hits = calls["ends"][low:high] > start
+                result[i] = np.unique(calls["samples"][low:high][hits])
+
+        return result
+
+    def samples(self, regions) -> list:
+        """Find the names of samples with calls overlapping each region.
+
+        Parameters:
+            regions (list of tuples) :
+                (chromosome, start, end) of each region
+
+        Returns:
+            names (list of lists) :
+                sample names for each region, in region order
+        """
+        return [self.sample_names[ordinals].tolist()
+                for ordinals in self.overlaps(regions)]
+
+
+def region_samples(dbconn, index, regions, fields=None):
+    """Join the samples overlapping each region to their metadata.
+
+    Parameters:
+        dbconn (dbnascentConnection object) :
+            current db connection
+
+        index (IntervalIndex object) :
+            index of the genome and caller to search
+
+        regions (list of tuples) :
+            (chromosome, start, end) of each region
+
+        fields (list) :
+            fields to return for each sample (default REGION_FIELDS)
+
+    Yields:
+        row (tuple) :
+            chromosome, start, end, then the sample's fields, for
+            each overlapping sample of each region, in region order
+    """
+    fields = fields or REGION_FIELDS
+    hits = index.samples(regions)
+    names = sorted({name for region_names in hits for name in region_names})
+
+    metadata = {}
+    for rows in dbquery.lookup_samples(dbconn, names, fields, "sample_name"):
+        for row in rows:
+            # Multi-valued fields give one row each; keep the first
+            if row[1] and row[0] not in metadata:
+                metadata[row[0]] = tuple(row[2:])
+
+    for region, region_names in zip(regions, hits):
+        for name in region_names:
+            yield tuple(region) + metadata.get(name, (None,) * len(fields))
+
+# dbintervals.py ends here
@@ -0,0 +1,627 @@
+"""Assemble count matrices from per-sample count files.
+
+Filename: dbmatrix.py
+Authors: Lynn Sanford <lynn.sanford@colorado.edu>
+
+Commentary:
+    This module builds DESeq2-ready count matrices for the samples
+    returned by a query. Each sample's featureCounts output is found
+    from a path pattern such as
+
+        {db_data}{paper_name}/counts/genes/{sample_name}.txt
+
+    where the fields in braces are query fields (sample_name and
+    paper_name are always queried) or db_data, the data directory.
+
+    Count files are read in parallel, and each sample's counts are
+    written straight into its column of a memory-mapped
+    features x samples integer matrix (a .npy file in column-major
+    order), so memory use does not grow with the number of samples.
+    The matrix is then streamed out as a counts table with one
+    column per sample, alongside a colData table of the query
+    fields with one row per sample, in the same order.
+
+    Samples whose count file is missing are left out of both
+    tables and reported. Every file must list the same features
+    in the same order as the first one.
+
+    Bidirectional counts are over the tfit or dREG master merge
+    regions of a genome. Each count file is checked against the
+    master merge region BED, so the matrix rows are the master
+    regions in BED order. Only samples with fcbidir_avail that are
+    included in the master merge are used.
+
+Functions:
+    count_file_path(str, dict, str, dict) -> str
+    read_feature_counts(str) -> tuple
+    read_regions(str) -> tuple
+    regions_match(list, list) -> bool
+    sample_table(object, list, dict, bool, object) -> tuple
+    fill_count_matrix(list, list, str, int, function, list) -> object
+    write_count_table(list, list, object, str, int) -> int
+    write_coldata(list, list, str) -> int
+    build_matrix(object, dict, dict, str, str, str, int, bool, object,
+                 dict, str) -> dict
+    build_gene_matrix(object, dict, str, str, str, int, bool, object) -> dict
+    build_bidir_matrix(object, dict, str, str, str, str, str, str, int,
+                       bool, object) -> dict
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import gzip
+import os
+
+import numpy as np
+
+import dbquery
+
+COUNT_DTYPE = np.int32
+# Gene counts are only assembled for samples that have them
+GENE_FILTER = {"fcgene_avail": True}
+DEFAULT_GENE_COUNTS = "{db_data}{paper_name}/counts/genes/{sample_name}.txt"
+BIDIR_CALLERS = ("tfit", "dreg")
+DEFAULT_BIDIR_COUNTS = (
+    "{db_data}{paper_name}/counts/{caller}/{sample_name}_{genome}.txt"
+)
+
+
+def count_file_path(pattern, sample, data_path, extra=None) -> str:
+    """Fill in the count file path pattern for one sample.
+
+    Parameters:
+        pattern (str) :
+            path with {field} placeholders
+
+        sample (dict) :
+            query fields of the sample
+
+        data_path (str) :
+            data directory, filled in for {db_data}
+
+        extra (dict) :
+            other values to fill in, e.g. {genome} and {caller}
+
+    Returns:
+        path (str) :
+            path to the sample's count file
+    """
+    values = dict(sample)
+    values.update(extra or {})
+    values["db_data"] = data_path
+    try:
+        return pattern.format(**values)
+    except KeyError as err:
+        raise ValueError(
+            "Count file pattern field is not a query field: " + str(err)
+        )
+
+
+def read_feature_counts(path) -> tuple:
+    """Read a featureCounts output file.
+
+    Comment lines (#) are skipped. The header line names the
+    columns; the first column holds feature ids, the next four
+    the feature coordinates (Chr, Start, End, Strand) and the
+    last one the counts.
+
+    Parameters:
+        path (str) :
+            path to featureCounts output (optionally gzipped)
+
+    Returns:
+        ids (list) :
+            feature ids in file order
+
+        coords (list of tuples) :
+            (chromosome, start, end) of each feature
+
+        counts (numpy array) :
+            counts of each feature
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+    ids = []
+    coords = []
+    counts = []
+    with opener(path, "rt") as f:
+        header = None
+        for line in f:
+            if line.startswith("#"):
+                continue
+            fields = line.rstrip("\n").split("\t")
+            if header is None:
+                header = fields
+                continue
+            ids.append(fields[0])
+            coords.append((fields[1], fields[2], fields[3]))
+            counts.append(int(fields[-1]))
+    return ids, coords, np.array(counts, dtype=COUNT_DTYPE)
+
+
+def read_regions(path) -> tuple:
+    """Read a master merge region BED file.
+
+    Parameters:
+        path (str) :
+            BED file of regions (optionally gzipped); track,
+            browser and comment lines are skipped
+
+    Returns:
+        ids (list) :
+            region names (BED column 4), or chr:start-end if the
+            file has no names
+
+        coords (list of tuples) :
+            (chromosome, start, end) of each region, as strings,
+            in file order
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+    ids = []
+    coords = []
+    with opener(path, "rt") as f:
+        for line in f:
+            if line.startswith(("#", "track", "browser")) or not line.strip():
+                continue
+            fields = line.rstrip("\n").split("\t")
+            coords.append((fields[0], fields[1], fields[2]))
+            if len(fields) > 3 and fields[3]:
+                ids.append(fields[3])
+            else:
+                ids.append(fields[0] + ":" + fields[1] + "-" + fields[2])
+    return ids, coords
+
+
+def regions_match(coords, regions) -> bool:
+    """Check count file features against BED regions, in order.
+
+    featureCounts annotations (SAF) are 1-based, so a start one
+    past the BED start also matches, as long as every region is
+    shifted the same way.
+
+    Parameters:
+        coords (list of tuples) :
+            (chromosome, start, end) of each feature in a count file
+
+        regions (list of tuples) :
+            (chromosome, start, end) of each BED region
+
+    Returns:
+        match (boolean) :
+            whether the features are the regions, in the same order
+    """
+    if len(coords) != len(regions):
+        return False
+    if coords == regions:
+        return True
+    return all(
+        chrom == bed_chrom and end == bed_end
+        and int(start) == int(bed_start) + 1
+        for (chrom, start, end), (bed_chrom, bed_start, bed_end)
+        in zip(coords, regions)
+    )
+
+
+def sample_table(
+    dbconn, fields, filters=None, use_wide=False, resolver=None
+) -> tuple:
+    """Query samples and collapse their fields to one row per sample.
+
+    Fields with several values for a sample (e.g. treatments)
+    are joined with "; ", as in sampleWide.
+
+    Parameters:
+        dbconn (dbnascentConnection object) :
+            current db connection
+
+        fields (list) :
+            fields to return; sample_name and paper_name are added
+            if not present
+
+        filters (dict) :
+            filter specification for each field
+
+        use_wide (boolean) :
+            read sampleWide when it covers the query
+
+        resolver (SearchResolver object) :
+            translates filter values (see dbsearch.py)
+
+    Returns:
+        columns (list) :
+            field names, starting with sample_name
+
+        samples (list of dicts) :
+            one row per sample, in sample_name order
+    """
+    columns = ["sample_name", "paper_name"] + [
+        field for field in fields if field not in ("sample_name", "paper_name")
+    ]
+    query = dbquery.build_query(columns, filters, True, use_wide, resolver)
+    query = query.order_by(*query.selected_columns)
+
+    samples = {}
+    with dbconn.engine.connect() as conn:
+        for row in conn.execute(query):
+            values = samples.setdefault(row[0], [[] for col in columns])
+            for i, value in enumerate(row):
+                if value not in values[i]:
+                    values[i].append(value)
+
+    rows = []
+    for sample_name in sorted(samples):
+        row = {}
+        for col, values in zip(columns, samples[sample_name]):
+            if len(values) == 1:
+                row[col] = values[0]
+            else:
+                row[col] = "; ".join(str(value) for value in values)
+        rows.append(row)
+    return columns, rows
+
+
+def fill_count_matrix(
+    paths, names, matrix_path, workers=4, reader=None, regions=None
+):
+    """Read count files in parallel into a memory-mapped matrix.
+
+    Parameters:
+        paths (list) :
+            count file of each sample
+
+        names (list) :
+            sample names, for error messages
+
+        matrix_path (str) :
+            .npy file to hold the features x samples matrix
+
+        workers (int) :
+            number of files read at the same time
+
+        reader (function) :
+            reads one file into (ids, coords, counts)
+            (default read_feature_counts)
+
+        regions (list of tuples) :
+            if given, the (chromosome, start, end) every file
+            must list, in order (see regions_match)
+
+    Returns:
+        ids (list) :
+            feature ids, in matrix row order
+
+        coords (list of tuples) :
+            feature coordinates
+
+        matrix (numpy memmap) :
+            features x samples counts
+    """
+    reader = reader or read_feature_counts
+    ids, coords, first = reader(paths[0])
+    if regions is not None and not regions_match(coords, regions):
+        raise ValueError(
+            "Regions of " + names[0] + " (" + paths[0]
+            + ") do not match the master merge regions"
+        )
+    matrix = np.lib.format.open_memmap(
+        matrix_path, mode="w+", dtype=COUNT_DTYPE,
+        shape=(len(ids), len(paths)), fortran_order=True,
+    )
+    matrix[:, 0] = first
+
+    def load_column(j):
+        sample_ids, sample_coords, counts = reader(paths[j])
+        if regions is not None:
+            if not regions_match(sample_coords, regions):
+                raise ValueError(
+                    "Regions of " + names[j] + " (" + paths[j]
+                    + ") do not match the master merge regions"
+                )
+        elif sample_ids != ids:
+            raise ValueError(
+                "Features of " + names[j] + " (" + paths[j]
+                + ") do not match those of " + names[0]
+            )
+        matrix[:, j] = counts
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        # list() raises the first error from any worker
+        list(pool.map(load_column, range(1, len(paths))))
+    matrix.flush()
+
+    return ids, coords, matrix
+
+
+def write_count_table(ids, names, matrix, outfile, chunk_rows=10000) -> int:
+    """Stream a count matrix to a tab-delimited file.
+
+    Parameters:
+        ids (list) :
+            feature id of each row
+
+        names (list) :
+            sample name of each column
+
+        matrix (numpy array or memmap) :
+            features x samples counts
+
+        outfile (str) :
+            output path; gzipped if it ends in .gz
+
+        chunk_rows (int) :
+            number of rows converted at a time
+
+    Returns:
+        nrows (int) :
+            number of features written
+    """
+    if outfile.endswith(".gz"):
+        f = gzip.open(outfile, "wt", newline="")
+    else:
+        f = open(outfile, "w", newline="")
+    with f:
+        w = csv.writer(f, delimiter="\t", lineterminator="\n")
+        w.writerow(["feature_id"] + list(names))
+        for start in range(0, len(ids), chunk_rows):
+            block = np.asarray(matrix[start:start + chunk_rows, :])
+            for feature_id, counts in zip(ids[start:start + chunk_rows],
+                                          block.tolist()):
+                w.writerow([feature_id] + counts)
+    return len(ids)
+
+
+def write_coldata(columns, samples, outfile) -> int:
+    """Write the colData table of a count matrix.
+
+    Parameters:
+        columns (list) :
+            field names, starting with sample_name
+
+        samples (list of dicts) :
+            one row per matrix column, in the same order
+
+        outfile (str) :
+            output path
+
+    Returns:
+        nrows (int) :
+            number of samples written
+    """
+    with open(outfile, "w", newline="") as f:
+        w = csv.writer(f, delimiter="\t", lineterminator="\n")
+        w.writerow(columns)
+        for sample in samples:
+            w.writerow(["" if sample[col] is None else sample[col]
+                        for col in columns])
+    return len(samples)
+
+
+def build_matrix(
+    dbconn,
+    spec,
+    filters,
+    out_base,
+    data_path,
+    pattern,
+    workers=4,
+    use_wide=False,
+    resolver=None,
+    extra=None,
+    regions_path=None,
+) -> dict:
+    """Build a count matrix and colData table from a query.
+
+    Writes <out_base>_counts.npy (the memory-mapped matrix),
+    <out_base>_counts.tsv.gz and <out_base>_coldata.tsv.
+
+    Parameters:
+        dbconn (dbnascentConnection object) :
+            current db connection
+
+        spec (dict) :
+            query spec with "fields" and "filters"
+            (see dbquery.load_query_specs)
+
+        filters (dict) :
+            filters added to those of the spec
+
+        out_base (str) :
+            output path without extension
+
+        data_path (str) :
+            data directory, filled in for {db_data}
+
+        pattern (str) :
+            count file path pattern (see count_file_path)
+
+        workers (int) :
+            number of count files read at the same time
+
+        use_wide (boolean) :
+            read sampleWide when it covers the query
+
+        resolver (SearchResolver object) :
+            translates filter values (see dbsearch.py)
+
+        extra (dict) :
+            other values to fill in to the pattern
+
+        regions_path (str) :
+            if given, region BED file every count file must match;
+            its region names become the matrix row ids
+
+    Returns:
+        summary (dict) :
+            "samples" and "features" in the matrix, "missing"
+            (sample names without a count file) and "files"
+            (paths written)
+    """
+    query_filters = dict(spec.get("filters") or {})
+    query_filters.update(filters)
+    columns, samples = sample_table(
+        dbconn, spec["fields"], query_filters, use_wide, resolver
+    )
+
+    found = []
+    paths = []
+    missing = []
+    for sample in samples:
+        path = count_file_path(pattern, sample, data_path, extra)
+        if os.path.isfile(path):
+            found.append(sample)
+            paths.append(path)
+        else:
+            missing.append(sample["sample_name"])
+    if not found:
+        raise FileNotFoundError(
+            "No count files found for the queried samples"
+        )
+
+    regions = None
+    if regions_path is not None:
+        region_ids, regions = read_regions(regions_path)
+
+    names = [sample["sample_name"] for sample in found]
+    files = {
+        "matrix": out_base + "_counts.npy",
+        "counts": out_base + "_counts.tsv.gz",
+        "coldata": out_base + "_coldata.tsv",
+    }
+    ids, coords, matrix = fill_count_matrix(
+        paths, names, files["matrix"], workers, regions=regions
+    )
+    if regions is not None:
+        ids = region_ids
+    write_count_table(ids, names, matrix, files["counts"])
+    write_coldata(columns, found, files["coldata"])
+
+    return {
+        "samples": len(names),
+        "features": len(ids),
+        "missing": missing,
+        "files": files,
+    }
+
+
+def build_gene_matrix(
+    dbconn,
+    spec,
+    out_base,
+    data_path,
+    pattern=DEFAULT_GENE_COUNTS,
+    workers=4,
+    use_wide=False,
+    resolver=None,
+) -> dict:
+    """Build a gene count matrix and colData table from a query.
+
+    Only samples with fcgene_avail are used. See build_matrix
+    for the files written.
+
+    Parameters:
+        dbconn (dbnascentConnection object) :
+            current db connection
+
+        spec (dict) :
+            query spec with "fields" and "filters"
+
+        out_base (str) :
+            output path without extension
+
+        data_path (str) :
+            data directory, filled in for {db_data}
+
+        pattern (str) :
+            count file path pattern (see count_file_path)
+
+        workers (int) :
+            number of count files read at the same time
+
+        use_wide (boolean) :
+            read sampleWide when it covers the query
+
+        resolver (SearchResolver object) :
+            translates filter values (see dbsearch.py)
+
+    Returns:
+        summary (dict) :
+            see build_matrix
+    """
+    return build_matrix(
+        dbconn, spec, GENE_FILTER, out_base, data_path, pattern,
+        workers, use_wide, resolver,
+    )
+
+
+def build_bidir_matrix(
+    dbconn,
+    spec,
+    out_base,
+    data_path,
+    genome,
+    caller,
+    regions_path,
+    pattern=DEFAULT_BIDIR_COUNTS,
+    workers=4,
+    use_wide=False,
+    resolver=None,
+) -> dict:
+    """Build a master merge region count matrix from a query.
+
+    Only samples of the genome with fcbidir_avail that are included
+    in the caller's master merge are used. Matrix rows are the
+    master merge regions, in BED order. See build_matrix for the
+    files written.
+
+    Parameters:
+        dbconn (dbnascentConnection object) :
+            current db connection
+
+        spec (dict) :
+            query spec with "fields" and "filters"
+
+        out_base (str) :
+            output path without extension
+
+        data_path (str) :
+            data directory, filled in for {db_data}
+
+        genome (str) :
+            genome build (e.g. "hg38" or "mm10")
+
+        caller (str) :
+            bidir caller ("tfit" or "dreg")
+
+        regions_path (str) :
+            master merge region BED file for the genome and caller
+
+        pattern (str) :
+            count file path pattern (see count_file_path);
+            {genome} and {caller} are filled in as well
+
+        workers (int) :
+            number of count files read at the same time
+
+        use_wide (boolean) :
+            read sampleWide when it covers the query
+
+        resolver (SearchResolver object) :
+            translates filter values (see dbsearch.py)
+
+    Returns:
+        summary (dict) :
+            see build_matrix
+    """
+    if caller not in BIDIR_CALLERS:
+        raise ValueError("Bidir caller must be tfit or dreg: " + caller)
+    filters = {
+        "fcbidir_avail": True,
+        caller + "_master_merge_incl": True,
+        "genome_build": genome,
+    }
+    return build_matrix(
+        dbconn, spec, filters, out_base, data_path, pattern, workers,
+        use_wide, resolver, {"genome": genome, "caller": caller},
+        regions_path,
+    )
+
+# dbmatrix.py ends here
@@ -33,7 +33,7 @@ class organisms(Base):
         unique=True,
         autoincrement=True,
     )
-    organism = sql.Column(sql.String(length=127))
+    organism = sql.Column(sql.String(length=127), index=True)
     genome_build = sql.Column(sql.String(length=50))
     genome_bases = sql.Column(sql.BigInteger, nullable=True)
 
@@ -105,10 +105,11 @@ class papers(Base):
     organism_id = sql.Column(
         sql.Integer,
         sql.ForeignKey("organisms.id"),
+        index=True,
     )
     library = sql.Column(sql.String(length=50))
     spikein = sql.Column(sql.String(length=127), nullable=True)
-    paper_name = sql.Column(sql.String(length=127))
+    paper_name = sql.Column(sql.String(length=127), index=True)
     published = sql.Column(sql.Boolean)
     year = sql.Column(sql.Integer)
     first_author = sql.Column(sql.String(length=127))
@@ -136,7 +137,7 @@ class samples(Base):
         unique=True,
         autoincrement=True,
     )
-    sample_name = sql.Column(sql.String(length=50))
+    sample_name = sql.Column(sql.String(length=50), index=True)
     replicate = sql.Column(sql.String(length=50))
     single_paired = sql.Column(sql.String(length=50))
     rcomp = sql.Column(sql.Boolean)
@@ -144,7 +145,7 @@ class samples(Base):
     mapped_strandedness = sql.Column(sql.String(length=50))
     unusable = sql.Column(sql.Boolean)
     timecourse = sql.Column(sql.Boolean)
-    control_experimental = sql.Column(sql.String(length=50))
+    control_experimental = sql.Column(sql.String(length=50), index=True)
     wildtype_untreated = sql.Column(sql.Boolean)
     outlier = sql.Column(sql.Boolean)
     notes = sql.Column(sql.String(length=300), nullable=True)
@@ -188,9 +189,11 @@ class sampleEquiv(Base):
     sample_id = sql.Column(
         sql.Integer,
         sql.ForeignKey("samples.id"),
+        index=True,
     )
     srr = sql.Column(
         sql.String(length=50),
+        index=True,
     )
 
 # Genetic info, including organism, sample type, cell type, and
@@ -207,12 +210,14 @@ class genetics(Base):
     organism_id = sql.Column(
         sql.Integer,
         sql.ForeignKey("organisms.id"),
+        index=True,
     )
     sample_type = sql.Column(sql.String(length=127))
-    cell_type = sql.Column(sql.String(length=127))
+    cell_type = sql.Column(sql.String(length=127), index=True)
     tissue_id = sql.Column(
         sql.Integer,
         sql.ForeignKey("tissues.id"),
+        index=True,
     )
     clone_individual = sql.Column(sql.String(length=127), nullable=True)
     strain = sql.Column(sql.String(length=127), nullable=True)
@@ -254,8 +259,8 @@ class conditions(Base):
         unique=True,
         autoincrement=True,
     )
-    condition_type = sql.Column(sql.String(length=127))
-    treatment = sql.Column(sql.String(length=127))
+    condition_type = sql.Column(sql.String(length=127), index=True)
+    treatment = sql.Column(sql.String(length=127), index=True)
     conc_intens = sql.Column(sql.String(length=50), nullable=True)
     start_time = sql.Column(sql.Integer, nullable=True)
     end_time = sql.Column(sql.Integer, nullable=True)
@@ -276,10 +281,12 @@ class conditionLink(Base):
     sample_id = sql.Column(
         sql.Integer,
         sql.ForeignKey("samples.id"),
+        index=True,
     )
     condition_id = sql.Column(
         sql.Integer,
         sql.ForeignKey("conditions.id"),
+        index=True,
     )
 
 
@@ -369,10 +376,12 @@ class bidirflowLink(Base):
     sample_id = sql.Column(
         sql.Integer,
         sql.ForeignKey("samples.id"),
+        index=True,
     )
     bidirflow_id = sql.Column(
         sql.Integer,
         sql.ForeignKey("bidirflowRuns.id"),
+        index=True,
     )
 
 # Linkage table of each sample to nascentflow run(s)
@@ -388,10 +397,12 @@ class nascentflowLink(Base):
     sample_id = sql.Column(
         sql.Integer,
         sql.ForeignKey("samples.id"),
+        index=True,
     )
     nascentflow_id = sql.Column(
         sql.Integer,
         sql.ForeignKey("nascentflowRuns.id"),
+        index=True,
     )
 
 # Main linkage table between sample, genetic, and expt IDs
@@ -407,18 +418,154 @@ class linkIDs(Base):
     sample_id = sql.Column(
         sql.Integer,
         sql.ForeignKey("samples.id"),
+        index=True,
     )
     genetic_id = sql.Column(
         sql.Integer,
         sql.ForeignKey("genetics.id"),
+        index=True,
     )
     paper_id = sql.Column(
         sql.Integer,
         sql.ForeignKey("papers.id"),
+        index=True,
     )
     bidir_id = sql.Column(
         sql.Integer,
         sql.ForeignKey("bidirs.id"),
+        index=True,
+    )
+
+# BUILD METADATA
+
+# Single-row version stamp, bumped by every build/ingest run
+class dbVersion(Base):
+    __tablename__ = "dbVersion"
+    id = sql.Column(
+        sql.Integer,
+        primary_key=True,
+        index=True,
+        unique=True,
+        autoincrement=True,
+    )
+    version = sql.Column(sql.Integer)
+    updated = sql.Column(sql.DateTime)
+    description = sql.Column(sql.String(length=250), nullable=True)
+
+# Papers included in each tfit/dreg master merge, parsed from the
+# master merge lists once per build (see db_global_add_update.py).
+# paper_name has no foreign key so papers can be listed before ingest
+class mergeMembership(Base):
+    __tablename__ = "mergeMembership"
+    id = sql.Column(
+        sql.Integer,
+        primary_key=True,
+        index=True,
+        unique=True,
+        autoincrement=True,
+    )
+    paper_name = sql.Column(sql.String(length=127))
+    genome = sql.Column(sql.String(length=50))
+    caller = sql.Column(sql.String(length=50))
+    __table_args__ = (
+        sql.Index(
+            "ix_mergeMembership_paper_name_caller", "paper_name", "caller"
+        ),
+    )
+
+# DENORMALIZED TABLES
+
+# Tables with one row per sample whose fields are copied into sampleWide
+sample_wide_sources = [samples, papers, genetics, organisms, tissues, bidirs]
+
+# Condition and run fields aggregated per sample into sampleWide,
+# under their own names: name -> (table, column, aggregate), where
+# aggregate is "list" (distinct values joined by "; "), "count"
+# (number of distinct values) or "max"
+sample_wide_aggregates = {
+    "condition_types": ("conditions", "condition_type", "list"),
+    "treatments": ("conditions", "treatment", "list"),
+    "num_conditions": ("conditions", "id", "count"),
+    "nascentflow_versions": ("nascentflowRuns", "nascentflow_version", "list"),
+    "latest_nascentflow_date": ("nascentflowRuns", "nascentflow_date", "max"),
+    "bidirflow_versions": ("bidirflowRuns", "bidirflow_version", "list"),
+    "latest_bidirflow_date": ("bidirflowRuns", "bidirflow_date", "max"),
+    "latest_tfit_date": ("bidirflowRuns", "tfit_date", "max"),
+    "latest_dreg_date": ("bidirflowRuns", "dreg_date", "max"),
+    "latest_fcgene_date": ("bidirflowRuns", "fcgene_date", "max"),
+    "latest_fcbidir_date": ("bidirflowRuns", "fcbidir_date", "max"),
+}
+
+# Commonly filtered sampleWide fields
+sample_wide_indexes = [
+    "sample_name", "control_experimental", "sample_qc_score",
+    "paper_name", "protocol", "cell_type", "organism", "tissue",
+]
+
+
+def _sample_wide_columns():
+    """Build the sampleWide column list from the source tables."""
+    columns = [
+        sql.Column("sample_id", sql.Integer, primary_key=True,
+                   autoincrement=False),
+        # Ids of the joined rows; null where a sample has no such row
+        sql.Column("paper_id", sql.Integer, nullable=True),
+        sql.Column("genetic_id", sql.Integer, nullable=True),
+        sql.Column("organism_id", sql.Integer, nullable=True),
+        sql.Column("tissue_id", sql.Integer, nullable=True),
+        sql.Column("bidir_id", sql.Integer, nullable=True),
+    ]
+    for source in sample_wide_sources:
+        for col in source.__table__.columns:
+            if col.primary_key or col.foreign_keys:
+                continue
+            columns.append(sql.Column(
+                col.name, col.type, nullable=True,
+                index=col.name in sample_wide_indexes,
+            ))
+    for name, (table, field, aggregate) in sample_wide_aggregates.items():
+        if aggregate == "list":
+            col_type = sql.String(length=1024)
+        elif aggregate == "count":
+            col_type = sql.Integer
+        else:
+            col_type = Base.metadata.tables[table].c[field].type
+        columns.append(sql.Column(name, col_type, nullable=True))
+    return columns
+
+
+# One row per sample with every one-to-one field joined from linkIDs,
+# plus the aggregated fields above; rebuilt at the end of each build
+# (see sample_wide_refresh.py) so most queries need no joins
+class sampleWide(Base):
+    __table__ = sql.Table("sampleWide", Base.metadata, *_sample_wide_columns())
+
+# Fields with precomputed sample and paper counts per value
+facet_fields = [
+    "organism", "cell_type", "protocol", "treatment",
+    "control_experimental", "sample_qc_score", "sample_nro_score",
+]
+
+# Number of samples in each paper per (facet field, value, organism);
+# summed over papers to serve facet counts without scanning the main
+# tables, and refreshed one paper at a time (see dbfacets.py).
+# paper_id has no foreign key so the table is not joined into queries
+class facetCounts(Base):
+    __tablename__ = "facetCounts"
+    id = sql.Column(
+        sql.Integer,
+        primary_key=True,
+        index=True,
+        unique=True,
+        autoincrement=True,
+    )
+    paper_id = sql.Column(sql.Integer, index=True)
+    field = sql.Column(sql.String(length=50))
+    value = sql.Column(sql.String(length=250), nullable=True)
+    organism = sql.Column(sql.String(length=127), nullable=True)
+    num_samples = sql.Column(sql.Integer)
+    __table_args__ = (
+        sql.Index("ix_facetCounts_field_organism", "field", "organism"),
     )
 
 # dborm.py ends here
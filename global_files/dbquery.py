@@ -0,0 +1,786 @@
+"""Build DBNascent queries from field and filter specifications.
+
+Filename: dbquery.py
+Authors: Lynn Sanford <lynn.sanford@colorado.edu>
+
+Commentary:
+    This module compiles the fields and filters used in
+    query_printout.py into a SQLAlchemy Core select() with bound
+    parameters, so queries can be built from code or from query
+    spec files instead of by editing and string-pasting SQL.
+
+    A query spec is a YAML or JSON mapping (or a list of them):
+
+        fields: [sample_name, paper_name, organism]
+        filters:
+          organism: '= "H. sapiens"'
+          cell_type: ['IN ("HEK293","HEK293T")']
+          sample_qc_score: {"<": 4}
+        outfile: /path/to/output.tsv
+
+    Filters take the strings used in query_printout.py or values
+    in the form taken by dbutils.filter_clause.
+
+    Joins are derived from the ORM foreign keys: only the tables
+    needed for the requested fields are joined, and filters on
+    tables with several rows per sample (conditions, flow runs,
+    sampleEquiv) become EXISTS subqueries when those tables are
+    not part of the output, so they do not multiply result rows.
+
+    Long lists of SRRs or sample names are looked up with
+    lookup_samples, which loads them into a temporary table and
+    joins it to the database on the server, instead of pasting
+    them into an IN (...) filter.
+
+Functions:
+    join_tree() -> dict
+    join_path(str) -> list
+    join_edge(str, set) -> tuple
+    plan_joins(list, str) -> list
+    plan_query(list, dict) -> dict
+    build_query(list, dict, bool, bool, object, list) -> sqlalchemy Select
+    wide_fields(list) -> bool
+    wide_query(list, dict, bool, object, list) -> sqlalchemy Select
+    sample_wide_select(str, list) -> sqlalchemy Select
+    refresh_sample_wide(object, list) -> int
+    sample_wide_current(object) -> bool
+    lookup_table() -> sqlalchemy Table
+    lookup_query(object, list, str) -> sqlalchemy Select
+    lookup_samples(object, list, list, str, int) -> generator
+    query_text(object, object) -> str
+    load_query_specs(str) -> list
+"""
+
+import json
+
+import dborm
+import dbutils
+import sqlalchemy as sql
+import yaml
+
+
+def join_tree() -> dict:
+    """Derive how each table is reached from linkIDs from ORM foreign keys.
+
+    Tables are visited breadth first from linkIDs, following foreign
+    keys in both directions in ORM column order, so each table is
+    reached by its shortest path (organisms through genetics, as
+    linkIDs lists genetic_id before paper_id).
+
+    Returns:
+        tree (dict) :
+            table -> (table it is joined to, that table's join
+            column, this table's join column, whether the join
+            can match many rows per row joined so far), in
+            breadth-first order
+    """
+    db_tables = dborm.Base.metadata.tables
+    tree = {}
+    queue = ["linkIDs"]
+    while queue:
+        table = queue.pop(0)
+        edges = []
+        # Foreign keys on this table match one row each
+        for col in db_tables[table].columns:
+            for fk in col.foreign_keys:
+                edges.append(
+                    (fk.column.table.name, col.name, fk.column.name, False)
+                )
+        # Foreign keys pointing to this table may match many rows
+        for other, other_obj in db_tables.items():
+            for col in other_obj.columns:
+                for fk in col.foreign_keys:
+                    if fk.column.table.name == table:
+                        edges.append(
+                            (other, fk.column.name, col.name, True)
+                        )
+        for next_table, parent_col, col, many in edges:
+            if next_table == "linkIDs" or next_table in tree:
+                continue
+            tree[next_table] = (table, parent_col, col, many)
+            queue.append(next_table)
+
+    return tree
+
+
+JOIN_TREE = join_tree()
+SAMPLE_WIDE_SOURCES = [
+    source.__tablename__ for source in dborm.sample_wide_sources
+]
+# sampleWide columns holding the id of each joined source row
+SAMPLE_WIDE_ID_TABLES = {
+    "paper_id": "papers",
+    "genetic_id": "genetics",
+    "organism_id": "organisms",
+    "tissue_id": "tissues",
+    "bidir_id": "bidirs",
+}
+SAMPLE_WIDE_IDS = {
+    table: col for col, table in SAMPLE_WIDE_ID_TABLES.items()
+}
+# dbVersion description set by a full sampleWide rebuild
+SAMPLE_WIDE_REFRESH = "sampleWide refresh"
+# Identifier types for bulk lookups: table and column matched
+LOOKUP_KEYS = {
+    "srr": ("sampleEquiv", "srr"),
+    "sample_name": ("samples", "sample_name"),
+}
+LOOKUP_FIELDS = ["sample_name", "paper_name", "cell_type"]
+
+
+def join_path(table) -> list:
+    """List the tables joined between linkIDs and a table.
+
+    Parameters:
+        table (str) :
+            table name
+
+    Returns:
+        path (list) :
+            tables from the one joined to linkIDs down to table
+    """
+    path = []
+    while table != "linkIDs":
+        if table not in JOIN_TREE:
+            raise ValueError(
+                "Table cannot be joined from linkIDs: " + table
+            )
+        path.insert(0, table)
+        table = JOIN_TREE[table][0]
+    return path
+
+
+def join_edge(table, requested) -> tuple:
+    """Find the join condition for a table, skipping unneeded tables.
+
+    A table reached by the same key as its parent (e.g.
+    conditionLink.sample_id and samples.id) is joined directly to
+    the parent's parent (linkIDs.sample_id) unless the parent
+    itself is requested.
+
+    Parameters:
+        table (str) :
+            table to join
+
+        requested (set) :
+            tables holding query or filter fields
+
+    Returns:
+        edge (tuple) :
+            (table joined to, its join column, this table's
+            join column)
+    """
+    parent, parent_col, col, many = JOIN_TREE[table]
+    while (parent != "linkIDs"
+           and parent not in requested
+           and not JOIN_TREE[parent][3]
+           and JOIN_TREE[parent][2] == parent_col):
+        parent, parent_col = JOIN_TREE[parent][0:2]
+    return parent, parent_col, col
+
+
+def plan_joins(tables, root="linkIDs") -> list:
+    """Choose the smallest set of joins reaching the given tables.
+
+    Parameters:
+        tables (list) :
+            tables holding query or filter fields
+
+        root (str) :
+            table the joins start from
+
+    Returns:
+        joins (list of tuples) :
+            (table, table joined to, its join column, this
+            table's join column) in join order
+    """
+    requested = set(tables)
+    edges = {}
+    stack = [table for table in tables if table != root]
+    while stack:
+        table = stack.pop()
+        if table in edges:
+            continue
+        edges[table] = join_edge(table, requested | {root})
+        if edges[table][0] != root and edges[table][0] != "linkIDs":
+            stack.append(edges[table][0])
+
+    return [(table,) + edges[table] for table in JOIN_TREE
+            if table in edges]
+
+
+def plan_query(fields, filters=None) -> dict:
+    """Plan the joins and filters of a query.
+
+    Tables holding query fields are joined. A filter on a table
+    that can match many rows per linkIDs row (conditions,
+    sampleEquiv, flow runs and their link tables) is checked with
+    an EXISTS subquery unless the query already joins those rows,
+    so it does not multiply the result rows. Filters on the same
+    such table are checked together, so they must all hold for
+    the same row.
+
+    Parameters:
+        fields (list) :
+            fields to return
+
+        filters (dict) :
+            filter specification for each field
+
+    Returns:
+        plan (dict) :
+            "fields": table of each field
+            "joins": joins from linkIDs (see plan_joins)
+            "filters": (table, field, spec) filters on the joins
+            "exists": list of dicts with "joins" (the first joined
+            to the outer query) and "filters" for each subquery
+    """
+    filters = filters or {}
+    field_tables = {field: dbutils.resolve_field(field) for field in fields}
+    outer = set(field_tables.values())
+    spanned = set()
+    for table in outer:
+        spanned.update(join_path(table))
+
+    outer_filters = []
+    semi_filters = {}
+    for field, spec in filters.items():
+        table = dbutils.resolve_field(field)
+        entry = None
+        for path_table in join_path(table):
+            if JOIN_TREE[path_table][3] and path_table not in spanned:
+                entry = path_table
+                break
+        if entry is None:
+            outer.add(table)
+            outer_filters.append((table, field, spec))
+        else:
+            semi_filters.setdefault(entry, []).append((table, field, spec))
+
+    # Subqueries are joined to the outer query by their first table
+    entry_edges = {}
+    for entry in semi_filters:
+        entry_edges[entry] = join_edge(entry, outer)
+        if entry_edges[entry][0] != "linkIDs":
+            outer.add(entry_edges[entry][0])
+
+    exists = []
+    for entry, entry_filters in semi_filters.items():
+        sub_tables = [table for table, field, spec in entry_filters]
+        exists.append({
+            "joins": [(entry,) + entry_edges[entry]]
+            + plan_joins(sub_tables, root=entry),
+            "filters": entry_filters,
+        })
+
+    return {
+        "fields": field_tables,
+        "joins": plan_joins(list(outer)),
+        "filters": outer_filters,
+        "exists": exists,
+    }
+
+
+def _join_from(from_clause, joins, outer=False):
+    """Add planned inner (or left outer) joins to a FROM clause."""
+    db_tables = dborm.Base.metadata.tables
+    for table, parent, parent_col, col in joins:
+        from_clause = from_clause.join(
+            db_tables[table],
+            db_tables[parent].c[parent_col] == db_tables[table].c[col],
+            isouter=outer,
+        )
+    return from_clause
+
+
+def build_query(
+    fields, filters=None, distinct=True, use_wide=False, resolver=None,
+    sample_ids=None,
+) -> sql.sql.Select:
+    """Compile fields and filters into a select statement.
+
+    Fields are matched to the first ORM table containing them
+    (see dbutils.resolve_field) and joins are chosen by
+    plan_query. All filters must hold. With use_wide, queries
+    whose fields and filters are all in sampleWide read that
+    table instead (see sample_wide_current).
+
+    Parameters:
+        fields (list) :
+            fields to return
+
+        filters (dict) :
+            filter specification for each field
+            (see dbutils.normalize_filter)
+
+        distinct (boolean) :
+            SELECT DISTINCT, as in query_printout.py
+
+        use_wide (boolean) :
+            read sampleWide when it covers the query; only
+            correct if sampleWide is up to date
+
+        resolver (SearchResolver object) :
+            translates filter values to canonical database
+            values (see dbsearch.py)
+
+        sample_ids (list) :
+            if given, only return these samples (database ids,
+            e.g. from dbbitmap.BitmapIndex.select)
+
+    Returns:
+        query (sqlalchemy Select) :
+            query with all filter values as bound parameters
+    """
+    if not fields:
+        raise ValueError("No query fields given")
+    db_tables = dborm.Base.metadata.tables
+    all_fields = list(fields) + list(filters or {})
+    aggregated = any(
+        field in dborm.sample_wide_aggregates for field in all_fields
+    )
+    # Aggregated fields only exist in sampleWide
+    if wide_fields(all_fields) and (use_wide or aggregated):
+        return wide_query(fields, filters, distinct, resolver, sample_ids)
+    plan = plan_query(fields, filters)
+
+    def add_filters(query, table_filters):
+        for table, field, spec in table_filters:
+            column = db_tables[table].c[field]
+            for crit in dbutils.normalize_filter(spec):
+                if resolver is not None:
+                    crit = resolver.translate(field, crit)
+                query = query.where(dbutils.filter_clause(column, crit))
+        return query
+
+    query = sql.select(
+        *[db_tables[plan["fields"][field]].c[field] for field in fields]
+    ).select_from(_join_from(db_tables["linkIDs"], plan["joins"]))
+    if distinct:
+        query = query.distinct()
+    if sample_ids is not None:
+        query = query.where(db_tables["linkIDs"].c.sample_id.in_(
+            [int(sample_id) for sample_id in sample_ids]
+        ))
+    query = add_filters(query, plan["filters"])
+
+    for semi in plan["exists"]:
+        entry, parent, parent_col, col = semi["joins"][0]
+        subquery = sql.select(sql.literal(1)).select_from(
+            _join_from(db_tables[entry], semi["joins"][1:])
+        ).where(db_tables[entry].c[col] == db_tables[parent].c[parent_col])
+        subquery = add_filters(subquery, semi["filters"])
+        query = query.where(subquery.exists())
+
+    return query
+
+
+def wide_fields(fields) -> bool:
+    """Check whether sampleWide holds all the given fields.
+
+    Parameters:
+        fields (list) :
+            query and filter fields
+
+    Returns:
+        covered (boolean) :
+            True if every field is a sampleWide field; raises an
+            error if aggregated fields are mixed with others
+    """
+    covered = True
+    aggregated = False
+    for field in fields:
+        if field in dborm.sample_wide_aggregates:
+            aggregated = True
+        elif dbutils.resolve_field(field) not in SAMPLE_WIDE_SOURCES:
+            covered = False
+    if aggregated and not covered:
+        raise ValueError(
+            "Aggregated sample fields ("
+            + ", ".join(dborm.sample_wide_aggregates.keys())
+            + ") can only be queried with fields of "
+            + ", ".join(SAMPLE_WIDE_SOURCES)
+        )
+    return covered
+
+
+def wide_query(
+    fields, filters=None, distinct=True, resolver=None, sample_ids=None
+) -> sql.sql.Select:
+    """Compile a query against sampleWide.
+
+    Returns the same rows as joining the source tables: rows are
+    limited to samples that have a row in each source table used.
+
+    Parameters:
+        fields (list) :
+            fields to return
+
+        filters (dict) :
+            filter specification for each field
+
+        distinct (boolean) :
+            SELECT DISTINCT
+
+        resolver (SearchResolver object) :
+            translates filter values to canonical database values
+
+        sample_ids (list) :
+            if given, only return these samples
+
+    Returns:
+        query (sqlalchemy Select) :
+            query with all filter values as bound parameters
+    """
+    filters = filters or {}
+    wide = dborm.sampleWide.__table__
+    query = sql.select(*[wide.c[field] for field in fields])
+    if distinct:
+        query = query.distinct()
+    if sample_ids is not None:
+        query = query.where(wide.c.sample_id.in_(
+            [int(sample_id) for sample_id in sample_ids]
+        ))
+
+    used = set()
+    for field in list(fields) + list(filters):
+        if field not in dborm.sample_wide_aggregates:
+            used.add(dbutils.resolve_field(field))
+    for table in sorted(used):
+        if table in SAMPLE_WIDE_IDS:
+            query = query.where(wide.c[SAMPLE_WIDE_IDS[table]].isnot(None))
+
+    for field, spec in filters.items():
+        for crit in dbutils.normalize_filter(spec):
+            if resolver is not None:
+                crit = resolver.translate(field, crit)
+            query = query.where(dbutils.filter_clause(wide.c[field], crit))
+
+    return query
+
+
+def _aggregate(column, aggregate, dialect_name):
+    """Aggregate expression for one sampleWide field."""
+    if aggregate == "count":
+        return sql.func.count(sql.distinct(column))
+    if aggregate == "max":
+        return sql.func.max(column)
+    if dialect_name == "mysql":
+        name = column.table.name + "." + column.name
+        return sql.func.group_concat(sql.literal_column(
+            "DISTINCT " + name + " ORDER BY " + name + " SEPARATOR '; '"
+        ))
+    return sql.func.group_concat(sql.distinct(column))
+
+
+def sample_wide_select(dialect_name, sample_ids=None) -> sql.sql.Select:
+    """Build the query that fills sampleWide.
+
+    Parameters:
+        dialect_name (str) :
+            database dialect ("mysql" uses GROUP_CONCAT options;
+            other dialects join lists with ",")
+
+        sample_ids (list) :
+            limit to these samples (default all)
+
+    Returns:
+        query (sqlalchemy Select) :
+            one row per sample, columns in sampleWide order
+    """
+    db_tables = dborm.Base.metadata.tables
+    wide = dborm.sampleWide.__table__
+    link = db_tables["linkIDs"]
+    samples = db_tables["samples"]
+
+    # One-to-one tables are outer joined so samples missing e.g.
+    # bidirs still get a row, with a null bidir_id
+    from_clause = link.join(samples, link.c.sample_id == samples.c.id)
+    for table, parent, parent_col, col in plan_joins(SAMPLE_WIDE_SOURCES):
+        if table == "samples":
+            continue
+        from_clause = from_clause.outerjoin(
+            db_tables[table],
+            db_tables[parent].c[parent_col] == db_tables[table].c[col],
+        )
+
+    columns = []
+    for col in wide.columns:
+        if col.name == "sample_id":
+            columns.append(samples.c.id.label(col.name))
+        elif col.name in SAMPLE_WIDE_ID_TABLES:
+            table = SAMPLE_WIDE_ID_TABLES[col.name]
+            columns.append(db_tables[table].c.id.label(col.name))
+        elif col.name in dborm.sample_wide_aggregates:
+            table, field, aggregate = dborm.sample_wide_aggregates[col.name]
+            entry = join_path(table)[0]
+            entry_parent, parent_col, entry_col = join_edge(entry, set())
+            subquery = sql.select(_aggregate(
+                db_tables[table].c[field], aggregate, dialect_name
+            )).select_from(
+                _join_from(db_tables[entry], plan_joins([table], root=entry))
+            ).where(
+                db_tables[entry].c[entry_col]
+                == db_tables[entry_parent].c[parent_col]
+            )
+            columns.append(subquery.scalar_subquery().label(col.name))
+        else:
+            table = dbutils.resolve_field(col.name)
+            columns.append(db_tables[table].c[col.name])
+
+    query = sql.select(*columns).select_from(from_clause)
+    if sample_ids is not None:
+        query = query.where(samples.c.id.in_(list(sample_ids)))
+
+    return query
+
+
+def refresh_sample_wide(dbconn, sample_ids=None) -> int:
+    """Rebuild sampleWide, or refresh the rows of some samples.
+
+    Old rows are replaced in one transaction, so queries see either
+    the old or the new contents. A full rebuild bumps the database
+    version, marking sampleWide as current until the next
+    build/ingest run bumps it again.
+
+    Parameters:
+        dbconn (dbnascentConnection object) :
+            current db connection
+
+        sample_ids (list) :
+            samples to refresh (default all)
+
+    Returns:
+        nrows (int) :
+            number of sampleWide rows written
+    """
+    wide = dborm.sampleWide.__table__
+    wide.create(dbconn.engine, checkfirst=True)
+    query = sample_wide_select(dbconn.engine.dialect.name, sample_ids)
+
+    with dbconn.engine.begin() as conn:
+        delete = wide.delete()
+        if sample_ids is not None:
+            delete = delete.where(wide.c.sample_id.in_(list(sample_ids)))
+        conn.execute(delete)
+        conn.execute(wide.insert().from_select(
+            [col.name for col in wide.columns], query
+        ))
+        count = sql.select(sql.func.count()).select_from(wide)
+        if sample_ids is not None:
+            count = count.where(wide.c.sample_id.in_(list(sample_ids)))
+        nrows = conn.execute(count).scalar()
+
+    if sample_ids is None:
+        dbconn.bump_version(SAMPLE_WIDE_REFRESH)
+
+    return nrows
+
+
+def sample_wide_current(dbconn) -> bool:
+    """Check whether sampleWide was rebuilt after the last change.
+
+    Parameters:
+        dbconn (dbnascentConnection object) :
+            current db connection
+
+    Returns:
+        current (boolean) :
+            True if the latest database version was set by a
+            full sampleWide rebuild
+    """
+    table = dborm.dbVersion.__table__
+    try:
+        row = dbconn.engine.execute(
+            sql.select(table.c.description).order_by(table.c.id)
+        ).first()
+    except sql.exc.DBAPIError:
+        return False
+    return row is not None and row[0] == SAMPLE_WIDE_REFRESH
+
+
+def lookup_table() -> sql.Table:
+    """Define the temporary table holding identifiers to look up.
+
+    Returns:
+        table (sqlalchemy Table) :
+            temporary table with input position and identifier
+    """
+    return sql.Table(
+        "lookupIdentifiers",
+        sql.MetaData(),
+        sql.Column("position", sql.Integer, primary_key=True),
+        sql.Column("identifier", sql.String(length=127)),
+        prefixes=["TEMPORARY"],
+    )
+
+
+def lookup_query(lookup, fields=None, key="srr") -> sql.sql.Select:
+    """Join a table of identifiers to samples and query fields.
+
+    Every identifier gives at least one row, in input order, with
+    empty fields if it matched no sample.
+
+    Parameters:
+        lookup (sqlalchemy Table) :
+            identifier table (see lookup_table)
+
+        fields (list) :
+            fields to return for each sample
+
+        key (str) :
+            identifier type, a key of LOOKUP_KEYS
+
+    Returns:
+        query (sqlalchemy Select) :
+            query returning identifier, found and the fields
+    """
+    if key not in LOOKUP_KEYS:
+        raise ValueError(
+            "Lookup key must be one of " + ", ".join(LOOKUP_KEYS)
+            + ": " + key
+        )
+    fields = fields or LOOKUP_FIELDS
+    db_tables = dborm.Base.metadata.tables
+    key_table, key_col = LOOKUP_KEYS[key]
+    key_obj = db_tables[key_table]
+    if key_table == "samples":
+        sample_col = key_obj.c.id
+    else:
+        sample_col = key_obj.c.sample_id
+
+    field_tables = {field: dbutils.resolve_field(field) for field in fields}
+    from_clause = lookup.outerjoin(
+        key_obj, key_obj.c[key_col] == lookup.c.identifier
+    ).outerjoin(
+        db_tables["linkIDs"], db_tables["linkIDs"].c.sample_id == sample_col
+    )
+    # The matched identifier table is already joined
+    joins = plan_joins(list(set(field_tables.values()) - {key_table}))
+    from_clause = _join_from(
+        from_clause,
+        [join for join in joins if join[0] != key_table],
+        outer=True,
+    )
+
+    return sql.select(
+        lookup.c.identifier,
+        (key_obj.c.id != None).label("found"),
+        *[db_tables[field_tables[field]].c[field] for field in fields]
+    ).select_from(from_clause).order_by(lookup.c.position)
+
+
+def lookup_samples(
+    dbconn, identifiers, fields=None, key="srr", chunk_size=10000
+):
+    """Look up samples for a list of SRRs or sample names.
+
+    The identifiers are bulk inserted into a temporary table on
+    one connection and joined to the database there, then results
+    are streamed back in input order.
+
+    Parameters:
+        dbconn (dbnascentConnection object) :
+            current db connection
+
+        identifiers (list) :
+            SRRs or sample names to look up
+
+        fields (list) :
+            fields to return for each sample (default LOOKUP_FIELDS)
+
+        key (str) :
+            identifier type, "srr" or "sample_name"
+
+        chunk_size (int) :
+            number of rows inserted and returned at a time
+
+    Yields:
+        chunk (list of tuples) :
+            rows of identifier, found (boolean) and the fields
+    """
+    lookup = lookup_table()
+    query = lookup_query(lookup, fields, key)
+    with dbconn.engine.connect() as conn:
+        lookup.create(conn)
+        try:
+            for i in range(0, len(identifiers), chunk_size):
+                conn.execute(lookup.insert(), [
+                    {"position": i + j, "identifier": identifier}
+                    for j, identifier
+                    in enumerate(identifiers[i:i + chunk_size])
+                ])
+            result = conn.execution_options(
+                stream_results=True, max_row_buffer=chunk_size
+            ).execute(query)
+            # The result is closed before the drop even if the
+            # caller stops reading early
+            try:
+                while True:
+                    rows = result.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    yield [(row[0], bool(row[1])) + tuple(row[2:])
+                           for row in rows]
+            finally:
+                result.close()
+        finally:
+            lookup.drop(conn)
+
+
+def query_text(query, dialect=None) -> str:
+    """Render a query as SQL text for the record of a query printout.
+
+    Parameters:
+        query (sqlalchemy Select) :
+            query to render
+
+        dialect (sqlalchemy Dialect) :
+            dialect of the database the query runs against
+
+    Returns:
+        text (str) :
+            SQL with parameter values filled in, or the SQL
+            followed by the parameters if they cannot be inlined
+    """
+    try:
+        return str(query.compile(
+            dialect=dialect, compile_kwargs={"literal_binds": True}
+        ))
+    except Exception:
+        compiled = query.compile(dialect=dialect)
+        return str(compiled) + "\n-- parameters: " + str(compiled.params)
+
+
+def load_query_specs(spec_path) -> list:
+    """Load query specs from a YAML or JSON file.
+
+    Parameters:
+        spec_path (str) :
+            path to file holding one query spec or a list of them
+
+    Returns:
+        specs (list of dicts) :
+            query specs with "fields", "filters" and "outfile" keys
+    """
+    with open(spec_path) as f:
+        if spec_path.endswith(".json"):
+            specs = json.load(f)
+        else:
+            specs = yaml.safe_load(f)
+    if isinstance(specs, dict):
+        specs = [specs]
+
+    for spec in specs:
+        if not spec.get("fields"):
+            raise ValueError(
+                "Query spec in " + spec_path + " has no fields"
+            )
+        if isinstance(spec["fields"], str):
+            spec["fields"] = [spec["fields"]]
+        spec["filters"] = spec.get("filters") or {}
+        spec.setdefault("distinct", True)
+
+    return specs
+
+# dbquery.py ends here
@@ -0,0 +1,652 @@
+"""Read-only access to DBNascent backups without restoring them.
+
+Filename: dbreader.py
+Authors: Lynn Sanford <lynn.sanford@colorado.edu>
+
+Commentary:
+    This module exposes the tables of a backup directory written by
+    dbnascentConnection.backup (full or incremental) as columns of
+    NumPy arrays. The first time a table is used, its backup is
+    decoded once into one .npy file per column (plus a null mask)
+    in a cache directory; after that, columns are memory-mapped, so
+    only the pages that are touched are read.
+
+    Queries take the same fields and filters as query_printout.py,
+    with joins from linkIDs and filters evaluated as vectorized
+    array operations. The live database can be loaded the same way
+    (LiveSnapshot) to diff a backup against it or against another
+    backup.
+
+Classes:
+    SnapshotTable
+    ColumnSnapshot
+    BackupSnapshot
+    LiveSnapshot
+
+Functions:
+    materialize_table(function, list, str) -> none
+    join_indices(array, array) -> tuple
+    filter_mask(array, object) -> array
+    table_diff(object, object, str, str) -> dict
+"""
+
+from abc import ABC, abstractmethod
+import os
+import shutil
+import tempfile
+import uuid
+
+import numpy as np
+
+import dbbackup
+import dborm
+import dbquery
+import dbutils
+
+NUMPY_TYPES = {
+    "int": np.int64,
+    "float": np.float64,
+    "bool": np.bool_,
+    "date": "datetime64[D]",
+    "datetime": "datetime64[us]",
+}
+FILL_VALUES = {
+    "int": 0,
+    "float": 0.0,
+    "bool": False,
+    "str": "",
+    "date": None,
+    "datetime": None,
+}
+
+
+class SnapshotTable:
+    """A table of a snapshot, stored as memory-mapped columns.
+
+    Attributes:
+        name (str) :
+            table name
+
+        schema (list of dicts) :
+            column names and storage types (see dbbackup.column_schema)
+
+        path (str) :
+            directory holding the column files
+
+    Methods:
+        column(name) -> masked array :
+            memory-mapped values of one column, nulls masked
+    """
+
+    def __init__(self, name, schema, path):
+        """Initialize snapshot table object.
+
+        Parameters:
+            name (str) :
+                table name
+
+            schema (list of dicts) :
+                column names and storage types
+
+            path (str) :
+                directory holding the column files
+        """
+        self.name = name
+        self.schema = schema
+        self.path = path
+        self._columns = {}
+
+    def __len__(self):
+        return len(self.column(self.schema[0]["name"]))
+
+    def column(self, name) -> np.ma.MaskedArray:
+        """Load one column as a memory-mapped masked array.
+
+        Parameters:
+            name (str) :
+                column name
+
+        Returns:
+            column (numpy masked array) :
+                column values with null values masked
+        """
+        if name not in self._columns:
+            if name not in [col["name"] for col in self.schema]:
+                raise KeyError(
+                    "Column not present in " + self.name + ": " + name
+                )
+            values = np.load(self.path + "/" + name + ".npy", mmap_mode="r")
+            nulls = np.load(self.path + "/" + name + ".null.npy",
+                            mmap_mode="r")
+            self._columns[name] = np.ma.MaskedArray(values, mask=nulls)
+        return self._columns[name]
+
+
+class ColumnSnapshot(ABC):
+    """Base class for column stores of all tables at one point in time.
+
+    Subclasses provide the table schemas and row chunks.
+
+    Attributes:
+        cache_dir (str) :
+            directory holding the decoded column files
+
+    Methods:
+        tables() -> list :
+            table names in the snapshot
+
+        table(name) -> SnapshotTable :
+            columns of one table, decoded on first use
+
+        join(joins, root="linkIDs") -> dict :
+            row indices of each table for joined rows
+
+        filter_rows(frame, table_filters) -> array :
+            which joined rows match the filters
+
+        query(fields, filters=None, distinct=True) -> list :
+            rows of the requested fields matching the filters
+    """
+
+    def __init__(self, cache_dir):
+        """Set up the column cache.
+
+        Parameters:
+            cache_dir (str) :
+                directory holding the decoded column files
+        """
+        self.cache_dir = cache_dir
+        self._loaded = {}
+
+    @abstractmethod
+    def tables(self) -> list:
+        """List the tables available in the snapshot."""
+
+    @abstractmethod
+    def _schema(self, name) -> list:
+        """Column names and storage types of one table."""
+
+    @abstractmethod
+    def _chunks(self, name):
+        """Iterate over the rows of one table in chunks."""
+
+    def table(self, name) -> SnapshotTable:
+        """Get one table, decoding it into the cache on first use.
+
+        Parameters:
+            name (str) :
+                table name
+
+        Returns:
+            table (SnapshotTable object) :
+                memory-mapped columns of the table
+        """
+        # Reuse the table, and the columns it has already mapped
+        if name in self._loaded:
+            return self._loaded[name]
+        if name not in self.tables():
+            raise KeyError(
+                "Table not present in snapshot: " + name
+            )
+        schema = self._schema(name)
+        table_dir = self.cache_dir + "/" + name
+        if not os.path.isdir(table_dir):
+            materialize_table(lambda: self._chunks(name), schema, table_dir)
+        self._loaded[name] = SnapshotTable(name, schema, table_dir)
+        return self._loaded[name]
+
+    def join(self, joins, root="linkIDs") -> dict:
+        """Join tables as planned by dbquery.plan_joins.
+
+        Parameters:
+            joins (list of tuples) :
+                (table, table joined to, its join column, this
+                table's join column) in join order
+
+            root (str) :
+                table the joins start from
+
+        Returns:
+            frame (dict) :
+                for each joined table, an array of row indices;
+                position i in every array belongs to result row i
+        """
+        frame = {root: np.arange(len(self.table(root)))}
+        for table, parent, parent_col, col in joins:
+            left = self.table(parent).column(parent_col)[frame[parent]]
+            right = self.table(table).column(col)
+            left_idx, right_idx = join_indices(left, right)
+            frame = {t: idx[left_idx] for t, idx in frame.items()}
+            frame[table] = right_idx
+
+        return frame
+
+    def filter_rows(self, frame, table_filters) -> np.ndarray:
+        """Evaluate filters over joined rows.
+
+        Parameters:
+            frame (dict) :
+                joined row indices (see join)
+
+            table_filters (list of tuples) :
+                (table, field, filter specification)
+
+        Returns:
+            keep (numpy boolean array) :
+                True for joined rows matching all filters
+        """
+        keep = np.ones(len(next(iter(frame.values()))), dtype=bool)
+        for table, field, spec in table_filters:
+            values = self.table(table).column(field)[frame[table]]
+            for crit in dbutils.normalize_filter(spec):
+                keep &= filter_mask(values, crit)
+        return keep
+
+    def query(self, fields, filters=None, distinct=True) -> list:
+        """Query the snapshot.
+
+        Joins and filters are planned as for the database (see
+        dbquery.plan_query), with EXISTS subqueries evaluated as
+        key lookups. Comparisons are exact, unlike MySQL's
+        case-insensitive string matching.
+
+        Parameters:
+            fields (list) :
+                fields to return
+
+            filters (dict) :
+                filter specification for each field
+                (see dbutils.normalize_filter)
+
+            distinct (boolean) :
+                drop duplicate result rows, as SELECT DISTINCT
+
+        Returns:
+            rows (list of tuples) :
+                one tuple of field values per result row
+        """
+        plan = dbquery.plan_query(fields, filters)
+        frame = self.join(plan["joins"])
+        keep = self.filter_rows(frame, plan["filters"])
+
+        for semi in plan["exists"]:
+            entry, parent, parent_col, col = semi["joins"][0]
+            sub_frame = self.join(semi["joins"][1:], root=entry)
+            sub_keep = self.filter_rows(sub_frame, semi["filters"])
+            matched = self.table(entry).column(col)[
+                sub_frame[entry][sub_keep]
+            ].compressed()
+            outer = self.table(parent).column(parent_col)[frame[parent]]
+            keep &= (np.isin(np.asarray(outer.data), matched)
+                     & ~np.ma.getmaskarray(outer))
+
+        columns = []
+        for field in fields:
+            table = plan["fields"][field]
+            rows = frame[table][keep]
+            columns.append(self.table(table).column(field)[rows].tolist())
+        rows = list(zip(*columns))
+        if distinct:
+            rows = list(dict.fromkeys(rows))
+
+        return rows
+
+
+class BackupSnapshot(ColumnSnapshot):
+    """Read-only view of a backup directory.
+
+    Attributes:
+        in_path (str) :
+            path to backup file directory
+
+        manifest (dict) :
+            backup manifest, or None for backups without one
+
+        cache_dir (str) :
+            directory holding the decoded column files
+            (default .colcache inside the backup directory)
+    """
+
+    def __init__(self, in_path, cache_dir=None):
+        """Open a backup directory.
+
+        Parameters:
+            in_path (str) :
+                path to backup file directory
+
+            cache_dir (str) :
+                directory for decoded column files
+        """
+        super().__init__(cache_dir or in_path + "/.colcache")
+        self.in_path = in_path
+        self.manifest = dbbackup.read_manifest(in_path)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._tables = []
+        incremental = (self.manifest is not None
+                       and self.manifest.get("type") == "incremental")
+        for table in dbbackup.backup_tables(in_path):
+            if incremental or os.path.exists(
+                in_path + "/" + table + dbbackup.BACKUP_EXT
+            ):
+                self._tables.append(table)
+
+    def tables(self) -> list:
+        """List the tables available in the backup."""
+        return list(self._tables)
+
+    def _schema(self, name) -> list:
+        if (self.manifest is not None
+                and self.manifest.get("type") == "incremental"):
+            return self.manifest["tables"][name]["columns"]
+        return dbbackup.read_backup_header(
+            self.in_path + "/" + name + dbbackup.BACKUP_EXT
+        )["columns"]
+
+    def _chunks(self, name):
+        return dbbackup.iter_table_chunks(self.in_path, name, self.manifest)
+
+
+class LiveSnapshot(ColumnSnapshot):
+    """Column store of the live database at one point in time.
+
+    All tables are read through one connection holding a consistent
+    snapshot, so they can be compared with a backup. Columns are
+    decoded into a temporary directory removed by close().
+
+    Attributes:
+        dbconn (dbnascentConnection object) :
+            current db connection
+
+        cache_dir (str) :
+            directory holding the decoded column files
+    """
+
+    def __init__(self, dbconn, cache_dir=None):
+        """Open a snapshot of the live database.
+
+        Parameters:
+            dbconn (dbnascentConnection object) :
+                current db connection
+
+            cache_dir (str) :
+                directory for decoded column files
+                (default a new temporary directory)
+        """
+        super().__init__(cache_dir or tempfile.mkdtemp(prefix="dbnascent_"))
+        self.dbconn = dbconn
+        self._own_cache = cache_dir is None
+        self._tables = list(dborm.Base.metadata.tables.keys())
+        conns, self.snapshot = dbbackup.open_snapshot_connections(
+            dbconn.engine, self._tables, 1
+        )
+        self._conn = conns[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self) -> None:
+        """Release the snapshot connection and temporary files."""
+        self._conn.close()
+        if self._own_cache:
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def tables(self) -> list:
+        """List the ORM tables in the database."""
+        return list(self._tables)
+
+    def _schema(self, name) -> list:
+        return dbbackup.column_schema(self.dbconn.get_table(name))
+
+    def _chunks(self, name):
+        table_obj = self.dbconn.get_table(name)
+        return self.dbconn.reflect_chunks(
+            name,
+            order_by=[col.name for col in table_obj.primary_key.columns],
+            stream=True,
+            conn=self._conn,
+        )
+
+
+def materialize_table(chunk_source, schema, table_dir) -> None:
+    """Decode row chunks into one .npy file per column.
+
+    Makes two passes over the chunks (the first to size the arrays
+    and string widths) and fills memory-mapped arrays chunk by
+    chunk, so memory use is one chunk regardless of table size.
+    The files are written to a uniquely named temporary directory
+    that is then renamed into place, so processes materializing the
+    same table at once do not collide; the first to finish wins.
+
+    Parameters:
+        chunk_source (function) :
+            returns a new iterator over lists of row dicts
+
+        schema (list of dicts) :
+            column names and storage types
+
+        table_dir (str) :
+            directory to create for the column files
+
+    Returns:
+        none
+    """
+    nrows = 0
+    widths = {col["name"]: 1 for col in schema if col["type"] == "str"}
+    for rows in chunk_source():
+        nrows = nrows + len(rows)
+        for name in widths:
+            for row in rows:
+                if row[name] is not None:
+                    widths[name] = max(widths[name], len(str(row[name])))
+
+    tmp_dir = table_dir + "." + uuid.uuid4().hex + ".tmp"
+    os.makedirs(tmp_dir)
+    arrays = []
+    for col in schema:
+        name = col["name"]
+        if col["type"] == "str":
+            dtype = "<U" + str(widths[name])
+        else:
+            dtype = NUMPY_TYPES[col["type"]]
+        values = np.lib.format.open_memmap(
+            tmp_dir + "/" + name + ".npy", mode="w+",
+            dtype=dtype, shape=(nrows,),
+        )
+        nulls = np.lib.format.open_memmap(
+            tmp_dir + "/" + name + ".null.npy", mode="w+",
+            dtype=np.bool_, shape=(nrows,),
+        )
+        arrays.append((col, values, nulls))
+
+    start = 0
+    for rows in chunk_source():
+        end = start + len(rows)
+        for col, values, nulls in arrays:
+            name = col["name"]
+            fill = FILL_VALUES[col["type"]]
+            chunk = [row[name] for row in rows]
+            nulls[start:end] = [value is None for value in chunk]
+            if col["type"] == "str":
+                chunk = [fill if value is None else str(value)
+                         for value in chunk]
+            else:
+                chunk = [fill if value is None else value
+                         for value in chunk]
+            values[start:end] = np.array(chunk, dtype=values.dtype)
+        start = end
+
+    for col, values, nulls in arrays:
+        values.flush()
+        nulls.flush()
+    del arrays
+    try:
+        os.replace(tmp_dir, table_dir)
+    except OSError:
+        # Another process finished the same table first
+        if not os.path.isdir(table_dir):
+            raise
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def join_indices(left, right) -> tuple:
+    """Inner join two key columns.
+
+    Handles one-to-one and one-to-many joins; null keys never match.
+
+    Parameters:
+        left (numpy masked array) :
+            key values of the rows joined so far
+
+        right (numpy masked array) :
+            key column of the table being joined
+
+    Returns:
+        left_idx (numpy array) :
+            index into left for each joined row
+
+        right_idx (numpy array) :
+            index into right for each joined row
+    """
+    right_valid = np.nonzero(~np.ma.getmaskarray(right))[0]
+    right_vals = np.asarray(right.data)[right_valid]
+    order = np.argsort(right_vals, kind="stable")
+    right_sorted = right_vals[order]
+
+    left_vals = np.asarray(left.data)
+    low = np.searchsorted(right_sorted, left_vals, "left")
+    high = np.searchsorted(right_sorted, left_vals, "right")
+    counts = np.where(np.ma.getmaskarray(left), 0, high - low)
+
+    left_idx = np.repeat(np.arange(len(left_vals)), counts)
+    starts = np.repeat(low, counts)
+    offsets = (np.arange(counts.sum())
+               - np.repeat(np.cumsum(counts) - counts, counts))
+    right_idx = right_valid[order[starts + offsets]]
+
+    return left_idx, right_idx
+
+
+def _coerce(values, value):
+    """Convert a filter value to the type of a column."""
+    kind = values.dtype.kind
+    if kind == "U":
+        return str(value)
+    if kind == "M":
+        return np.datetime64(value)
+    if kind == "b":
+        if isinstance(value, str):
+            return value.lower() in ("1", "true")
+        return bool(value)
+    if isinstance(value, str):
+        return float(value)
+    return value
+
+
+def filter_mask(column, value) -> np.ndarray:
+    """Evaluate one filter criterion over a column.
+
+    Parameters:
+        column (numpy masked array) :
+            column values, nulls masked
+
+        value :
+            filter value in the form taken by dbutils.filter_clause
+
+    Returns:
+        keep (numpy boolean array) :
+            True for rows matching the criterion
+    """
+    nulls = np.ma.getmaskarray(column)
+    values = np.asarray(column.data)
+    if value is None:
+        return nulls.copy()
+    if isinstance(value, (list, tuple, set)):
+        options = np.array([_coerce(values, v) for v in value])
+        return np.isin(values, options) & ~nulls
+    if not isinstance(value, dict):
+        return (values == _coerce(values, value)) & ~nulls
+
+    keep = np.ones(len(values), dtype=bool)
+    for op, opval in value.items():
+        op = op.strip().lower()
+        if op in ("=", "==", "is"):
+            keep &= filter_mask(column, opval)
+        elif op in ("!=", "<>", "is not"):
+            if opval is None:
+                keep &= ~nulls
+            else:
+                keep &= (values != _coerce(values, opval)) & ~nulls
+        elif op == "<":
+            keep &= (values < _coerce(values, opval)) & ~nulls
+        elif op == "<=":
+            keep &= (values <= _coerce(values, opval)) & ~nulls
+        elif op == ">":
+            keep &= (values > _coerce(values, opval)) & ~nulls
+        elif op == ">=":
+            keep &= (values >= _coerce(values, opval)) & ~nulls
+        elif op == "in":
+            keep &= filter_mask(column, list(opval))
+        elif op == "not in":
+            keep &= ~filter_mask(column, list(opval)) & ~nulls
+        else:
+            raise ValueError(
+                "Unrecognized filter operator: " + op
+            )
+
+    return keep
+
+
+def table_diff(old, new, table, key="id") -> dict:
+    """Compare one table between two snapshots.
+
+    Parameters:
+        old (ColumnSnapshot object) :
+            earlier snapshot (backup or live)
+
+        new (ColumnSnapshot object) :
+            later snapshot (backup or live)
+
+        table (str) :
+            table name
+
+        key (str) :
+            column identifying rows
+
+    Returns:
+        diff (dict) :
+            arrays of key values for "added", "removed" and
+            "changed" rows
+    """
+    old_table = old.table(table)
+    new_table = new.table(table)
+    old_keys = np.asarray(old_table.column(key).data)
+    new_keys = np.asarray(new_table.column(key).data)
+    common, old_idx, new_idx = np.intersect1d(
+        old_keys, new_keys, assume_unique=True, return_indices=True
+    )
+
+    changed = np.zeros(len(common), dtype=bool)
+    new_names = [col["name"] for col in new_table.schema]
+    for col in old_table.schema:
+        name = col["name"]
+        if name == key or name not in new_names:
+            continue
+        old_col = old_table.column(name)
+        new_col = new_table.column(name)
+        old_nulls = np.ma.getmaskarray(old_col)[old_idx]
+        new_nulls = np.ma.getmaskarray(new_col)[new_idx]
+        old_vals = np.asarray(old_col.data)[old_idx]
+        new_vals = np.asarray(new_col.data)[new_idx]
+        changed |= ((old_nulls != new_nulls)
+                    | (~old_nulls & ~new_nulls & (old_vals != new_vals)))
+
+    return {
+        "added": np.setdiff1d(new_keys, old_keys),
+        "removed": np.setdiff1d(old_keys, new_keys),
+        "changed": common[changed],
+    }
+
+# dbreader.py ends here
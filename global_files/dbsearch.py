@@ -0,0 +1,387 @@
+"""Resolve user search terms to canonical DBNascent values.
+
+Filename: dbsearch.py
+Authors: Lynn Sanford <lynn.sanford@colorado.edu>
+
+Commentary:
+    The searchEquiv table (built by searcheq_build.py) maps search
+    terms, such as "human" or "GRO seq", to the values stored in the
+    database ("H. sapiens", "GRO-seq") for each searchable field.
+
+    SearchResolver loads searchEquiv once and keeps an index per
+    search field, so filter values can be translated with no
+    further database queries. A term is looked up as follows:
+
+        1. exactly as given
+        2. folded: case-insensitive, ignoring spaces and punctuation
+        3. as the prefix of folded terms that all map to one value
+        4. by trigram similarity, if one value is clearly closest
+
+    Steps 3 and 4 only apply to free-text fields. Identifiers
+    (e.g. srr, sample_name, paper_name) and numbers differ from
+    other valid values by a character or two, so a near miss is a
+    different sample, not a misspelling; for these fields an
+    unmatched term is recorded with its closest values (see
+    suggest) for the caller to report.
+
+    Terms matching nothing are left unchanged. A term matching
+    several values (e.g. a cell line and its derivatives) becomes
+    a list, which filters with IN.
+
+Classes:
+    SearchResolver
+
+Functions:
+    fold_term(str) -> str
+    trigrams(str) -> set
+"""
+
+from bisect import bisect_left
+import csv
+import re
+
+import dborm
+import sqlalchemy as sql
+
+FOLD_RE = re.compile(r"[\W_]+")
+# Smallest trigram similarity for a fuzzy match
+TRIGRAM_MIN = 0.6
+# Fields matched only exactly or folded, never by prefix or similarity
+EXACT_FIELDS = (
+    "paper_name", "srr", "srp", "geo", "sample_name", "year",
+    "replicate", "sample_qc_score", "sample_data_score",
+)
+# Filter operators whose values are translated
+EQ_OPS = ("=", "==", "is")
+NE_OPS = ("!=", "<>", "is not")
+
+
+def fold_term(term) -> str:
+    """Fold a term for case- and punctuation-insensitive matching.
+
+    Parameters:
+        term (str) :
+            search term
+
+    Returns:
+        folded (str) :
+            casefolded term with spaces and punctuation removed
+    """
+    return FOLD_RE.sub("", str(term).casefold())
+
+
+def trigrams(folded) -> set:
+    """Split a folded term into character trigrams.
+
+    Parameters:
+        folded (str) :
+            folded term (see fold_term)
+
+    Returns:
+        grams (set) :
+            trigrams, padded so short terms have some
+    """
+    padded = "  " + folded + " "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchResolver:
+    """An in-memory index of searchEquiv for translating filter values.
+
+    Attributes:
+        fields (dict) :
+            search field -> index with "terms" (canonical values),
+            "exact" and "folded" (term -> term numbers), "keys"
+            (sorted folded terms) and "grams" (trigram -> folded
+            terms)
+
+        translations (list) :
+            (field, term, canonical values) for every filter value
+            that was changed, for reporting
+
+        unmatched (list) :
+            (field, term, closest values) for every value of an
+            EXACT_FIELDS field that matched nothing, for reporting
+
+    Methods:
+        from_db(dbconn) -> SearchResolver :
+            Loads searchEquiv from the database in one query
+
+        from_file(path) -> SearchResolver :
+            Loads the searcheq.txt table written by searcheq_build.py
+
+        resolve(field, term) -> list :
+            Canonical values for one term
+
+        suggest(field, term, limit=5) -> list :
+            Closest canonical values by trigram similarity
+
+        translate(field, crit) -> object :
+            Translates the values of one filter criterion
+
+        pop_translations() -> list :
+            Returns and clears the translations made so far
+
+        pop_unmatched() -> list :
+            Returns and clears the unmatched identifiers so far
+    """
+
+    def __init__(self, rows):
+        """Build search indexes.
+
+        Parameters:
+            rows (iterable of tuples) :
+                (search_term, db_term, search_field)
+        """
+        self.fields = {}
+        self.translations = []
+        self.unmatched = []
+        for search_term, db_term, search_field in rows:
+            if search_term is None or db_term is None:
+                continue
+            index = self.fields.setdefault(search_field, {
+                "terms": [], "term_ids": {}, "exact": {}, "folded": {},
+            })
+            if db_term not in index["term_ids"]:
+                index["term_ids"][db_term] = len(index["terms"])
+                index["terms"].append(db_term)
+            term_id = index["term_ids"][db_term]
+            # searchEquiv terms match their own db value
+            for term in (search_term, db_term):
+                term = str(term)
+                ids = index["exact"].setdefault(term, [])
+                if term_id not in ids:
+                    ids.append(term_id)
+                ids = index["folded"].setdefault(fold_term(term), [])
+                if term_id not in ids:
+                    ids.append(term_id)
+
+        for index in self.fields.values():
+            del index["term_ids"]
+            index["exact"] = {
+                term: tuple(ids) for term, ids in index["exact"].items()
+            }
+            index["folded"] = {
+                term: tuple(ids) for term, ids in index["folded"].items()
+            }
+            index["keys"] = sorted(index["folded"])
+            index["grams"] = {}
+            for key in index["keys"]:
+                for gram in trigrams(key):
+                    index["grams"].setdefault(gram, []).append(key)
+
+    @classmethod
+    def from_db(cls, dbconn):
+        """Load searchEquiv from the database.
+
+        Parameters:
+            dbconn (dbnascentConnection object) :
+                current db connection
+
+        Returns:
+            resolver (SearchResolver object) :
+                resolver over all search fields
+        """
+        table = dborm.searchEquiv.__table__
+        rows = dbconn.engine.execute(sql.select(
+            table.c.search_term, table.c.db_term, table.c.search_field
+        )).fetchall()
+        return cls(rows)
+
+    @classmethod
+    def from_file(cls, path):
+        """Load the tab-delimited searcheq.txt table.
+
+        Parameters:
+            path (str) :
+                path to file with search_term, db_term and
+                search_field columns
+
+        Returns:
+            resolver (SearchResolver object) :
+                resolver over all search fields
+        """
+        with open(path, newline="") as f:
+            reader = csv.DictReader(f, delimiter="\t")
+            rows = [(row["search_term"], row["db_term"], row["search_field"])
+                    for row in reader]
+        return cls(rows)
+
+    def _fuzzy(self, index, folded) -> list:
+        """Score folded terms by trigram similarity to a folded term."""
+        grams = trigrams(folded)
+        shared = {}
+        for gram in grams:
+            for key in index["grams"].get(gram, []):
+                shared[key] = shared.get(key, 0) + 1
+        scores = []
+        for key, count in shared.items():
+            union = len(grams) + len(trigrams(key)) - count
+            scores.append((count / union, key))
+        scores.sort(key=lambda score: (-score[0], score[1]))
+        return scores
+
+    def resolve(self, field, term) -> list:
+        """Find the canonical values of a search term.
+
+        Parameters:
+            field (str) :
+                search field (query field name)
+
+            term (str) :
+                search term
+
+        Returns:
+            values (list) :
+                canonical values, or [term] if nothing matches
+        """
+        index = self.fields.get(field)
+        if index is None or not isinstance(term, str):
+            return [term]
+        ids = index["exact"].get(term)
+        folded = fold_term(term)
+        if ids is None:
+            ids = index["folded"].get(folded)
+
+        # Never guess at identifiers; report the nearest instead
+        if ids is None and field in EXACT_FIELDS:
+            self.unmatched.append((field, term, self.suggest(field, term)))
+            return [term]
+
+        # Prefix of terms that all mean the same value
+        if ids is None and folded:
+            start = bisect_left(index["keys"], folded)
+            prefix_ids = set()
+            for key in index["keys"][start:]:
+                if not key.startswith(folded):
+                    break
+                prefix_ids.update(index["folded"][key])
+                if len(prefix_ids) > 1:
+                    break
+            if len(prefix_ids) == 1:
+                ids = tuple(prefix_ids)
+
+        # Misspellings, if one value is clearly closest
+        if ids is None and folded:
+            scores = self._fuzzy(index, folded)
+            if scores and scores[0][0] >= TRIGRAM_MIN:
+                best = {
+                    term_id
+                    for score, key in scores if score == scores[0][0]
+                    for term_id in index["folded"][key]
+                }
+                if len(best) == 1:
+                    ids = tuple(best)
+
+        if ids is None:
+            return [term]
+        return [index["terms"][term_id] for term_id in ids]
+
+    def suggest(self, field, term, limit=5) -> list:
+        """List the canonical values closest to a search term.
+
+        Parameters:
+            field (str) :
+                search field (query field name)
+
+            term (str) :
+                search term
+
+            limit (int) :
+                maximum number of values
+
+        Returns:
+            values (list) :
+                canonical values, most similar first
+        """
+        index = self.fields.get(field)
+        if index is None:
+            return []
+        values = []
+        for score, key in self._fuzzy(index, fold_term(term)):
+            for term_id in index["folded"][key]:
+                if index["terms"][term_id] not in values:
+                    values.append(index["terms"][term_id])
+            if len(values) >= limit:
+                break
+        return values[0:limit]
+
+    def _resolve_list(self, field, values) -> list:
+        resolved = []
+        for value in values:
+            for canonical in self.resolve(field, value):
+                if canonical not in resolved:
+                    resolved.append(canonical)
+        return resolved
+
+    def translate(self, field, crit):
+        """Translate the values of one filter criterion.
+
+        Parameters:
+            field (str) :
+                query field the filter is on
+
+            crit :
+                filter value in the form taken by
+                dbutils.filter_clause
+
+        Returns:
+            crit :
+                filter value with search terms replaced by
+                canonical values; equality with several values
+                becomes IN
+        """
+        if field not in self.fields or crit is None:
+            return crit
+
+        if isinstance(crit, str):
+            translated = self._resolve_list(field, [crit])
+            if len(translated) == 1:
+                translated = translated[0]
+        elif isinstance(crit, (list, tuple, set)):
+            translated = self._resolve_list(field, list(crit))
+        elif isinstance(crit, dict):
+            translated = {}
+            for op, value in crit.items():
+                key = op.strip().lower()
+                if key in ("in", "not in"):
+                    value = self._resolve_list(field, list(value))
+                elif key in EQ_OPS + NE_OPS and isinstance(value, str):
+                    value = self._resolve_list(field, [value])
+                    if len(value) == 1:
+                        value = value[0]
+                    else:
+                        op = "in" if key in EQ_OPS else "not in"
+                translated[op] = value
+        else:
+            return crit
+
+        if translated != crit:
+            self.translations.append((field, crit, translated))
+        return translated
+
+    def pop_translations(self) -> list:
+        """Return the translations made so far and start a new list.
+
+        Returns:
+            translations (list of tuples) :
+                (field, term, canonical values) for every filter
+                value changed since the last call
+        """
+        translations = self.translations
+        self.translations = []
+        return translations
+
+    def pop_unmatched(self) -> list:
+        """Return the unmatched identifiers so far and start a new list.
+
+        Returns:
+            unmatched (list of tuples) :
+                (field, term, closest values) for every identifier
+                that matched nothing since the last call
+        """
+        unmatched = self.unmatched
+        self.unmatched = []
+        return unmatched
+
+# dbsearch.py ends here
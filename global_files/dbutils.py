@@ -11,15 +11,29 @@ Commentary:
 Classes:
     dbnascentConnection
     Metatable
+    BidirSummary
 
 Functions:
     load_config(file) -> object
     load_keys(dict) -> dict
+    fetch_chunks(object, object, bool, int, bool) -> generator
+    filter_clause(column, value) -> sqlalchemy expression
+    parse_filter_literal(str) -> object
+    parse_filter(str) -> object
+    normalize_filter(object) -> list
+    resolve_field(str) -> str
     key_store_compare(dict, list, list, list) -> dict
     object_as_dict(object) -> dict
     entry_update(object, str, list, list -> list
+    sync_rows(object, str, list, list) -> dict
     db_round(float) -> float
+    parse_condition(str, str, str) -> tuple
+    parse_conditions(list) -> list
     duration_calc(list) -> list
+    key_id_map(list, list) -> dict
+    merge_list_accum(list) -> set
+    merge_membership_rows(dict) -> list
+    merge_membership(object, str) -> dict
     scrape_fastqc(str, str, str, dict) -> dict
     scrape_picard(str, str, str) -> dict
     scrape_mapstats(str, str, str, dict) -> dict
@@ -31,6 +45,7 @@ Functions:
     add_version_info(object, str, str, str, list) -> list
 """
 
+from collections import namedtuple
 import configparser
 import csv
 import datetime
@@ -42,16 +57,19 @@ from statistics import median
 import yaml
 import zipfile as zp
 
+import dbbackup
 import dborm
 import pymysql
 import sqlalchemy as sql
-from sqlalchemy.ext.serializer import loads, dumps
 from sqlalchemy.orm import sessionmaker
 
 
 class dbnascentConnection:
     """A class to handle connection to the MySQL database.
 
+    Read-only SQLite exports of the database (see export_sqlite)
+    can be opened the same way, by passing the file path as db_url.
+
     Attributes:
         engine (dialect, pool objects) : 
             engine created by sqlalchemy
@@ -66,41 +84,81 @@ class dbnascentConnection:
         add_tables() :
             Adds tables from ORM to database
 
+        add_indexes() -> list :
+            Adds ORM indexes missing from existing tables
+
         delete_tables() :
             Deletes all tables in ORM from database
 
-        reflect_table(table, filter_crit=None) -> list:
+        get_table(table) -> sqlalchemy Table :
+            Looks up a table object by name
+
+        reflect_chunks(table, columns=None, filter_crit=None, ...) :
+            Yields table data in chunks, optionally projected,
+            filtered and streamed from a server-side cursor
+
+        reflect_table(table, filter_crit=None, columns=None) -> list:
             Pulls table data from database, optionally filtered
             by filter criteria
 
-        backup(out_path, tables=False) :
+        distinct_values(table, field) -> list :
+            Gets the distinct non-null values of one column
+
+        backup(out_path, tables=False, chunk_size=10000, workers=1,
+               incremental=False) -> str :
             Backs up database to an external location, optionally
             limited to specific tables
 
-        restore(in_path, tables=False) :
+        restore(in_path, tables=False, workers=4) -> dict :
             Restores database from backups, optionally limited to
             specific tables
+
+        restore_paper(in_path, paper_name) -> dict :
+            Restores the rows of a single paper from a backup
+
+        export_sqlite(out_path, tables=False, chunk_size=10000) -> str :
+            Exports the database to a read-only SQLite file
+
+        db_version() -> str :
+            Gets the database version stamp, read once per connection
+
+        bump_version(description="") -> int :
+            Increments the database version stamp
     """
 
     engine = None
     _Session = None
     session = None
+    _db_version = None
 
     def __init__(self, db_url, cred_path):
         """Initialize database connection.
 
         Parameters:
             db_url (str) : 
-                path to database (mandatory)
+                path to database (mandatory); either a MySQL
+                host/database, a sqlite:// url or the path to a
+                .sqlite export file (opened read-only)
 
             cred_path (str) : 
                 path to tab-delimited credentials
                 one line file with username tab password
+                (not used for SQLite)
 
         Returns:
             none
         """
-        if cred_path:
+        if db_url and db_url.startswith("sqlite:"):
+            self.engine = sql.create_engine(db_url, echo=False)
+        elif db_url and db_url.endswith(dbbackup.SQLITE_EXT):
+            if not os.path.exists(db_url):
+                raise FileNotFoundError(
+                    "SQLite database does not exist at " + db_url
+                )
+            self.engine = sql.create_engine(
+                dbbackup.sqlite_url(db_url), echo=False
+            )
+        elif cred_path:
             with open(cred_path) as f:
                 cred = next(f).split("\t")
             self.engine = sql.create_engine("mysql+pymysql://" + str(cred[0]) + ":"
@@ -129,6 +187,50 @@ class dbnascentConnection:
         """
         dborm.Base.metadata.create_all(self.engine)
 
+    def add_indexes(self) -> list:
+        """Add ORM indexes missing from existing tables.
+
+        add_tables() only creates indexes along with new tables.
+        An index is skipped if the table already has an index with
+        the same leading columns (e.g. one MySQL made for a
+        foreign key).
+
+        Parameters:
+            none
+
+        Returns:
+            created (list) :
+                names of indexes created
+        """
+        inspector = sql.inspect(self.engine)
+        existing_tables = inspector.get_table_names()
+        created = []
+        for table_obj in dborm.Base.metadata.sorted_tables:
+            if table_obj.name not in existing_tables:
+                continue
+            existing = [
+                index["column_names"]
+                for index in inspector.get_indexes(table_obj.name)
+            ]
+            existing.extend(
+                fk["constrained_columns"]
+                for fk in inspector.get_foreign_keys(table_obj.name)
+                if self.engine.dialect.name == "mysql"
+            )
+            existing.append(
+                inspector.get_pk_constraint(table_obj.name)
+                ["constrained_columns"]
+            )
+            for index in table_obj.indexes:
+                columns = [col.name for col in index.columns]
+                if any(cols[0:len(columns)] == columns for cols in existing):
+                    continue
+                index.create(self.engine)
+                created.append(index.name)
+                existing.append(columns)
+
+        return created
+
     def delete_tables(self, table_list=[]) -> None:
         """Delete tables in ORM from database.
 
@@ -148,10 +250,91 @@ class dbnascentConnection:
         else:
             dborm.Base.metadata.drop_all(self.engine)
 
-    def reflect_table(self, table, filter_crit=None) -> list:
+    def get_table(self, table) -> sql.Table:
+        """Look up a table object by name.
+
+        Tables not defined in the ORM are reflected from the database.
+
+        Parameters:
+            table (str) :
+                table name
+
+        Returns:
+            table_obj (sqlalchemy Table) :
+                table object for building queries
+        """
+        if table in dborm.Base.metadata.tables:
+            return dborm.Base.metadata.tables[table]
+        return sql.Table(table, dborm.Base.metadata, autoload_with=self.engine)
+
+    def reflect_chunks(
+        self,
+        table,
+        columns=None,
+        filter_crit=None,
+        order_by=None,
+        stream=False,
+        chunk_size=10000,
+        conn=None,
+    ):
+        """Query records from a specific table in chunks.
+
+        Filter values are sent as bound parameters rather than
+        pasted into the query string.
+
+        Parameters:
+            table (str) :
+                table name from ORM
+
+            columns (list) :
+                columns to return (default all columns)
+
+            filter_crit (dict) :
+                filter criteria for table, keyed by column name
+                see filter_clause for accepted values
+
+            order_by (list) :
+                columns to order results by
+
+            stream (boolean) :
+                use a server-side cursor so only one chunk of
+                rows is held in memory at a time
+
+            chunk_size (int) :
+                number of rows per chunk
+
+            conn (sqlalchemy Connection) :
+                existing connection to read from, e.g. one holding
+                a transaction snapshot (default a new connection)
+
+        Yields:
+            chunk (list of dicts) :
+                up to chunk_size rows matching filter criteria
+        """
+        table_obj = self.get_table(table)
+        if columns:
+            query = sql.select(*[table_obj.c[col] for col in columns])
+        else:
+            query = sql.select(table_obj)
+        if filter_crit:
+            query = query.where(*[
+                filter_clause(table_obj.c[filtkey], filter_crit[filtkey])
+                for filtkey in filter_crit
+            ])
+        if order_by:
+            query = query.order_by(*[table_obj.c[col] for col in order_by])
+
+        if conn is not None:
+            yield from fetch_chunks(conn, query, stream, chunk_size)
+            return
+        with self.engine.connect() as conn:
+            yield from fetch_chunks(conn, query, stream, chunk_size)
+
+    def reflect_table(self, table, filter_crit=None, columns=None) -> list:
         """Query all records from a specific table.
 
-        Can optionally add filtering criteria.
+        Can optionally add filtering criteria and limit the
+        columns returned.
 
         Parameters:
             table (str) : 
@@ -159,7 +342,10 @@ class dbnascentConnection:
 
             filter_crit (dict) : 
                 filter criteria for table
-                only currently takes "=" filter criteria
+                see filter_clause for accepted values
+
+            columns (list) :
+                columns to return (default all columns)
 
         Returns:
             query_results (list of dicts) : 
@@ -167,26 +353,33 @@ class dbnascentConnection:
         """
         query_results = []
 
-        query_str = "SELECT * FROM " + table
-        if filter_crit is not None:
-            query_str = query_str + " WHERE "
-            i = 0
-            for filtkey in filter_crit:
-                if i == 0:
-                    query_str = (query_str + str(filtkey) +
-                                 ' = "' + str(filter_crit[filtkey]) + '"')
-                    i = (i + 1)
-                else:
-                    query_str = (query_str + " AND " + str(filtkey) +
-                                 ' = "' + str(filter_crit[filtkey]) + '"')
-
-        sqlquery = self.session.execute(sql.text(query_str)).fetchall()
-
-        for query_res in sqlquery:
-            query_results.append(dict(query_res))
+        for chunk in self.reflect_chunks(table, columns, filter_crit):
+            query_results.extend(chunk)
 
         return query_results
     
+    def distinct_values(self, table, field) -> list:
+        """Get the distinct values of one column.
+
+        Values are deduplicated by the database, so only the
+        distinct values are sent back rather than every row.
+
+        Parameters:
+            table (str) :
+                table name from ORM
+
+            field (str) :
+                column name
+
+        Returns:
+            values (list) :
+                distinct non-null values
+        """
+        column = self.get_table(table).c[field]
+        query = sql.select(column).where(column.isnot(None)).distinct()
+        with self.engine.connect() as conn:
+            return [row[0] for row in conn.execute(query)]
+
     def get_coltypes(self) -> dict:
         """Sorts column types for correct formatting.
 
@@ -217,10 +410,25 @@ class dbnascentConnection:
 
         return coltypes
 
-    def backup(self, out_path, tables=False) -> None:
+    def backup(
+        self,
+        out_path,
+        tables=False,
+        chunk_size=10000,
+        workers=1,
+        incremental=False,
+    ) -> str:
         """Backup database.
 
-        Can optionally limit to specific tables.
+        Can optionally limit to specific tables. All tables are read
+        from one consistent snapshot, using several connections in
+        parallel if requested, and streamed in chunks into
+        compressed columnar files (see dbbackup).
+
+        Incremental backups store tables as content-addressed blocks
+        in a block store shared by all backups in out_path, so the
+        timestamped directory only holds a manifest and unchanged
+        tables are not stored again.
 
         Parameters:
             out_path (str) : 
@@ -230,8 +438,18 @@ class dbnascentConnection:
                 list of specific tables, if whole database 
                 backup is not desired
 
+            chunk_size (int) :
+                number of rows read and written at a time
+
+            workers (int) :
+                number of connections dumping tables in parallel
+
+            incremental (boolean) :
+                write an incremental, deduplicated backup
+
         Returns:
-            none
+            backup_dir (str) :
+                path to timestamped backup directory
         """
         # Make subdirectory with timestamp
         if not out_path:
@@ -241,21 +459,25 @@ class dbnascentConnection:
         backup_dir = out_path + "/" + now_dir
         os.makedirs(backup_dir)
 
-        # Send contents of each table to serialized file
+        # Stream contents of each table to a compressed file
         if not tables:
             dborm.Base.metadata.reflect(bind=self.engine)
             tables = list(dborm.Base.metadata.tables.keys())
-        for table in tables:
-            outfile = backup_dir + "/" + table + ".dbdump"
-            q = self.session.query(eval('dborm.' + table))
-            serialized_data = dumps(q.all())
-            with open(outfile, 'wb') as out:
-                out.write(serialized_data)
-
-    def restore(self, in_path, tables=False) -> None:
+        block_dir = None
+        if incremental:
+            block_dir = out_path + "/" + dbbackup.BLOCK_DIR
+        dbbackup.snapshot_backup(
+            self, backup_dir, tables, workers, chunk_size, block_dir
+        )
+
+        return backup_dir
+
+    def restore(self, in_path, tables=False, workers=4) -> dict:
         """Restore database.
 
-        Can optionally limit to specific tables.
+        Can optionally limit to specific tables. Backups are bulk
+        loaded with foreign key checks off, with independent tables
+        loaded in parallel (see dbbackup.restore_tables).
 
         Parameters:
             in_path (str) : 
@@ -265,35 +487,146 @@ class dbnascentConnection:
                 list of specific tables, if whole database 
                 restore is not desired
 
+            workers (int) :
+                maximum number of tables loaded at the same time
+
         Returns:
-            none
+            row_counts (dict) :
+                number of rows restored per table
         """
         # If not specified, identify all tables that have backups
         if not tables:
-            files = os.listdir(in_path)
-            tables = []
-            for file in files:
-                tables.append(file.split(".")[0])
-        # Grab table order from ORM and reverse for deletion
+            tables = dbbackup.backup_tables(in_path)
         dborm.Base.metadata.reflect(bind=self.engine)
-        dbtables = list(dborm.Base.metadata.tables.keys())
-        dbtables.reverse()
-        # Delete data in tables for backup (if not all tables,
-        # foreign key dependencies may cause a problem)
-        for dbtable in dbtables:
-            if dbtable in tables:
-                self.engine.execute(
-                    eval("dborm." + dbtable + ".__table__.delete()")
-                )
-        # Restore in normal building order
-        dbtables.reverse()
-        for dbtable in dbtables:
-            if dbtable in tables:
-                infile = in_path + "/" + dbtable + ".dbdump"
-                with open(infile, 'rb') as table_backup:
-                    for dbentry in loads(table_backup.read()):
-                        self.session.merge(dbentry)
-                self.session.commit()
+
+        row_counts = dbbackup.restore_tables(self, in_path, tables, workers)
+        self.bump_version("restore " + in_path)
+        return row_counts
+
+    def restore_paper(self, in_path, paper_name) -> dict:
+        """Restore a single paper from a backup.
+
+        Only the rows linked to the paper are replaced, leaving the
+        rest of the database untouched (see dbbackup.restore_paper).
+
+        Parameters:
+            in_path (str) :
+                path to backup file directory
+
+            paper_name (str) :
+                paper identifier
+
+        Returns:
+            row_counts (dict) :
+                number of rows restored per table
+        """
+        row_counts = dbbackup.restore_paper(self, in_path, paper_name)
+        self.bump_version("restore " + paper_name + " from " + in_path)
+        return row_counts
+
+    def export_sqlite(self, out_path, tables=False, chunk_size=10000) -> str:
+        """Export database to a single read-only SQLite file.
+
+        The file holds the full ORM schema with indexes and can be
+        opened with dbnascentConnection(<file>, None) and queried
+        through dbquery like the MySQL database (see
+        dbbackup.export_sqlite).
+
+        Parameters:
+            out_path (str) :
+                directory to write the export into
+
+            tables (list) :
+                list of specific tables, if whole database
+                export is not desired
+
+            chunk_size (int) :
+                number of rows read and inserted at a time
+
+        Returns:
+            out_file (str) :
+                path to export file, named by database version
+        """
+        os.makedirs(out_path, exist_ok=True)
+        stamp = self.db_version()
+        if stamp:
+            release = "v" + stamp.split("@")[0]
+        else:
+            release = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        out_file = (out_path + "/dbnascent_" + release
+                    + dbbackup.SQLITE_EXT)
+        dbbackup.export_sqlite(self, out_file, tables, chunk_size)
+
+        return out_file
+
+    def db_version(self) -> str:
+        """Get the database version stamp.
+
+        The stamp is read once per connection object, so it can key
+        cached query results without another query per lookup.
+
+        Parameters:
+            none
+
+        Returns:
+            stamp (str) :
+                version number and time of the last build/ingest
+                run, or None if the database has no version yet
+        """
+        if self._db_version is None:
+            table = dborm.dbVersion.__table__
+            try:
+                row = self.engine.execute(
+                    sql.select(table.c.version, table.c.updated)
+                    .order_by(table.c.id)
+                ).first()
+            except sql.exc.DBAPIError:
+                row = None
+            if row is None:
+                self._db_version = ""
+            else:
+                self._db_version = str(row[0]) + "@" + str(row[1])
+
+        return self._db_version or None
+
+    def bump_version(self, description="") -> int:
+        """Increment the database version stamp.
+
+        Called at the end of every build/ingest run, so results
+        cached under an older stamp are no longer used. The update
+        time is part of the stamp, so a version number restored
+        from a backup is not mistaken for an earlier one.
+
+        Parameters:
+            description (str) :
+                what changed the database
+
+        Returns:
+            version (int) :
+                new version number
+        """
+        table = dborm.dbVersion.__table__
+        table.create(self.engine, checkfirst=True)
+        now = datetime.datetime.now()
+        with self.engine.begin() as conn:
+            row = conn.execute(
+                sql.select(table.c.id, table.c.version)
+                .order_by(table.c.id)
+                .with_for_update()
+            ).first()
+            if row is None:
+                version = 1
+                conn.execute(table.insert().values(
+                    version=version, updated=now, description=description
+                ))
+            else:
+                version = (row[1] or 0) + 1
+                conn.execute(table.update().where(table.c.id == row[0])
+                             .values(version=version, updated=now,
+                                     description=description))
+        self._db_version = None
+
+        return version
 
 
 class Metatable:
@@ -557,6 +890,254 @@ def load_keys(config: dict, section: str, dbfields = None) -> dict:
     return keys
 
 
+def fetch_chunks(conn, query, stream=False, chunk_size=10000, as_tuples=False):
+    """Execute a query and yield its rows in chunks.
+
+    Parameters:
+        conn (sqlalchemy Connection) :
+            connection to execute on
+
+        query (sqlalchemy Select or text) :
+            query to execute
+
+        stream (boolean) :
+            use a server-side cursor so only one chunk of
+            rows is held in memory at a time
+
+        chunk_size (int) :
+            number of rows per chunk
+
+        as_tuples (boolean) :
+            yield rows as tuples in column order instead of dicts
+
+    Yields:
+        chunk (list of dicts or tuples) :
+            up to chunk_size rows, keyed by column label
+    """
+    if stream:
+        conn = conn.execution_options(
+            stream_results=True,
+            max_row_buffer=chunk_size,
+        )
+    result = conn.execute(query)
+    while True:
+        rows = result.fetchmany(chunk_size)
+        if not rows:
+            break
+        if as_tuples:
+            yield [tuple(row) for row in rows]
+        else:
+            yield [dict(row._mapping) for row in rows]
+
+
+def filter_clause(column, value):
+    """Build a bound-parameter filter expression for one column.
+
+    Parameters:
+        column (sqlalchemy Column) :
+            column to filter on
+
+        value :
+            None -> IS NULL
+            list, tuple or set -> IN (...)
+            dict of operator: value pairs -> all must match
+                operators are "=", "!=", "<", "<=", ">", ">=",
+                "in" and "not in"; a None value with "=" or "!="
+                gives IS NULL or IS NOT NULL
+                e.g. {">=": 2, "<": 4} for a range
+            anything else -> = value
+
+    Returns:
+        clause (sqlalchemy expression) :
+            filter expression for a WHERE clause
+    """
+    if value is None:
+        return column.is_(None)
+    if isinstance(value, (list, tuple, set)):
+        return column.in_(list(value))
+    if not isinstance(value, dict):
+        return column == value
+
+    clauses = []
+    for op, opval in value.items():
+        op = op.strip().lower()
+        if op in ("=", "==", "is"):
+            clauses.append(filter_clause(column, opval))
+        elif op in ("!=", "<>", "is not"):
+            if opval is None:
+                clauses.append(column.isnot(None))
+            else:
+                clauses.append(column != opval)
+        elif op == "<":
+            clauses.append(column < opval)
+        elif op == "<=":
+            clauses.append(column <= opval)
+        elif op == ">":
+            clauses.append(column > opval)
+        elif op == ">=":
+            clauses.append(column >= opval)
+        elif op == "in":
+            clauses.append(column.in_(list(opval)))
+        elif op == "not in":
+            clauses.append(column.notin_(list(opval)))
+        else:
+            raise ValueError(
+                "Unrecognized filter operator: " + op
+            )
+    return sql.and_(*clauses)
+
+
+FILTER_OP_RE = re.compile(
+    r"^\s*((?:IS\s+NOT\s+NULL|IS\s+NULL|NOT\s+IN|IN)\b"
+    r"|==|!=|<>|<=|>=|=|<|>)"
+    r"\s*(.*?)\s*$",
+    re.IGNORECASE,
+)
+FILTER_TOKEN_RE = re.compile(
+    r'"((?:[^"\\]|\\.)*)"|\'((?:[^\'\\]|\\.)*)\'|([^,\s]+)'
+)
+
+
+def parse_filter_literal(literal):
+    """Convert one SQL literal from a filter string to a python value.
+
+    Parameters:
+        literal (str) :
+            quoted string, number, NULL, TRUE or FALSE
+
+    Returns:
+        value (str, int, float, bool or None) :
+            parsed value
+    """
+    literal = literal.strip()
+    if len(literal) > 1 and literal[0] == literal[-1] and literal[0] in "\"'":
+        return literal[1:-1]
+    if literal.upper() == "NULL":
+        return None
+    if literal.upper() == "TRUE":
+        return True
+    if literal.upper() == "FALSE":
+        return False
+    try:
+        return int(literal)
+    except ValueError:
+        pass
+    try:
+        return float(literal)
+    except ValueError:
+        raise ValueError(
+            "Unquoted filter value is not a number: " + literal
+        )
+
+
+def parse_filter(filter_str):
+    """Parse a filter string as used in query_printout.py.
+
+    Examples are '= "control"', 'IN ("HEK293","K562")', '< 4'
+    and 'IS NOT NULL'.
+
+    Parameters:
+        filter_str (str) :
+            operator followed by a value or list of values
+
+    Returns:
+        value :
+            filter value in the form taken by filter_clause
+    """
+    match = FILTER_OP_RE.match(filter_str)
+    if not match:
+        raise ValueError(
+            "Filter not recognized: " + filter_str
+        )
+    op = " ".join(match.group(1).upper().split())
+    rest = match.group(2)
+
+    if op == "IS NULL" or op == "IS NOT NULL":
+        if rest:
+            raise ValueError(
+                "Filter not recognized: " + filter_str
+            )
+        return None if op == "IS NULL" else {"!=": None}
+
+    if op == "IN" or op == "NOT IN":
+        if not (rest.startswith("(") and rest.endswith(")")):
+            raise ValueError(
+                "IN filter values must be in parentheses: " + filter_str
+            )
+        values = []
+        for token in FILTER_TOKEN_RE.finditer(rest[1:-1]):
+            if token.group(1) is not None:
+                values.append(token.group(1))
+            elif token.group(2) is not None:
+                values.append(token.group(2))
+            else:
+                values.append(parse_filter_literal(token.group(3)))
+        return values if op == "IN" else {"not in": values}
+
+    if not rest:
+        raise ValueError(
+            "Filter has no value: " + filter_str
+        )
+    value = parse_filter_literal(rest)
+    if op in ("=", "=="):
+        return value
+    return {op: value}
+
+
+def normalize_filter(value) -> list:
+    """Convert a filter specification to a list of filter_clause values.
+
+    Accepts the filter strings used in query_printout.py (a string
+    or a list of strings, all of which must hold) as well as values
+    already in the form taken by filter_clause. A string or list of
+    strings in which none starts with an operator is taken as a
+    value (or list of values) to match; otherwise every string
+    must parse as a filter, and parse errors are raised.
+
+    Parameters:
+        value :
+            filter specification for one field
+
+    Returns:
+        criteria (list) :
+            filter_clause values, all of which must hold
+    """
+    if isinstance(value, str):
+        value = [value]
+        single = True
+    else:
+        single = False
+    if (isinstance(value, list) and value
+            and all(isinstance(v, str) for v in value)
+            and any(FILTER_OP_RE.match(v) for v in value)):
+        return [parse_filter(v) for v in value]
+    if single:
+        return value
+    return [value]
+
+
+def resolve_field(field) -> str:
+    """Find the ORM table a query field belongs to.
+
+    If a field is in multiple tables, only the first one (in ORM
+    order) is used, as in query_printout.py.
+
+    Parameters:
+        field (str) :
+            column name
+
+    Returns:
+        table (str) :
+            table name
+    """
+    for table, table_obj in dborm.Base.metadata.tables.items():
+        if field in table_obj.columns.keys():
+            return table
+    raise KeyError(
+        "Field not present in any database table: " + field
+    )
+
+
 def key_store_compare(
     comp_dict,
     db_dict,
@@ -781,7 +1362,7 @@ def entry_update(dbconn, table, dbkeys, comp_table) -> list:
         to_add (list of dicts) : 
             new entries not in db to add
     """
-    db_dump = dbconn.reflect_table(table)
+    db_dump = dbconn.reflect_table(table, columns=dbkeys)
       
     db_dump = format_for_db_add(dbconn,db_dump)
     db_table = Metatable(db_dump)
@@ -798,6 +1379,62 @@ def entry_update(dbconn, table, dbkeys, comp_table) -> list:
     return entries_to_add
 
 
+def sync_rows(dbconn, table, dbkeys, rows) -> dict:
+    """Make a table hold exactly the given rows, changing only the delta.
+
+    Rows are compared to the current table on the given keys (as
+    strings). Rows missing from the table are inserted and table
+    rows not in the new set, including duplicates, are deleted,
+    all in one transaction, so readers never see a partly
+    rebuilt table.
+
+    Parameters:
+        dbconn (dbnascentConnection object) :
+            current db connection
+
+        table (str) :
+            table to update; must have an id primary key
+
+        dbkeys (list) :
+            keys identifying a row
+
+        rows (list of dicts) :
+            full new contents of the table
+
+    Returns:
+        changes (dict) :
+            numbers of rows "added" and "deleted"
+    """
+    table_obj = dbconn.get_table(table)
+    new_rows = {}
+    for row in rows:
+        key = tuple(str(row[dbkey]) for dbkey in dbkeys)
+        new_rows.setdefault(key, row)
+
+    with dbconn.engine.begin() as conn:
+        current = conn.execute(sql.select(
+            table_obj.c.id, *[table_obj.c[dbkey] for dbkey in dbkeys]
+        ).order_by(table_obj.c.id).with_for_update()).fetchall()
+        present = set()
+        to_delete = []
+        for row in current:
+            key = tuple(str(value) for value in row[1:])
+            if key in new_rows and key not in present:
+                present.add(key)
+            else:
+                to_delete.append(row[0])
+        to_add = [row for key, row in new_rows.items() if key not in present]
+
+        for i in range(0, len(to_delete), 1000):
+            conn.execute(table_obj.delete().where(
+                table_obj.c.id.in_(to_delete[i:i + 1000])
+            ))
+        if to_add:
+            conn.execute(table_obj.insert(), to_add)
+
+    return {"added": len(to_add), "deleted": len(to_delete)}
+
+
 def db_round(value_to_round) -> float:
     """Round values appropriately for input into database.
 
@@ -823,6 +1460,117 @@ def db_round(value_to_round) -> float:
         return round(value_to_round, 5)
 
 
+# Condition fields in conditions table order; treatment syntax is
+# "treatment(conc_intens)" and time syntax "start,end,unit", with
+# one entry per condition separated by ";"
+CONDITION_FIELDS = [
+    "condition_type", "treatment", "conc_intens", "start_time",
+    "end_time", "time_unit", "duration", "duration_unit",
+]
+Condition = namedtuple("Condition", CONDITION_FIELDS)
+NO_TREATMENT = Condition("no treatment", None, None, None, None, None,
+                         None, None)
+TREATMENT_RE = re.compile(r"^([^()]*)(?:\(([^()]*)\)\s*)?$")
+TIME_RE = re.compile(r"^\s*(-?\d+)\s*,\s*(-?\d+)\s*,\s*([A-Za-z]+)\s*$")
+
+# Parsed conditions: (condition_type, treatment, time) -> Condition,
+# so identical conditions across samples and papers share one object
+_condition_cache = {}
+
+
+def parse_condition(cond_type, treatment, time) -> tuple:
+    """Parse one condition of a sample.
+
+    Parameters:
+        cond_type (str) :
+            condition type
+
+        treatment (str) :
+            treatment, optionally followed by (conc_intens)
+
+        time (str) :
+            start,end,unit; anything without a comma means no times
+
+    Returns:
+        condition (Condition namedtuple) :
+            typed condition, shared with every identical condition
+    """
+    key = (cond_type, treatment, time)
+    condition = _condition_cache.get(key)
+    if condition is not None:
+        return condition
+
+    treatment_match = TREATMENT_RE.match(treatment)
+    if treatment_match is None:
+        raise SyntaxError("bad treatment syntax: " + repr(treatment))
+    if "," in time:
+        time_match = TIME_RE.match(time)
+        if time_match is None:
+            raise SyntaxError("bad time syntax: " + repr(time))
+        start, end, unit = time_match.groups()
+        duration, duration_unit = duration_calc([start, end, unit])
+        times = (int(start), int(end), unit, int(duration), duration_unit)
+    else:
+        times = (None, None, None, None, None)
+
+    condition = Condition(
+        cond_type, treatment_match.group(1), treatment_match.group(2),
+        *times
+    )
+    return _condition_cache.setdefault(key, condition)
+
+
+def parse_conditions(samples) -> list:
+    """Parse the condition syntax of all samples.
+
+    Syntax errors of every sample are collected and raised
+    together, with the row position of each sample.
+
+    Parameters:
+        samples (list of dicts) :
+            list of dicts from metatable, with sample_id,
+            condition_type, treatment and times
+
+    Returns:
+        sample_conds (list of tuples) :
+            (sample_id, Condition namedtuple) for each condition
+            of each sample
+    """
+    sample_conds = []
+    errors = []
+    for row, sample in enumerate(samples, start=1):
+        if not sample["treatment"]:
+            sample_conds.append((sample["sample_id"], NO_TREATMENT))
+            continue
+
+        cond_types = (sample["condition_type"] or "").split(";")
+        treatments = sample["treatment"].split(";")
+        times = (sample["times"] or "").split(";")
+        where = ("row " + str(row) + " (" + str(sample.get("sample_name"))
+                 + ", " + str(sample.get("paper_name")) + "): ")
+        if not len(cond_types) == len(treatments) == len(times):
+            errors.append(
+                where + str(len(cond_types)) + " condition types, "
+                + str(len(treatments)) + " treatments, "
+                + str(len(times)) + " times"
+            )
+            continue
+
+        for cond_type, treatment, time in zip(cond_types, treatments, times):
+            try:
+                condition = parse_condition(cond_type, treatment, time)
+            except SyntaxError as err:
+                errors.append(where + err.msg)
+                continue
+            sample_conds.append((sample["sample_id"], condition))
+
+    if errors:
+        raise SyntaxError(
+            "Treatment parsing errors:\n" + "\n".join(errors)
+        )
+    return sample_conds
+
+
 def condition_processing(samples) -> list:
     """Parse condition syntax.
 
@@ -835,59 +1583,10 @@ def condition_processing(samples) -> list:
             list of dicts parsed correctly for database
     """
     cond_parsed = []
-    for cond in samples:
-        if cond["treatment"]:
-            cond_types = cond["condition_type"].split(";")
-            treatments = cond["treatment"].split(";")
-            times = cond["times"].split(";")
-
-            # Check if lengths are equivalent
-            if (len(cond_types) != len(treatments)) or (len(cond_types) != len(times)):
-                raise SyntaxError("Treatment parsing error: " + cond["paper_name"])
-
-            for i in range(len(cond_types)):
-                new_cond = dict()
-                new_cond["sample_id"] = cond["sample_id"]
-                treatment = treatments[i].split("(")
-                time = times[i].split(",")
-                new_cond["condition_type"] = cond_types[i]
-                new_cond["treatment"] = treatment[0]
-                if len(treatment) > 1:
-                    new_cond["conc_intens"] = treatment[1].split(")")[0]
-                else:
-                    new_cond["conc_intens"] = None
-
-                if len(time) > 1:
-                    new_cond["start_time"] = int(time[0])
-                    new_cond["end_time"] = int(time[1])
-                    new_cond["time_unit"] = time[2]
-
-                    # Calculate duration and units
-                    duration_list = duration_calc(time)
-                    new_cond["duration"] = int(duration_list[0])
-                    new_cond["duration_unit"] = duration_list[1]
-                else:
-                    new_cond["start_time"] = None
-                    new_cond["end_time"] = None
-                    new_cond["time_unit"] = None
-                    new_cond["duration"] = None
-                    new_cond["duration_unit"] = None
-
-                cond_parsed.append(new_cond)
-
-        # If no treatment, store empty values
-        else:
-            new_cond = dict()
-            new_cond["sample_id"] = cond["sample_id"]
-            new_cond["condition_type"] = "no treatment"
-            new_cond["treatment"] = None
-            new_cond["conc_intens"] = None
-            new_cond["start_time"] = None
-            new_cond["end_time"] = None
-            new_cond["time_unit"] = None
-            new_cond["duration"] = None
-            new_cond["duration_unit"] = None
-            cond_parsed.append(new_cond)
+    for sample_id, condition in parse_conditions(samples):
+        new_cond = {"sample_id": sample_id}
+        new_cond.update(condition._asdict())
+        cond_parsed.append(new_cond)
 
     return cond_parsed
 
@@ -945,7 +1644,34 @@ def duration_calc(time_list) -> list:
     return duration_list
 
 
-def merge_list_accum(merge_file_list) -> list:
+def key_id_map(rows, keys) -> dict:
+    """Index database rows by their key values.
+
+    Values are compared as strings, as in key_store_compare,
+    with None and "" treated alike.
+
+    Parameters:
+        rows (list of dicts) :
+            rows with "id" and the keys (usually formatted with
+            format_for_db_add)
+
+        keys (list) :
+            keys identifying a row
+
+    Returns:
+        ids (dict) :
+            tuple of key values as strings -> id
+    """
+    ids = {}
+    for row in rows:
+        key = tuple(
+            "" if row[k] is None else str(row[k]) for k in keys
+        )
+        ids[key] = row["id"]
+    return ids
+
+
+def merge_list_accum(merge_file_list) -> set:
     """Scrape master merge lists for paper_id values.
 
     Parameters:
@@ -953,25 +1679,72 @@ def merge_list_accum(merge_file_list) -> list:
             list of files to scrape
 
     Returns:
-        merge_ids (list) :
-            list of paper_id values incl in master merges
+        merge_ids (set) :
+            paper_id values incl in master merges
     """
     if len(merge_file_list) == 0:
         raise FileNotFoundError(
             "Merge lists do not exist at the provided paths"
         )
 
-    merge_ids = []
+    merge_ids = set()
     for mergefile in merge_file_list:
        with open(mergefile) as f:
            for line in f:
-               paper_id = tuple(line.strip().split("/"))[3]
-               if paper_id not in merge_ids:
-                   merge_ids.append(paper_id)
+               if line.strip():
+                   merge_ids.add(line.strip().split("/")[3])
 
     return merge_ids
 
 
+def merge_membership_rows(merge_files) -> list:
+    """Scrape master merge lists into mergeMembership rows.
+
+    Parameters:
+        merge_files (dict) :
+            (genome, caller) -> path to master merge list
+
+    Returns:
+        rows (list of dicts) :
+            one row per paper, genome and caller
+    """
+    rows = []
+    for (genome, caller), mergefile in sorted(merge_files.items()):
+        for paper_id in sorted(merge_list_accum([mergefile])):
+            rows.append({
+                "paper_name": paper_id,
+                "genome": genome,
+                "caller": caller,
+            })
+    return rows
+
+
+def merge_membership(dbconn, paper_id) -> dict:
+    """Look up which master merges include a paper.
+
+    Parameters:
+        dbconn (dbnascentConnection object) :
+            current db connection
+
+        paper_id (str) :
+            paper identifier
+
+    Returns:
+        merge_ids (dict) :
+            caller -> set of paper_id values incl in that
+            caller's master merges, holding at most this paper
+    """
+    rows = dbconn.reflect_table(
+        "mergeMembership",
+        filter_crit={"paper_name": [paper_id]},
+        columns=["caller"],
+    )
+    merge_ids = {"tfit": set(), "dreg": set()}
+    for row in rows:
+        merge_ids.setdefault(row["caller"], set()).add(paper_id)
+    return merge_ids
+
+
 def scrape_fastqc(paper_id,
     sample_name,
     data_path,
@@ -1560,6 +2333,162 @@ def add_version_info(
     return ver_table
 
 
+# Loaded bidir summaries: (paths, file mtimes) -> BidirSummary
+_bidir_summary_cache = {}
+
+
+class BidirSummary:
+    """Per-sample tfit and dreg summary stats of a paper.
+
+    The summary files are read once, numeric columns are parsed
+    to ints and floats, and stats are indexed by sample_name.
+
+    Attributes:
+        stats (dict) :
+            sample_name -> {bidir summary key: typed value} for
+            every caller with a summary file
+
+        callers (list) :
+            callers summarized
+
+    Methods:
+        load(data_path, paper_id) -> BidirSummary :
+            Loads a paper's summary files, reusing an earlier load
+            if the files have not changed
+
+        sample_stats(sample_name) -> dict :
+            Stats of one sample, with None for missing values
+
+        attach(samples, merge_ids, dbkeys) -> Metatable :
+            Adds stats and master merge flags to samples
+    """
+
+    callers = ["tfit", "dreg"]
+
+    def __init__(self, summary_paths):
+        """Read and index bidir summary files.
+
+        Parameters:
+            summary_paths (dict) :
+                caller -> path to summary file; missing files
+                give null stats
+        """
+        self.callers = list(summary_paths)
+        self.stats = {}
+        for caller, summary_path in summary_paths.items():
+            if not os.path.exists(summary_path):
+                continue
+            with open(summary_path, newline="") as f:
+                for row in csv.DictReader(f, delimiter="\t"):
+                    stats = self.stats.setdefault(row["sample_name"], {})
+                    for key in self.summary_keys(caller):
+                        stats[key] = self._parse(key, row.get(key))
+
+    @classmethod
+    def load(cls, data_path, paper_id):
+        """Load the tfit and dreg summaries of a paper.
+
+        Parameters:
+            data_path (str) :
+                path to data directory
+
+            paper_id (str) :
+                paper identifier
+
+        Returns:
+            summary (BidirSummary object) :
+                indexed summaries, shared between calls while the
+                files are unchanged
+        """
+        summary_paths = {
+            caller: (data_path + str(paper_id) + "/bidir_summary/"
+                     + caller + "_stats.txt")
+            for caller in cls.callers
+        }
+        cache_key = tuple(
+            (path, os.path.getmtime(path) if os.path.exists(path) else None)
+            for path in summary_paths.values()
+        )
+        if cache_key not in _bidir_summary_cache:
+            _bidir_summary_cache[cache_key] = cls(summary_paths)
+        return _bidir_summary_cache[cache_key]
+
+    @staticmethod
+    def summary_keys(caller) -> list:
+        """List the summary keys of one caller."""
+        return [
+            "num_" + caller + "_bidir",
+            "num_" + caller + "_bidir_promoter",
+            "num_" + caller + "_bidir_exonic",
+            "num_" + caller + "_bidir_intronic",
+            "num_" + caller + "_bidir_intergenic",
+            caller + "_bidir_gc",
+        ]
+
+    @staticmethod
+    def _parse(key, value):
+        """Parse one summary value to int (counts) or float (GC)."""
+        if value is None or value.strip() in ("", "NA", "None"):
+            return None
+        if key.endswith("_gc"):
+            return float(value)
+        return int(float(value))
+
+    def sample_stats(self, sample_name) -> dict:
+        """Get the summary stats of one sample.
+
+        Parameters:
+            sample_name (str) :
+                sample name
+
+        Returns:
+            stats (dict) :
+                bidir summary key -> value for every caller,
+                None where the sample has no summary
+        """
+        stats = self.stats.get(sample_name, {})
+        return {
+            key: stats.get(key)
+            for caller in self.callers
+            for key in self.summary_keys(caller)
+        }
+
+    def attach(self, samples, merge_ids, dbkeys) -> Metatable:
+        """Add summary stats and master merge flags to samples.
+
+        Parameters:
+            samples (metatable object) :
+                object to which to add bidir summary data
+
+            merge_ids (dict) :
+                caller -> set of paper_id values incl in that
+                caller's master merges
+
+            dbkeys (list) :
+                db bidir keys
+
+        Returns:
+            samples (metatable object) :
+                object with bidir data appended
+        """
+        for sample in samples.data:
+            # Metatable values are strings until format_for_db_add
+            for key, value in self.sample_stats(
+                sample["sample_name"]
+            ).items():
+                sample[key] = None if value is None else str(value)
+            for caller in self.callers:
+                if sample["paper_name"] in merge_ids.get(caller, ()):
+                    sample[caller + "_master_merge_incl"] = "1"
+                else:
+                    sample[caller + "_master_merge_incl"] = "0"
+            for bidirkey in dbkeys:
+                if bidirkey in sample.keys():
+                    sample[bidirkey] = str(sample[bidirkey])
+
+        return samples
+
+
 def add_bidir_info(
     samples,
     summary_path,
@@ -1569,6 +2498,9 @@ def add_bidir_info(
 ) -> Metatable:
     """Find tfit/dreg summary info for a paper.
 
+    Prefer BidirSummary.load(...).attach(...), which adds both
+    callers in one pass.
+
     Parameters:
         samples (metatable object):
             object to which to add bidir summary data
@@ -1579,8 +2511,8 @@ def add_bidir_info(
         caller (str) :
             which bidir caller ("tfit" or "dreg")
 
-        merge_ids (list) :
-            list of paper_id values incl in master merges
+        merge_ids (set) :
+            paper_id values incl in master merges
 
         dbkeys (list) :
             db bidir keys
@@ -1589,39 +2521,7 @@ def add_bidir_info(
         samples (metatable object) :
             object with bidir data appended
     """
-    if os.path.exists(summary_path):
-        summary = Metatable(summary_path)
-    else:
-        summary = Metatable([])
-
-    for sample in samples.data:
-        key_store_compare(
-            sample,
-            summary.data,
-            ["sample_name",],
-            [
-                "num_" + caller +"_bidir",
-                "num_" + caller +"_bidir_promoter",
-                "num_" + caller +"_bidir_exonic",
-                "num_" + caller +"_bidir_intronic",
-                "num_" + caller +"_bidir_intergenic",
-                caller + "_bidir_gc",
-            ],
-            addnull=True,
-        )
-        # Format proportion correctly
-        if sample[caller + "_bidir_gc"]:
-            sample[caller + "_bidir_gc"] = str(float(sample[caller + "_bidir_gc"]))
-    
-        # Add master file info
-        if sample["paper_name"] in merge_ids:
-            sample[caller + "_master_merge_incl"] = "1"
-        else:
-            sample[caller + "_master_merge_incl"] = "0"
-        for bidirkey in dbkeys:
-            if bidirkey in sample.keys():
-                sample[bidirkey] = str(sample[bidirkey])
-
-    return samples
+    summary = BidirSummary({caller: summary_path})
+    return summary.attach(samples, {caller: merge_ids}, dbkeys)
 
 # dbutils.py ends here
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+#
+# Filename: index_advisor.py
+# Description: Check query plans and suggest database indexes
+# Authors: Lynn Sanford <lynn.sanford@colorado.edu>
+#
+
+# Commentary:
+#
+# This file contains code for running common DBNascent queries
+# under EXPLAIN, reporting full table scans and temporary
+# table/filesort use, and suggesting composite indexes
+#
+# Parameters:
+#
+# Optionally takes one or more YAML/JSON query spec files
+# (see dbquery.py) to check instead of the default query set
+# in dbadvisor.py
+#
+
+# Code:
+
+# Import
+import sys, os
+sys.path.append(os.path.join(os.path.dirname(__file__), '.', 'global_files'))
+import dbadvisor
+import dbquery
+import dbutils
+
+# Load config file and connect to db
+config = dbutils.load_config(
+    "/home/lsanford/DBNascent-build/config/config_query.txt")
+db_url = config["file_locations"]["database"]
+creds = config["file_locations"]["credentials"]
+dbconnect = dbutils.dbnascentConnection(db_url, creds)
+
+# Collect queries to check
+if len(sys.argv) > 1:
+    query_specs = []
+    for spec_path in sys.argv[1:]:
+        query_specs.extend(dbquery.load_query_specs(spec_path))
+else:
+    query_specs = dbadvisor.CANONICAL_QUERIES
+
+# Explain queries as query_printout.py would run them
+use_wide = dbquery.sample_wide_current(dbconnect)
+reports = dbadvisor.advise(dbconnect, query_specs, use_wide)
+print(dbadvisor.format_report(reports, dbconnect.engine.dialect))
+
+# index_advisor.py ends here
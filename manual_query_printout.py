@@ -14,11 +14,10 @@
 # Code:
 
 # Import
-import csv
-import sqlalchemy as sql
 import sys, os
 sys.path.append(os.path.join(os.path.dirname(__file__), '.', 'global_files'))
-import dborm
+import dbcache
+import dbexport
 import dbutils
 
 # Load config file and connect to db
@@ -28,7 +27,15 @@ db_url = config["file_locations"]["database"]
 creds = config["file_locations"]["credentials"]
 dbconnect = dbutils.dbnascentConnection(db_url, creds)
 
+# Reuse results cached since the last build/ingest run, if configured
+if config["file_locations"].get("query_cache"):
+    cache = dbcache.QueryCache(config["file_locations"]["query_cache"])
+else:
+    cache = None
+
 ### User inputs ###
+# For long lists of SRRs or sample names, use sample_lookup.py
+# instead of an IN (...) filter
 outfile = "/Users/lysa8537/db_query_outputs/high_quality_controls.tsv"
 
 db_fields = ["paper_name",
@@ -55,14 +62,8 @@ query_build = 'SELECT paper_name,sample_name,cell_type,sample_qc_score,condition
 
 ### Query database and print results
 
-results = dbconnect.session.execute(sql.text(query_build)).fetchall()
-
-# Write out results of query (and query itself)
-with open(outfile, "w") as f:
-    w = csv.writer(f, delimiter='\t')
-    w.writerow(db_fields)
-    for data in results:
-        w.writerow(data)
-
-with open(outfile[0:-4] + "_query.txt", "w") as f:
-    f.write(query_build)
+# Stream results into the output file (format set by extension:
+# .tsv, .tsv.gz, .parquet or .arrow) and record the query itself
+dbexport.export_query(
+    dbconnect, query_build, outfile, columns=db_fields, cache=cache
+)
@@ -10,15 +10,24 @@
 # This file contains code for setting up MYSQL query
 # in order to query Dowell Lab Nascent Database
 #
+# Parameters:
+#
+# Optionally takes one or more YAML/JSON query spec files
+# (see dbquery.py), each holding one query or a list of
+# queries with fields, filters and outfile. All queries are
+# run over one database connection. With no arguments, the
+# user input variables below are used.
+#
 
 # Code:
 
 # Import
-import csv
-import sqlalchemy as sql
 import sys, os
 sys.path.append(os.path.join(os.path.dirname(__file__), '.', 'global_files'))
-import dborm
+import dbcache
+import dbexport
+import dbquery
+import dbsearch
 import dbutils
 
 ### User input variables ###
@@ -98,8 +107,18 @@ user_filter_fields = {
 outfile = "/home/lsanford/db_query_outputs/paper_list.tsv"
 
 
-### Determine which search fields are from which tables
-### If a field is in multiple tables, only the first one is used
+### Collect queries to run
+if len(sys.argv) > 1:
+    query_specs = []
+    for spec_path in sys.argv[1:]:
+        query_specs.extend(dbquery.load_query_specs(spec_path))
+else:
+    query_specs = [{
+        "fields": user_query_fields,
+        "filters": user_filter_fields,
+        "outfile": outfile,
+        "distinct": True,
+    }]
 
 # Load config file and connect to db
 config = dbutils.load_config(
@@ -108,101 +127,32 @@ db_url = config["file_locations"]["database"]
 creds = config["file_locations"]["credentials"]
 dbconnect = dbutils.dbnascentConnection(db_url, creds)
 
-# Find and store all tables and fields necessary for query
-db_query_fields = {}
-db_filter_fields = {}
-tables_to_join = []
-query_join_keys = dict(config["query_join_keys"])
-db_tables = dict(dborm.Base.metadata.tables)
-
-for table in db_tables.keys():
-    for field in user_query_fields:
-        if field in db_tables[table].columns.keys():
-            # If a field is found in an ORM table object,
-            # store the field with table name attached
-            if field not in db_query_fields.keys():
-                db_query_fields[field] = table + "." + field
-                # If that table is not already on the list of
-                # tables to join, add it
-                if table not in tables_to_join:
-                    if table == "tissues" or table == "organisms":
-                        if "genetics" not in tables_to_join:
-                            tables_to_join.append("genetics")
-                    elif table == "sampleEquiv":
-                        if "samples" not in tables_to_join:
-                            tables_to_join.append("samples")
-                    if table not in query_join_keys["existing"]:
-                        tables_to_join.append(table)
-    for filtkey in user_filter_fields:
-        if filtkey in db_tables[table].columns.keys():
-            if filtkey not in db_filter_fields.keys():
-                db_filter_fields[filtkey] = table + "." + filtkey
-            if table not in tables_to_join:
-                if table == "tissues" or table == "organisms":
-                    if "genetics" not in tables_to_join:
-                        tables_to_join.append("genetics")
-                elif table == "sampleEquiv":
-                    if "samples" not in tables_to_join:
-                        tables_to_join.append("samples")
-                if table not in query_join_keys["existing"]:
-                    tables_to_join.append(table)
-
-### Build raw SQlite query string
-
-# Initialize query string
-query_build = (
-    "SELECT DISTINCT "
-)
-
-# Add all query fields
-i = 0
-for field in db_query_fields:
-    if i == 0:
-        query_build = query_build + db_query_fields[field]
-        i = 1
-    else:
-        query_build = query_build + ", " + db_query_fields[field]
+# Reuse results cached since the last build/ingest run, if configured
+if config["file_locations"].get("query_cache"):
+    cache = dbcache.QueryCache(config["file_locations"]["query_cache"])
+else:
+    cache = None
 
-# Add all tables
-query_build = (
-    query_build
-    + " FROM linkIDs"
-)
-
-for table in tables_to_join:
-    query_build = query_build + " " + query_join_keys[table.lower()]
-
-# Add all filters
-i = 0
-for filtkey in user_filter_fields.keys():
-    for value in user_filter_fields[filtkey]:
-        if i == 0:
-            query_build = (query_build + 
-                           " WHERE " + 
-                           db_filter_fields[filtkey] + 
-                           " " + 
-                           str(value)
-                          )
-            i = 1
-        else:
-            query_build = (query_build + 
-                           " AND " + 
-                           db_filter_fields[filtkey] + 
-                           " " + 
-                           str(value)
-                          )
+# Read the denormalized sampleWide table instead of joining
+# when it covers a query and is up to date
+use_wide = dbquery.sample_wide_current(dbconnect)
 
+# Translate filter values such as "human" or "hek293" to the values
+# stored in the database, using the searchEquiv table
+resolver = dbsearch.SearchResolver.from_db(dbconnect)
 
 ### Query database and print results
-
-results = dbconnect.session.execute(sql.text(query_build)).fetchall()
-
-# Write out results of query (and query itself)
-with open(outfile, "w") as f:
-    w = csv.writer(f, delimiter='\t')
-    w.writerow((list(db_query_fields.keys())))
-    for data in results:
-        w.writerow(data)
-
-with open(outfile[0:-4] + "_query.txt", "w") as f:
-    f.write(query_build)
+for spec in query_specs:
+    query = dbquery.build_query(
+        spec["fields"], spec["filters"], spec["distinct"], use_wide,
+        resolver,
+    )
+    for field, term, translated in resolver.pop_translations():
+        print(field + ": " + str(term) + " -> " + str(translated))
+    for field, term, closest in resolver.pop_unmatched():
+        print(field + ": " + str(term) + " not found; closest: "
+              + ", ".join(closest))
+
+    # Stream results into the output file (format set by extension:
+    # .tsv, .tsv.gz, .parquet or .arrow) and record the query itself
+    dbexport.export_query(dbconnect, query, spec["outfile"], cache=cache)
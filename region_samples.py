@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+#
+# Filename: region_samples.py
+# Description: Find samples with bidir calls overlapping regions
+# Authors: Lynn Sanford <lynn.sanford@colorado.edu>
+#
+
+# Commentary:
+#
+# This file contains code for finding the samples with a tfit or
+# dREG call overlapping each region in a BED file, using the
+# interval index saved at the end of each build (see
+# dbintervals.py), and writing them out with their metadata.
+#
+# Parameters:
+#
+# 1. Genome build (hg38 or mm10)
+# 2. Bidir caller (tfit or dreg)
+# 3. BED file of regions
+# 4. Output file (tab-delimited)
+# 5. Optionally, comma-separated fields to return
+#    (default sample_name,paper_name,cell_type)
+#
+
+# Code:
+
+# Import
+import sys, os
+sys.path.append(os.path.join(os.path.dirname(__file__), '.', 'global_files'))
+import csv
+import dbintervals
+import dbutils
+
+if len(sys.argv) < 5:
+    sys.exit(
+        "Usage: region_samples.py <genome> <tfit|dreg> <region BED> "
+        "<output file> [fields]"
+    )
+genome = sys.argv[1]
+caller = sys.argv[2]
+region_file = sys.argv[3]
+outfile = sys.argv[4]
+fields = sys.argv[5].split(",") if len(sys.argv) > 5 else None
+
+# Load config file and connect to db
+config = dbutils.load_config(
+    "/home/lsanford/DBNascent-build/config/config_query.txt")
+files = config["file_locations"]
+dbconnect = dbutils.dbnascentConnection(files["database"], files["credentials"])
+
+index = dbintervals.IntervalIndex.load(
+    files["interval_index"].format(genome=genome, caller=caller)
+)
+regions = dbintervals.read_region_file(region_file)
+
+nrows = 0
+with open(outfile, "w", newline="") as f:
+    w = csv.writer(f, delimiter="\t", lineterminator="\n")
+    w.writerow(["chrom", "start", "end"]
+               + (fields or dbintervals.REGION_FIELDS))
+    for row in dbintervals.region_samples(dbconnect, index, regions, fields):
+        w.writerow(["" if value is None else value for value in row])
+        nrows = nrows + 1
+print(str(len(regions)) + " regions, " + str(nrows) + " rows written")
+
+# region_samples.py ends here
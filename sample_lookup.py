@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+#
+# Filename: sample_lookup.py
+# Description: Look up samples for a list of SRRs or sample names
+# Authors: Lynn Sanford <lynn.sanford@colorado.edu>
+#
+
+# Commentary:
+#
+# This file contains code for resolving a list of SRR accessions
+# or sample names to samples, papers and cell types. The list is
+# joined to the database on the server through a temporary table,
+# so it can be any length. Results are written in input order,
+# with found = False for identifiers that matched no sample.
+#
+# Parameters:
+#
+# 1. File with one SRR or sample name per line
+# 2. Output file (.tsv, .tsv.gz, .parquet or .arrow)
+# 3. Optionally, identifier type: srr (default) or sample_name
+# 4. Optionally, comma-separated fields to return
+#    (default sample_name,paper_name,cell_type)
+#
+
+# Code:
+
+# Import
+import sys, os
+sys.path.append(os.path.join(os.path.dirname(__file__), '.', 'global_files'))
+import dbexport
+import dbutils
+
+if len(sys.argv) < 3:
+    sys.exit(
+        "Usage: sample_lookup.py <identifier file> <output file> "
+        "[srr|sample_name] [fields]"
+    )
+id_file = sys.argv[1]
+outfile = sys.argv[2]
+key = sys.argv[3] if len(sys.argv) > 3 else "srr"
+fields = sys.argv[4].split(",") if len(sys.argv) > 4 else None
+
+# Load config file and connect to db
+config = dbutils.load_config(
+    "/home/lsanford/DBNascent-build/config/config_query.txt")
+db_url = config["file_locations"]["database"]
+creds = config["file_locations"]["credentials"]
+dbconnect = dbutils.dbnascentConnection(db_url, creds)
+
+# Read identifiers, skipping blank lines
+with open(id_file) as f:
+    identifiers = [line.strip() for line in f if line.strip()]
+
+nrows = dbexport.export_lookup(dbconnect, identifiers, outfile, fields, key)
+print(str(len(identifiers)) + " identifiers, " + str(nrows) + " rows written")
+
+# sample_lookup.py ends here
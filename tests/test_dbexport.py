@@ -0,0 +1,79 @@
+"""Tests for columnar export of raw SQL results.
+
+Filename: test_dbexport.py
+Authors: Lynn Sanford <lynn.sanford@colorado.edu>
+
+Commentary:
+    Raw SQL queries (manual_query_printout.py) take their Arrow types
+    from the ORM by column name, but MySQL returns TINYINT booleans
+    as ints and aggregates as Decimal. These check that such values
+    are written as the ORM types instead of failing in pyarrow.
+
+Classes:
+    ArrowExportTests
+"""
+
+from decimal import Decimal
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append(
+    os.path.join(os.path.dirname(__file__), "..", "global_files")
+)
+import dbexport
+
+try:
+    import pyarrow.ipc
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+COLUMNS = ["unusable", "rcomp", "map_prop", "sample_qc_score"]
+ROWS = [
+    (1, 0, Decimal("0.25"), Decimal("3")),
+    (0, None, None, 2),
+    (True, 1, 1, None),
+]
+EXPECTED = {
+    "unusable": [True, False, True],
+    "rcomp": [False, None, True],
+    "map_prop": [0.25, None, 1.0],
+    "sample_qc_score": [3, 2, None],
+}
+
+
+@unittest.skipIf(pq is None, "pyarrow is not installed")
+class ArrowExportTests(unittest.TestCase):
+    """Write driver-typed raw SQL rows as Parquet and Arrow."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        query = "SELECT " + ", ".join(COLUMNS) + " FROM samples"
+        self.types = dbexport.column_types(query, COLUMNS)
+
+    def write(self, name):
+        outfile = os.path.join(self.tmpdir.name, name)
+        writer = dbexport._ArrowWriter(
+            outfile, COLUMNS, self.types, dbexport.output_format(outfile)
+        )
+        writer.write(ROWS)
+        writer.close()
+        return outfile
+
+    def test_parquet(self):
+        table = pq.read_table(self.write("out.parquet"))
+        self.assertEqual(table.to_pydict(), EXPECTED)
+
+    def test_arrow(self):
+        with pyarrow.ipc.open_file(self.write("out.arrow")) as reader:
+            table = reader.read_all()
+        self.assertEqual(table.to_pydict(), EXPECTED)
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+# test_dbexport.py ends here